@@ -0,0 +1,199 @@
+import argparse
+import os
+import sys
+import time
+from .Settings import Settings
+from . import Instrumentation
+
+# Exit codes, for cron and schedulers
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+class Timer:
+    """Print the progress of the command, prefixed with the elapsed time."""
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.start = time.perf_counter()
+
+    def log(self, message):
+        if not self.quiet:
+            print(f"[{time.perf_counter() - self.start:8.2f}s] {message}", flush=True)
+
+
+def openWallet(args, settings):
+    from .Wallet import Wallet
+    databaseFilename = args.database or settings.database_filepath
+    return Wallet(apiKey=settings.cryptocompare_api_key or None, databaseFilename=databaseFilename, lazy=True)
+
+
+def checkApiKey(wallet) -> bool:
+    # The prices are requested when the database is saved, fail before doing any work without an API key
+    if wallet.apiKey is None:
+        print("No CryptoCompare API key in the settings, prices can't be requested", file=sys.stderr)
+        return False
+    return True
+
+
+def commandImport(args, settings, timer):
+    from . import Importer
+    from .LoaderCache import LoaderCache
+    wallet = openWallet(args, settings)
+    if not args.dry_run and not checkApiKey(wallet):
+        return EXIT_ERROR
+    dirpath = args.exports or settings.exported_transactions_dirpath
+    exports = Importer.listExports(dirpath, args.exchanges)
+    timer.log(f"Importing {len(exports)} exports from {dirpath}")
+
+    def progress(done, total, path, result, seconds):
+        if isinstance(result, Exception):
+            timer.log(f"[{done}/{total}] FAILED {path}: {result}")
+        else:
+            timer.log(f"[{done}/{total}] Loaded {path} ({len(result)} transactions in {seconds:.2f}s)")
+
+    countBefore = len(wallet.transactions)
+    Importer.importExports(wallet, dirpath, args.exchanges, maxWorkers=args.workers, progress=progress,
+                           cacheDirpath=None if args.no_cache else LoaderCache.DefaultDirpath)
+    timer.log(f"{len(wallet.transactions) - countBefore} new transactions added to the wallet")
+    if args.compact:
+        removed = wallet.compactInterestRows(args.compact)
+        timer.log(f"{removed} rows removed by the compaction of the interests")
+    if not args.dry_run:
+        wallet.save()
+        timer.log("Database saved")
+    return EXIT_OK
+
+
+def commandEnrich(args, settings, timer):
+    wallet = openWallet(args, settings)
+    if not checkApiKey(wallet):
+        return EXIT_ERROR
+    missing = wallet.transactions['price_USD'].isna().sum()
+    timer.log(f"{missing} transactions without USD price")
+    wallet.addUsdData()
+    timer.log(f"{missing - wallet.transactions['price_USD'].isna().sum()} USD prices added")
+    if not args.dry_run:
+        wallet.save()
+        timer.log("Database saved")
+    return EXIT_OK
+
+
+def commandReport(args, settings, timer):
+    import pandas as pd
+    wallet = openWallet(args, settings)
+    summary = wallet.getSummary(args.currency)
+    timer.log("Summary computed")
+    if args.format == 'json':
+        print(summary.to_json(indent=4))
+    elif args.format == 'csv':
+        summary.to_csv(sys.stdout, header=False)
+    else:
+        print(summary.to_string())
+    if args.stats:
+        stats = wallet.getCoinsStats(args.currency)
+        timer.log("Coins stats computed")
+        if args.format == 'json':
+            print(stats.to_json(orient='index', indent=4))
+        elif args.format == 'csv':
+            stats.to_csv(sys.stdout)
+        else:
+            with pd.option_context('display.max_rows', None, 'display.width', 200):
+                print(stats)
+    return EXIT_OK
+
+
+def commandExport(args, settings, timer):
+    import pandas as pd
+    wallet = openWallet(args, settings)
+    outputDirpath = args.output or settings.output_dirpath
+    os.makedirs(outputDirpath, exist_ok=True)
+    if not args.no_excel:
+        stats_filepath = os.path.join(outputDirpath, "stats.xlsx")
+        with pd.ExcelWriter(stats_filepath, engine='openpyxl') as writer:
+            wallet.getSummary().to_excel(writer, sheet_name='Summary')
+            wallet.getCoinsStats().to_excel(writer, sheet_name='Coins Stats')
+            wallet.getWalletsBalance().to_excel(writer, sheet_name='Wallets Balance')
+            wallet.getTransactions(remove_datetime_timezone=True).to_excel(writer, sheet_name='Transactions', index=False)
+        timer.log(f"Excel exported to {stats_filepath}")
+    if not args.no_tradingview:
+        TradingView_filepath = os.path.join(outputDirpath, "TradingView_PineData.txt")
+        wallet.exportTradingView(TradingView_filepath)
+        timer.log(f"TradingView data exported to {TradingView_filepath}")
+    return EXIT_OK
+
+
+def commandInit(args, settings, timer):
+    # The only command writing the settings, the other ones only read them
+    if os.path.exists(args.settings):
+        print(f"The settings file {args.settings} already exists", file=sys.stderr)
+        return EXIT_ERROR
+    settings.save(args.settings)
+    timer.log(f"Default settings written to {args.settings}")
+    return EXIT_OK
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='cryptowallet', description="Headless import, price enrichment and reporting of the CryptoWallet database")
+    parser.add_argument('--settings', default=Settings._default_settings_filepath, help="Settings JSON file (default: %(default)s)")
+    parser.add_argument('--database', help="Database file, instead of the one of the settings")
+    parser.add_argument('--trace', help="Write a JSON trace of the timing spans to this file")
+    parser.add_argument('--profile', help="Profile the command with cProfile, and write the stats to this file")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Don't print the progress")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    initParser = subparsers.add_parser('init', help="Write the settings file with the default values, to edit")
+    initParser.set_defaults(func=commandInit)
+
+    importParser = subparsers.add_parser('import', help="Import the exports of all the exchanges")
+    importParser.add_argument('--exports', help="Folder of the exports, instead of the one of the settings")
+    importParser.add_argument('--exchanges', nargs='+', help="Exchange folders to import (default: all)")
+    importParser.add_argument('--workers', type=int, help="Number of worker processes loading the exports")
+    importParser.add_argument('--dry-run', action='store_true', help="Don't save the database")
+    importParser.add_argument('--no-cache', action='store_true', help="Parse all the exports, even the unchanged ones")
+    importParser.add_argument('--compact', choices=['D', 'W', 'M'], help="Compact the interest rows per day, week or month, the raw rows are kept in the archive")
+    importParser.set_defaults(func=commandImport)
+
+    enrichParser = subparsers.add_parser('enrich', help="Add the missing USD prices")
+    enrichParser.add_argument('--dry-run', action='store_true', help="Don't save the database")
+    enrichParser.set_defaults(func=commandEnrich)
+
+    reportParser = subparsers.add_parser('report', help="Print the summary of the wallet")
+    reportParser.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+    reportParser.add_argument('--stats', action='store_true', help="Also print the statistics per coin")
+    reportParser.add_argument('--currency', default='USD', help="Currency of the values, e.g. CHF or EUR (default: %(default)s)")
+    reportParser.set_defaults(func=commandReport)
+
+    exportParser = subparsers.add_parser('export', help="Export the Excel statistics and the TradingView data")
+    exportParser.add_argument('--output', help="Output folder, instead of the one of the settings")
+    exportParser.add_argument('--no-excel', action='store_true')
+    exportParser.add_argument('--no-tradingview', action='store_true')
+    exportParser.set_defaults(func=commandExport)
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    timer = Timer(args.quiet)
+    if args.trace:
+        Instrumentation.tracer.enable(args.trace)
+    try:
+        settings = Settings.load(args.settings, create_file=False)
+        if args.profile:
+            with Instrumentation.profile(args.profile):
+                code = args.func(args, settings, timer)
+        else:
+            code = args.func(args, settings, timer)
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    timer.log(f"'{args.command}' done")
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
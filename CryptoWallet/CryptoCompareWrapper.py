@@ -1,16 +1,36 @@
 import pandas as pd
 import numpy as np
-from requests_futures.sessions import FuturesSession
-from tqdm import tqdm
+from concurrent.futures import as_completed
+import itertools
 import time
 import os
 import json
-import requests
+from .Transport import HttpTransport, TransportError
+from .PricePanel import PricePanel
+from .Storage import FileLock, atomicWrite
 
 class CryptoCompareWrapper():
     def __init__(self):
         pass
     
+    # Transport used for all the requests to the API. Replace it with setTransport() to record, replay, or use a local stub server.
+    transport = HttpTransport()
+
+    @staticmethod
+    def setTransport(transport):
+        previous = CryptoCompareWrapper.transport
+        CryptoCompareWrapper.transport = transport
+        return previous
+
+    # Memory-mapped matrix of the daily close prices, updated by requestDailyHistoricalPrices(). Opened on first use.
+    pricePanel = None
+
+    @staticmethod
+    def getPricePanel() -> PricePanel:
+        if CryptoCompareWrapper.pricePanel is None:
+            CryptoCompareWrapper.pricePanel = PricePanel()
+        return CryptoCompareWrapper.pricePanel
+
     AssetNameMap = {
         'IOTA': 'MIOTA',
         'MNT': 'MANTLE'
@@ -18,8 +38,22 @@ class CryptoCompareWrapper():
     UnsupportedHistoricalPriceAssets = ['1000PEPPER', 'CHILLGUY', 'UOS', 'HYPE', 'SDM', 'GNET', 'XBG', 'BIO', 'PAWSY', 'WGC']
     UnsupportedCurrentPriceAssets = ['1000PEPPER', 'GNET', 'XBG', 'BIO', 'PAWSY', 'WGC']
     
+    MAX_FSYMS_LENGTH = 300  # Maximum length of the comma separated 'fsyms' parameter of the pricemulti endpoint
+    CurrentPricesWorkers = 8  # Number of batches requested concurrently
+
     @staticmethod
     def requestApiCurrentPrices(assets :pd.Series, apiKey) -> pd.Series:
+        prices = list(CryptoCompareWrapper.iterApiCurrentPrices(assets, apiKey))
+        if not prices:
+            return pd.Series(dtype=float)
+        return pd.concat(prices)
+
+    @staticmethod
+    def iterApiCurrentPrices(assets :pd.Series, apiKey):
+        """Request the current prices of the assets, and yield a Series of prices for each batch as soon as it arrives.
+
+        Batches are requested concurrently over a pooled session, so the wall time is about one round-trip.
+        """
         # Rename assets to match CryptoCompare API
         assets = assets.replace(CryptoCompareWrapper.AssetNameMap)
         
@@ -27,41 +61,62 @@ class CryptoCompareWrapper():
         assets = assets[~assets.isin(CryptoCompareWrapper.UnsupportedCurrentPriceAssets)]
         
         if assets.empty:
-            return pd.Series()
+            return
+
+        assets_batches = CryptoCompareWrapper.batchAssets(assets)
+        AssetNameMap_inverted = {v: k for k, v in CryptoCompareWrapper.AssetNameMap.items()}
+
+        # Request all the batches concurrently, and process them in their order of arrival
+        nWorkers = min(len(assets_batches), CryptoCompareWrapper.CurrentPricesWorkers)
+        with CryptoCompareWrapper.transport.session(max_workers=nWorkers) as session:
+            futures = []
+            for batch in assets_batches:
+                future = CryptoCompareWrapper.__requestApiCurrentPricesBatch(session, batch, apiKey)
+                future.batch = batch
+                futures.append(future)
 
-        # Create batch of assets where the joinded length is less than 300 characters
-        MAX_FSYMS_LENGH = 300
+            try:
+                for future in as_completed(futures):
+                    try:
+                        response = future.result()
+                    except TransportError as e:
+                        raise Exception(f"Request Error to CryptoCompare API : {e}\n")
+                    prices = CryptoCompareWrapper.__parseCurrentPricesResponse(response, future.batch)
+                    # Replace back the original asset names using the AssetNameMap
+                    yield prices.rename(index=AssetNameMap_inverted)
+            finally:
+                # If the caller stops early or an error is raised, don't wait for the pending batches
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def batchAssets(assets, maxLength = MAX_FSYMS_LENGTH) -> list:
+        # Pack the assets in batches whose comma joined length is at most maxLength characters.
+        # The length of the current batch is tracked incrementally, so packing is linear in the number of assets.
         assets_batches = []
         assets_batch = []
+        batch_length = 0
         for asset in assets:
-            batch_length = len(','.join(assets_batch + [asset]))
-
+            # Length of the batch if the asset is appended, including the separating comma
+            new_length = batch_length + len(asset) + (1 if assets_batch else 0)
+            
             # If the batch is too long, append the current batch to the list of batches and start a new batch
-            if batch_length > MAX_FSYMS_LENGH:
-              assets_batches.append(assets_batch.copy())
-              assets_batch.clear()              
-              
+            if new_length > maxLength and assets_batch:
+                assets_batches.append(assets_batch)
+                assets_batch = []
+                new_length = len(asset)
+            
             assets_batch.append(asset)
-          
-        # Append the last batch to the list of batches
-        assets_batches.append(assets_batch) 
-              
-        # Request prices for each batch of assets to th API
-        prices = []
-        for batch in assets_batches:
-            batch_prices = CryptoCompareWrapper.__requestApiCurrentPricesBatch(batch, apiKey)
-            prices.append(batch_prices)
-        prices = pd.concat(prices).squeeze()
-        
-        # Replace back the original asset names using the AssetNameMap
-        AssetNameMap_inverted = {v: k for k, v in CryptoCompareWrapper.AssetNameMap.items()}
-        prices = prices.rename(index=AssetNameMap_inverted)
+            batch_length = new_length
         
-        return prices
+        # Append the last batch to the list of batches
+        if assets_batch:
+            assets_batches.append(assets_batch)
+        return assets_batches
               
     @staticmethod
-    def __requestApiCurrentPricesBatch(assetsBatch, apiKey):
-        api_url = 'https://min-api.cryptocompare.com/data/pricemulti'
+    def __requestApiCurrentPricesBatch(session, assetsBatch, apiKey):
+        api_url = 'data/pricemulti'
         params={
             'fsyms': ','.join(assetsBatch),
             'tsyms':'USD',
@@ -69,10 +124,10 @@ class CryptoCompareWrapper():
             'extraParams':'CryptoWallet',
             'apiKey': apiKey
         }
-        try:
-            response = requests.get(url=api_url,params=params)
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Request Error to CryptoCompare API : {e}\n")
+        return session.get(url=api_url,params=params)
+
+    @staticmethod
+    def __parseCurrentPricesResponse(response, assetsBatch) -> pd.Series:
         if response.status_code != 200:
             raise Exception(f"Request Error to CryptoCompare API : {response.status_code}")
         
@@ -96,16 +151,17 @@ class CryptoCompareWrapper():
             print(f"Unable to get current price for: {missing_assets}")
         
         # Extract prices in data[asset]['USD'] into a pandas Series with asset: price. If the asset is not in the response, enter np.nan as the price.
-        prices = pd.Series({asset: data.get(asset, {}).get('USD', np.nan) for asset in assetsBatch})
+        prices = pd.Series({asset: data.get(asset, {}).get('USD', np.nan) for asset in assetsBatch}, dtype=float)
         
         return prices
     
     @staticmethod
-    def addMissingUsdPrice(transactions, apiKey):
+    def addMissingUsdPrice(transactions, apiKey, progress = None, cancelled = None):
+        # progress(done, total) is called as the candles are received. cancelled() is polled, the requests stop when it returns True.
         if apiKey is None:
             raise Exception("No API key provided, no USD values will be added")
         # Select transactions with missing usd price
-        missingUsdPrice = transactions[transactions['price_USD'].isna()].copy()  # Copy to avoid SettingWithCopyWarning
+        missingUsdPrice = transactions[transactions['price_USD'].isna()]
         # remove the unsuported assets by the api
         missingUsdPrice = missingUsdPrice[~missingUsdPrice['asset'].isin(CryptoCompareWrapper.UnsupportedHistoricalPriceAssets)]
         
@@ -114,63 +170,142 @@ class CryptoCompareWrapper():
         if missingUsdPrice.empty:
             return transactions
 
+        prices = CryptoCompareWrapper.requestHourlyPrices(missingUsdPrice, apiKey, progress, cancelled)
+        prices = prices.dropna()
+        transactions.loc[prices.index, 'price_USD'] = prices
+        return transactions
+
+    HourlyCandlesLimit = 2000  # Maximum number of candles returned by a histohour request
+    HourlyCandlesColumns = ['open', 'high', 'low', 'close', 'volumefrom', 'volumeto']
+
+    @staticmethod
+    def candlePrice(candles: pd.DataFrame) -> pd.Series:
+        # USD price of the transactions of an hourly candle
+        return (candles['high'] + candles['low']) / 2
+
+    @staticmethod
+    def requestHourlyPrices(transactions, apiKey, progress = None, cancelled = None) -> pd.Series:
+        """USD price of the transactions, from the hourly candle of their asset containing their datetime.
+
+        The candles are cached in a CSV file per asset, so only the hours not covered yet are requested to the API, with
+        a request per range of up to HourlyCandlesLimit hours. The requested hours without candle are cached too, as NaN rows.
+        The prices are then joined to the transactions with a merge_asof per asset. NaN if there is no candle, or if it
+        could not be received.
+        """
         # Rename assets to match CryptoCompare API
-        missingUsdPrice['asset'] = missingUsdPrice['asset'].replace(CryptoCompareWrapper.AssetNameMap)
-        
-        # API setup
-        api_url = 'https://min-api.cryptocompare.com/data/v2/histohour'
+        requested = pd.DataFrame({
+            'datetime': transactions['datetime'].astype('datetime64[ns, UTC]'),
+            'asset': transactions['asset'].replace(CryptoCompareWrapper.AssetNameMap),
+        }, index=transactions.index)
+        hours = requested['datetime'].dt.floor('h')
+
+        candles = {}
+        ranges = []
+        for asset, assetHours in hours.groupby(requested['asset']):
+            candles[asset] = CryptoCompareWrapper.readHourlyCandles(asset)
+            uncovered = pd.DatetimeIndex(assetHours.unique()).difference(candles[asset].index)
+            ranges += [(asset, toTs, limit) for toTs, limit in CryptoCompareWrapper.hourlyRanges(uncovered)]
+        print(f"Hourly candles to request: {len(ranges)} ranges for {len(requested)} transactions")
+
+        if ranges:
+            received = CryptoCompareWrapper.requestHourlyCandles(ranges, apiKey, progress, cancelled)
+            for asset, assetCandles in received.items():
+                candles[asset] = CryptoCompareWrapper.saveHourlyCandles(asset, assetCandles)
+
+        # Join each transaction to the last candle started before it, of its asset, within the hour
+        table = pd.concat([assetCandles.assign(asset=asset) for asset, assetCandles in candles.items()])
+        table = pd.DataFrame({'datetime': table.index.astype('datetime64[ns, UTC]'), 'asset': table['asset'].to_numpy(),
+                              'price': CryptoCompareWrapper.candlePrice(table).to_numpy()})
+        left = requested.rename_axis('row').reset_index().sort_values('datetime', kind='stable')
+        joined = pd.merge_asof(left, table.sort_values('datetime', kind='stable'), on='datetime', by='asset', direction='backward',
+                               tolerance=pd.Timedelta(3600 * 10**9 - 1, unit='ns'))
+        return pd.Series(joined['price'].to_numpy(dtype=float), index=joined['row'].to_numpy(), name='price_USD').reindex(transactions.index)
+
+    @staticmethod
+    def hourlyRanges(hours: pd.DatetimeIndex) -> list:
+        # (toTs, limit) of the histohour requests covering the hours, each request returning the limit+1 candles up to toTs
+        seconds = np.sort(hours.as_unit('s').asi8)
+        ranges = []
+        first = 0
+        while first < len(seconds):
+            last = np.searchsorted(seconds, seconds[first] + CryptoCompareWrapper.HourlyCandlesLimit * 3600, side='right') - 1
+            ranges.append((int(seconds[last]), max(1, int(seconds[last] - seconds[first]) // 3600)))
+            first = last + 1
+        return ranges
+
+    @staticmethod
+    def requestHourlyCandles(ranges, apiKey, progress = None, cancelled = None) -> dict:
+        # Candles received for each asset, as a DataFrame indexed by the start time of the candle
+        api_url = 'data/v2/histohour'
         nWorkers = 3
         rate_limit_delay = 1.0 / 50  # 50 calls per second
 
-        with FuturesSession(max_workers=nWorkers) as session:
+        # Count the received responses, as they arrive in the threads of the session
+        received = itertools.count(1)
+        def onReceived(future):
+            progress(next(received), len(ranges))
+
+        candles = {}
+        with CryptoCompareWrapper.transport.session(max_workers=nWorkers) as session:
             futures = []
-             # Submit requests with row indices as metadata
-            for idx, row in missingUsdPrice.iterrows():
+            for asset, toTs, limit in ranges:
+                if cancelled is not None and cancelled():
+                    break
                 future = session.get(
                     url=api_url,
                     params={
-                        'fsym': row['asset'],
+                        'fsym': asset,
                         'tsym':'USD',
-                        'limit':'1',
-                        'toTs':row['datetime'].timestamp(),
+                        'limit': str(limit),
+                        'toTs': toTs,
                         'extraParams':'CryptoWallet',
                         'apiKey':apiKey
                     }
                 )
-                # Attach the index to each future so we know where to place the result
-                future.idx = idx
+                # Attach the requested range to each future so we know where to place the result
+                future.range = (asset, toTs, limit)
+                if progress is not None:
+                    future.add_done_callback(onReceived)
                 futures.append(future)
                 time.sleep(rate_limit_delay)  # Add delay to respect rate limit
             
-            prices = {}
             failedReplies = {}
             
             # Process each completed future
+            from tqdm import tqdm  # Only needed for the progress bar, imported here for a fast startup
             try:
-                for future in tqdm(futures, desc="Fetching prices"):
+                for future in tqdm(futures, desc="Fetching hourly candles"):
+                    if cancelled is not None and cancelled() and not future.done():
+                        continue  # Keep the candles already received, skip the pending requests
                     response = future.result()
+                    asset, toTs, limit = future.range
+                    rangeName = f"{asset} {limit + 1}h to {toTs}"
                     
                     # Check if API request was successful
                     if response.status_code != 200:
                         print(f"Request Error: Status {response.status_code}")
-                        failedReplies[future.idx] = {"status_code": response.status_code}
+                        failedReplies[rangeName] = {"status_code": response.status_code}
                         continue
                         
                     json_data = response.json()
                     # Check if API reponse is not successful
                     if json_data['Response'] != "Success":
                         print(f"API Error {json_data['Type']}: {json_data['Message']}")
-                        failedReplies[future.idx] = json_data
+                        failedReplies[rangeName] = json_data
                         continue
                     
-                    # Extract and calculate the average price
                     try:
-                        data = json_data['Data']['Data'][-1]
-                        avg_price = (data['high'] + data['low']) / 2
-                        prices[future.idx] = avg_price
-                    except (KeyError, IndexError, TypeError) as e:
-                        print(f"Data parsing error for index {future.idx}: {e}")
-                        failedReplies[future.idx] = {"error": str(e)}
+                        data = pd.DataFrame(json_data['Data']['Data'], columns=['time'] + CryptoCompareWrapper.HourlyCandlesColumns)
+                        data = data.set_index(pd.to_datetime(data['time'], unit='s', utc=True).rename('time'))[CryptoCompareWrapper.HourlyCandlesColumns]
+                    except (KeyError, TypeError) as e:
+                        print(f"Data parsing error for {rangeName}: {e}")
+                        failedReplies[rangeName] = {"error": str(e)}
+                        continue
+                    # The requested hours without candle (e.g. before the listing of the asset) are NaN rows, so that
+                    # they are cached as covered and not requested again
+                    hours = pd.date_range(end=pd.Timestamp(toTs, unit='s', tz='UTC'), periods=limit + 1, freq='h', name='time')
+                    data = data.reindex(data.index.as_unit('ns').union(hours.as_unit('ns')))
+                    candles.setdefault(asset, []).append(data.astype(float))
         
             except KeyboardInterrupt: # Stop API request, but don't propagate the exception, to continue the rest of the code
                 print("Interrupt received, stopping API requests...")
@@ -181,26 +316,55 @@ class CryptoCompareWrapper():
                     os.makedirs('log', exist_ok=True)
                     with open('log/apiFailedReply.json', 'w') as logfile:
                         json.dump(failedReplies, logfile, indent=4)
-                
-                # Update the transactions DataFrame with prices
-                price_series = pd.Series(prices)
-                transactions.loc[price_series.index, 'price_USD'] = price_series
         
-        return transactions
+        return {asset: pd.concat(frames) for asset, frames in candles.items()}
+
+    @staticmethod
+    def hourlyCandlesFilename(asset) -> str:
+        return f'./data/historical_OHLCV_hourly_{asset}.csv'
+
+    @staticmethod
+    def readHourlyCandles(asset) -> pd.DataFrame:
+        data_filename = CryptoCompareWrapper.hourlyCandlesFilename(asset)
+        if not os.path.exists(data_filename):
+            return pd.DataFrame(columns=CryptoCompareWrapper.HourlyCandlesColumns, index=pd.DatetimeIndex([], tz='UTC', name='time'), dtype=float)
+        data = pd.read_csv(data_filename, index_col='time')
+        data.index = pd.to_datetime(data.index, utc=True).as_unit('ns')
+        return data
+
+    @staticmethod
+    def saveHourlyCandles(asset, requested_data) -> pd.DataFrame:
+        """Merge the received candles in the cached candles of the asset, and return all the candles.
+
+        The candle of the current hour is used but not saved, as it changes until the end of the hour.
+        The hours without candle are NaN rows, they don't replace a cached candle.
+        """
+        data_filename = CryptoCompareWrapper.hourlyCandlesFilename(asset)
+        os.makedirs(os.path.dirname(data_filename), exist_ok=True)
+        with FileLock(data_filename):
+            # Read the file again, another process may have added candles
+            requested_data = requested_data[~requested_data.index.duplicated(keep='last')]
+            data = requested_data.combine_first(CryptoCompareWrapper.readHourlyCandles(asset))
+            complete = data.index < pd.Timestamp.now(tz='utc').floor('h')
+            with atomicWrite(data_filename, newline='') as f:
+                data[complete].to_csv(f)
+        return data
     
     @staticmethod
     def requestDailyHistoricalPrices(asset: str, apiKey) -> pd.DataFrame:
         if apiKey is None:
             raise Exception("No API key provided, no USD values will be added")
-        # Rename asset to match CryptoCompare API
+        # Rename asset to match CryptoCompare API. The price panel uses the original name.
+        panelAsset = asset
         asset = CryptoCompareWrapper.AssetNameMap.get(asset, asset)
         
         # remove the unsuported assets by the api
         if asset in CryptoCompareWrapper.UnsupportedHistoricalPriceAssets:
             return pd.DataFrame()
+        pricePanel = CryptoCompareWrapper.getPricePanel()
         
         # API setup
-        api_url = 'https://min-api.cryptocompare.com/data/v2/histoday'
+        api_url = 'data/v2/histoday'
         params={
             'fsym': asset,
             'tsym':'USD',
@@ -211,8 +375,14 @@ class CryptoCompareWrapper():
             'explainPath': 'false'
         }
         
-        # get existing historical data from file
+        # get existing historical data from file. A single process updates the file of an asset at a time, the others
+        # wait for it and find the file up to date.
         data_filename = f'./data/historical_OHLCV_daily_{asset}.csv'
+        with FileLock(data_filename):
+            return CryptoCompareWrapper._updateDailyHistoricalPrices(data_filename, panelAsset, pricePanel, api_url, params)
+
+    @staticmethod
+    def _updateDailyHistoricalPrices(data_filename, panelAsset, pricePanel, api_url, params):
         saved_data = pd.DataFrame()
         if os.path.exists(data_filename):
             saved_data = pd.read_csv(data_filename, parse_dates=['time'], index_col='time')
@@ -221,6 +391,8 @@ class CryptoCompareWrapper():
             last_saved_date = saved_data.index.max()
             days_since_last_saved_data = (pd.Timestamp.now(tz='utc') - last_saved_date).days
             if days_since_last_saved_data < 1:
+                if panelAsset not in pricePanel.assets:
+                    pricePanel.update(panelAsset, saved_data['close'])
                 return saved_data
 
             params['limit'] = str(days_since_last_saved_data)
@@ -231,8 +403,8 @@ class CryptoCompareWrapper():
 
         
         try:
-            response = requests.get(url=api_url,params=params)
-        except requests.exceptions.RequestException as e:
+            response = CryptoCompareWrapper.transport.get(api_url, params)
+        except TransportError as e:
             raise Exception(f"Request Error to CryptoCompare API : {e}\n")
         if response.status_code != 200:
             raise Exception(f"Request Error to CryptoCompare API : {response.status_code}")
@@ -257,5 +429,8 @@ class CryptoCompareWrapper():
         requested_data = requested_data[~requested_data.index.isin(saved_data.index)]
         # Append the new data to the existing data and save it to a file
         data = pd.concat([saved_data, requested_data])
-        data.to_csv(data_filename)
+        with atomicWrite(data_filename, newline='') as f:
+            data.to_csv(f)
+        # Only the new days are written to the price panel, unless the asset is not in it yet
+        pricePanel.update(panelAsset, data['close'] if panelAsset not in pricePanel.assets else requested_data['close'])
         return data
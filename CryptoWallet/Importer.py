@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import Loader
+from .Instrumentation import span
+from .LoaderCache import LoaderCache
+
+# Subfolders of Settings.exported_transactions_dirpath, in import order.
+# Folder name: (loader class name, True if each export is a folder of files, False if it is a single file)
+ExchangeFolders = {
+    'Binance': ('BinanceLoader', False),
+    'Ledger': ('LedgerLoader', False),
+    'SwissBorg': ('SwissborgLoader', False),
+    'Kucoin': ('KucoinLoader', True),
+    'ByBit': ('BybitLoader', True),
+    'Manual': ('ManualTransactionsLoader', False),
+}
+
+
+def listExports(exportedTransactionsDirpath, exchanges=None) -> list:
+    """Return the (exchange folder, loader class name, path) of each export, in import order."""
+    exports = []
+    for folder, (loaderName, isFolder) in ExchangeFolders.items():
+        if exchanges is not None and folder not in exchanges:
+            continue
+        folderpath = os.path.join(exportedTransactionsDirpath, folder)
+        if not os.path.isdir(folderpath):
+            continue
+        for name in sorted(os.listdir(folderpath)):
+            path = os.path.join(folderpath, name)
+            if os.path.isdir(path) == isFolder:
+                exports.append((folder, loaderName, path))
+    return exports
+
+
+def loadExport(loaderName, path, cacheDirpath=None):
+    # Run in a worker process. Return the loaded transactions and the loading time.
+    # With a cache folder, the transactions of an export are cached under the hash of its content and the version of
+    # its loader: an unchanged export is read back from the cache instead of being parsed again.
+    start = time.perf_counter()
+    loader = getattr(Loader, loaderName)
+    if cacheDirpath is None:
+        return loader.load(path), time.perf_counter() - start
+    cache = LoaderCache('transactions', cacheDirpath)
+    key = f"{loaderName}-v{loader.version}-{LoaderCache.contentHash(path)}"
+    transactions = cache.get(key)
+    if transactions is None:
+        transactions = loader.load(path)
+        cache.put(key, transactions)
+    return transactions, time.perf_counter() - start
+
+
+def loadExports(exports, maxWorkers=None, progress=None, cancelled=None, cacheDirpath=LoaderCache.DefaultDirpath) -> list:
+    """Load the exports in parallel worker processes.
+
+    The workers are spawned, not forked: the calling process may run other threads (price refresher, transport, GUI),
+    whose locks would be copied in their current state by a fork.
+
+    progress(done, total, path, result, seconds) is called after each export, where result is the loaded DataFrame or the exception raised.
+    cancelled() is polled between exports, loading stops when it returns True.
+    The loaded transactions are cached in cacheDirpath, see loadExport(). Set it to None to parse all the exports.
+    Return the list of (exchange folder, path, DataFrame or exception) in the order of the exports.
+    """
+    results = [None] * len(exports)
+    if not exports:
+        return results
+    with ProcessPoolExecutor(max_workers=maxWorkers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(loadExport, loaderName, path, cacheDirpath): i for i, (_, loaderName, path) in enumerate(exports)}
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                folder, _, path = exports[i]
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    result, seconds = e, None
+                results[i] = (folder, path, result)
+                if progress is not None:
+                    progress(done, len(exports), path, result, seconds)
+                if cancelled is not None and cancelled():
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+    return results
+
+
+def importExports(wallet, exportedTransactionsDirpath, exchanges=None, maxWorkers=None, progress=None, cancelled=None,
+                  cacheDirpath=LoaderCache.DefaultDirpath) -> int:
+    """Load all the exports of the exchanges in parallel, and add them to the wallet in import order.
+
+    Nothing is added to the wallet if an export fails to load or if the import is cancelled.
+    Return the number of imported exports.
+    """
+    exports = listExports(exportedTransactionsDirpath, exchanges)
+    results = loadExports(exports, maxWorkers, progress, cancelled, cacheDirpath)
+    if any(result is None for result in results):
+        raise InterruptedError("Import cancelled, no transactions added to the wallet")
+    errors = [(path, result) for _, path, result in results if isinstance(result, Exception)]
+    if errors:
+        raise Exception("Failed to load the exports:\n" + '\n'.join(f"- {path}: {e}" for path, e in errors))
+    # Add the transactions sequentially, as the removal of existing transactions depends on the previous imports
+    for _, path, transactions in results:
+        with span('import:add', path=path):
+            wallet.addTransactions(transactions)
+    return len(results)
@@ -0,0 +1,219 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+# Lightweight timing spans around the stages of the pipeline (loaders, dedup, merge, integrity check, save, API calls).
+# Tracing is disabled by default and costs a function call per span. Enable it with Instrumentation.tracer.enable(),
+# or by setting the environment variable CRYPTOWALLET_TRACE to the JSON file where the trace is written at exit.
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'attributes', 'parent', 'thread', 'start', 'duration')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.thread = threading.get_ident()
+        self.start = None
+        self.duration = None
+
+    def set(self, **attributes):
+        # Attach attributes to the span, like the number of rows or bytes processed
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.tracer._stack().pop()
+        if excType is not None:
+            self.attributes['error'] = excType.__name__
+        self.tracer._record(self)
+        return False
+
+
+class NullSpan:
+    # Returned when tracing is disabled
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_nullSpan = NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._savedAtExit = set()
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return _nullSpan
+        return Span(self, name, attributes)
+
+    def enable(self, traceFilename=None):
+        """Start recording spans. If traceFilename is given, the trace is written to it at exit."""
+        self.enabled = True
+        if traceFilename is not None and traceFilename not in self._savedAtExit:
+            self._savedAtExit.add(traceFilename)
+            atexit.register(self.save, traceFilename)
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def toDict(self) -> dict:
+        # Chrome trace event format, readable by chrome://tracing or https://ui.perfetto.dev
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'traceEvents': [{
+                'name': span.name,
+                'ph': 'X',
+                'ts': (span.start - self._origin) * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': os.getpid(),
+                'tid': span.thread,
+                'args': dict(span.attributes, parent=span.parent),
+            } for span in spans],
+            'displayTimeUnit': 'ms',
+        }
+
+    def save(self, filename):
+        directory = os.path.dirname(filename)
+        if directory:  # Only create directories if there's actually a path component
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(self.toDict(), f, default=str)
+
+    def summary(self) -> pd.DataFrame:
+        """Total time, number of calls, rows and bytes per span name, slowest first."""
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return pd.DataFrame(columns=['calls', 'total_s', 'mean_s', 'max_s', 'rows', 'bytes'])
+        df = pd.DataFrame({
+            'name': [s.name for s in spans],
+            'duration': [s.duration for s in spans],
+            'rows': [s.attributes.get('rows', 0) for s in spans],
+            'bytes': [s.attributes.get('bytes', 0) for s in spans],
+        })
+        summary = df.groupby('name').agg(calls=('duration', 'size'), total_s=('duration', 'sum'), mean_s=('duration', 'mean'),
+                                         max_s=('duration', 'max'), rows=('rows', 'sum'), bytes=('bytes', 'sum'))
+        return summary.sort_values('total_s', ascending=False)
+
+
+tracer = Tracer()
+if os.environ.get('CRYPTOWALLET_TRACE'):
+    tracer.enable(os.environ['CRYPTOWALLET_TRACE'])
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def pathSize(path) -> int:
+    # Size in bytes of a file, or of the files of a folder
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+    return os.path.getsize(path)
+
+
+def traced(func=None, *, name=None):
+    """Decorator recording a span for each call of the function.
+
+    The span records the size of the path arguments, the number of rows of the DataFrame
+    arguments (rowsIn), and the number of rows of the returned DataFrame (rows).
+    """
+    if func is None:
+        return functools.partial(traced, name=name)
+    spanName = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not tracer.enabled:
+            return func(*args, **kwargs)
+        with tracer.span(spanName) as s:
+            for arg in list(args) + list(kwargs.values()):
+                if isinstance(arg, str) and os.path.exists(arg):
+                    s.set(path=arg, bytes=pathSize(arg))
+                elif isinstance(arg, pd.DataFrame):
+                    s.set(rowsIn=len(arg))
+            result = func(*args, **kwargs)
+            if isinstance(result, (pd.DataFrame, pd.Series)):
+                s.set(rows=len(result))
+            return result
+    return wrapper
+
+
+@contextmanager
+def profile(filename=None, engine='cProfile'):
+    """Profile the enclosed code with cProfile or pyinstrument.
+
+    The result is written to filename (.prof for cProfile, .html for pyinstrument), or printed if no filename is given.
+    """
+    if engine == 'cProfile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            if filename:
+                profiler.dump_stats(filename)
+            else:
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+    elif engine == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument is not installed. Install it with 'pip install pyinstrument', or use engine='cProfile'")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            if filename:
+                with open(filename, 'w') as f:
+                    f.write(profiler.output_html())
+            else:
+                print(profiler.output_text())
+    else:
+        raise ValueError(f"Unknown profiler engine '{engine}'. Use 'cProfile' or 'pyinstrument'.")
@@ -1,14 +1,40 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timezone, timedelta
-from .Transaction import Transaction, TransactionType, WalletType
+from .Transaction import Transaction, TransactionType, WalletType, StableCoinsUSD
 import dataclasses
 import os
+import re
 from copy import deepcopy
+from .Instrumentation import span, traced
+
+
+def toUtc(values, offsetMinutes = 0) -> pd.Series:
+    # Parse the ISO 8601 datetimes of a column at once. Their timezone is replaced by the UTC offset of the export, in minutes.
+    datetimes = pd.to_datetime(values.astype(str), format='ISO8601')
+    if datetimes.dt.tz is not None:
+        datetimes = datetimes.dt.tz_localize(None)
+    return (datetimes - pd.to_timedelta(offsetMinutes, unit='min')).dt.tz_localize('UTC')
+
+
+def localToUtc(values) -> pd.Series:
+    # Parse the ISO 8601 datetimes of a column, the datetimes without timezone being in the local timezone of the machine,
+    # as datetime.astimezone() does. Each distinct value is converted once.
+    codes, uniques = pd.factorize(values.astype(str))
+    converted = pd.DatetimeIndex([datetime.fromisoformat(value).astimezone(timezone.utc) for value in uniques], dtype='datetime64[ns, UTC]')
+    return pd.Series(converted[codes], index=values.index)
+
+
+def insertAfter(transactions, derived) -> pd.DataFrame:
+    # Insert the rows derived from some transactions (fees, mirror rows...) right after them. derived keeps the index of the transactions.
+    return pd.concat([transactions, derived]).sort_index(kind='stable').reset_index(drop=True)
 
 
 class BinanceLoader:
     name = 'Binance'
+    # Version of the output of the loader. Increment it when the loaded transactions change, to invalidate the
+    # transactions cached by the importer, see Importer.loadExport()
+    version = 1
     TransactionTypesMap = {
         'Deposit': TransactionType.DEPOSIT,
         'Withdraw': TransactionType.WITHDRAW,
@@ -55,12 +81,14 @@ class BinanceLoader:
     }
 
     @classmethod
+    @traced
     def load(cls, filepath_or_buffer) -> pd.DataFrame:
         print(f"Loading transactions from {filepath_or_buffer} file")
         # Check that the file is a csv file
         if (not filepath_or_buffer.endswith('.csv')):
             raise Exception(f"The file {filepath_or_buffer} is not a csv file")
-        inTransactions = pd.read_csv(filepath_or_buffer)
+        with span('read_csv'):
+            inTransactions = pd.read_csv(filepath_or_buffer)
         transactions = []
         exceptions_occurred = False
         for idx, row in inTransactions.iterrows():
@@ -124,7 +152,8 @@ class BinanceLoader:
                                                         transactions[-1].amount,
                                                         note=transactions[-1].note + ', Transaction not from Binance'))
 
-        transactions_df = pd.DataFrame(transactions)
+        with span('build_dataframe', rows=len(transactions)):
+            transactions_df = pd.DataFrame(transactions)
         
         if exceptions_occurred:
             raise Exception(
@@ -135,6 +164,7 @@ class BinanceLoader:
 
 class LedgerLoader:
     name = 'Ledger'
+    version = 2
     TransactionTypesMap = {
         'IN': TransactionType.DEPOSIT,
         'OUT': TransactionType.WITHDRAW,
@@ -143,52 +173,48 @@ class LedgerLoader:
     }
     
     @classmethod
+    @traced
     def load(cls, filepath_or_buffer) -> pd.DataFrame:
         print(f"Loading transactions from {filepath_or_buffer} file")
         # Check that the file is a csv file
         if (not filepath_or_buffer.endswith('.csv')):
             raise Exception(f"The file {filepath_or_buffer} is not a csv file")
-        inTransactions = pd.read_csv(filepath_or_buffer)
-        transactions = []
-        exceptions_occurred = False
-        for idx, row in inTransactions.iterrows():
-            if (row['Status'] != 'Confirmed'):
-                if (row['Status'] != 'Failed'):
-                    raise Exception(
-                        f"The transaction status '{row['Status']}' is unknown. Only 'Confirmed' and 'Failed' are supported by the loader.")
-                continue  # Skip the transaction if it is not confirmed
-            try:
-                new_transaction = Transaction(
-                    datetime=datetime.fromisoformat(row['Operation Date']).replace(tzinfo=timezone.utc),
-                    asset=row['Currency Ticker'],
-                    amount=row['Operation Amount'],
-                    type=cls.TransactionTypesMap[row['Operation Type']],
-                    exchange=cls.name,
-                    userId=str(row['Account Name']) + ' - ' + str(row['Account xpub']),
-                    wallet=WalletType.FUNDING,
-                    note=f"Operation Hash={row['Operation Hash']}"
-                )
-                # If the transaction type is OUT, the amount is negative
-                if (new_transaction.type in {TransactionType.WITHDRAW, TransactionType.FEE}):
-                    new_transaction.amount = -new_transaction.amount
-                # Manage all the transaction types that was not managable only with the TransactionTypesMap, and set to TBD.
-                if (new_transaction.type == TransactionType.TBD):
-                    if (row['Operation Type'] == 'NFT_IN'):
-                        # NFT_IN is a transaction type that is not supported by the loader. Go to the next transaction.
-                        continue
-                    else:
-                        raise KeyError(row['Operation'])
-                
-                transactions.append(new_transaction)
-                
-                    
-            except KeyError as e:
-                # If a KeyError is raised, it means that the transaction type is not supported by the loader. As many missing transaction type can be missing, we don't raise an exception here. We analyse all the transactions and raise an exception at the end if needed.
-                print(f"The transaction type {e} is not supported by the loader")
-                exceptions_occurred = True
-                continue
-
-        transactions_df = pd.DataFrame(transactions)
+        with span('read_csv'):
+            inTransactions = pd.read_csv(filepath_or_buffer)
+
+        with span('build_dataframe', rows=len(inTransactions)):
+            # Skip the transactions that are not confirmed
+            status = inTransactions['Status']
+            unknown = ~status.isin(['Confirmed', 'Failed'])
+            if unknown.any():
+                raise Exception(
+                    f"The transaction status '{status[unknown].iloc[0]}' is unknown. Only 'Confirmed' and 'Failed' are supported by the loader.")
+            inTransactions = inTransactions[(status == 'Confirmed').to_numpy()]
+            # NFT_IN is a transaction type that is not supported by the loader. Skip these transactions.
+            inTransactions = inTransactions[(inTransactions['Operation Type'] != 'NFT_IN').to_numpy()]
+
+            types = inTransactions['Operation Type'].map(cls.TransactionTypesMap)
+            # As many transaction types can be missing, all the unsupported types are reported, and an exception is raised at the end
+            isUnsupported = types.isna().to_numpy()
+            for key in inTransactions.loc[isUnsupported, 'Operation Type'].unique():
+                print(f"The transaction type '{key}' is not supported by the loader")
+            exceptions_occurred = bool(isUnsupported.any())
+            inTransactions, types = inTransactions[~isUnsupported], types[~isUnsupported]
+
+            # WITHDRAW and FEE amounts are negative
+            sign = np.where(types.isin([TransactionType.WITHDRAW, TransactionType.FEE]), -1.0, 1.0)
+            transactions_df = pd.DataFrame({
+                'datetime': toUtc(inTransactions['Operation Date']),
+                'asset': inTransactions['Currency Ticker'],
+                'amount': sign * inTransactions['Operation Amount'],
+                'type': types,
+                'exchange': cls.name,
+                'userId': inTransactions['Account Name'].astype(str) + ' - ' + inTransactions['Account xpub'].astype(str),
+                'wallet': WalletType.FUNDING,
+                'note': "Operation Hash=" + inTransactions['Operation Hash'].astype(str),
+                'price_USD': np.nan,
+                'amount_USD': np.nan,
+            }).reset_index(drop=True)
         
         if exceptions_occurred:
             raise Exception(
@@ -199,6 +225,7 @@ class LedgerLoader:
 
 class CoinbaseLoader:
     name = 'Coinbase'
+    version = 1
     TransactionTypesMap = {
         'Send': TransactionType.WITHDRAW,
         'Deposit': TransactionType.DEPOSIT,
@@ -209,6 +236,7 @@ class CoinbaseLoader:
     NegativeTransactionTypes = {'Send', 'Convert'}
 
     @classmethod
+    @traced
     def load(cls, filepath_or_buffer) -> pd.DataFrame:
         raise DeprecationWarning("CoinbaseLoader is not supported anymore. Use the ManualTransactionsLoader instead.")
         print(f"Loading transactions from {filepath_or_buffer} file")
@@ -331,7 +359,8 @@ class CoinbaseLoader:
                 raise Exception("Fees different from 0 for a transaction that is not a 'Buy' or 'Convert' transaction is not supported by the loader.")
 
 
-        transactions_df = pd.DataFrame(transactions)
+        with span('build_dataframe', rows=len(transactions)):
+            transactions_df = pd.DataFrame(transactions)
         
         if exceptions_occurred:
             raise Exception(
@@ -352,7 +381,9 @@ class CoinbaseLoader:
     
     
 class ManualTransactionsLoader:
+    version = 1
     @classmethod
+    @traced
     def load(cls, filepath_or_buffer) -> pd.DataFrame:
         print(f"Loading transactions from {filepath_or_buffer} file")
         #Check that filepath_or_buffer exists
@@ -371,6 +402,7 @@ class ManualTransactionsLoader:
 
 class SwissborgLoader:
     name = 'Swissborg'
+    version = 2
     TransactionTypesMap = {
         'Deposit': TransactionType.DEPOSIT,
         'Withdrawal': TransactionType.WITHDRAW,
@@ -379,8 +411,13 @@ class SwissborgLoader:
         'Payouts': TransactionType.STAKING_INTEREST
     }
     NegativeTransactionTypes = {'Withdrawal', 'Sell'}
+    # Layout of the account statement: the user id is in the cell E6, the header of the table in the row 14, columns A:K
+    UserIdCell = (5, 4)
+    HeaderRow = 13
+    TableColumns = 11
     
     @classmethod
+    @traced
     def load(cls, filepath_or_buffer) -> pd.DataFrame:
         print(f"Loading transactions from {filepath_or_buffer} file")
         # Check that the file is a xlsx file
@@ -388,52 +425,77 @@ class SwissborgLoader:
             raise Exception(
                 f"The file {filepath_or_buffer} is not a xlsx file")
 
-        inTransactions = pd.read_excel(
-            filepath_or_buffer, header=13, usecols='A:K')
-        # The user id is in the cell 6E row of the file
-        userId = pd.read_excel(
-            filepath_or_buffer, usecols="E", skiprows=4, nrows=1).iat[0, 0]
-
-        transactions = []
-        exceptions_occurred = False
-        for idx, row in inTransactions.iterrows():
-            try:
-                transactions.append(Transaction(
-                    datetime=datetime.fromisoformat(
-                        row['Time in UTC']).replace(tzinfo=timezone.utc),
-                    asset=row['Currency'],
-                    amount=-row['Gross amount'] if row['Type'] in cls.NegativeTransactionTypes else row['Gross amount'],
-                    type=cls.TransactionTypesMap[row['Type']],
-                    exchange=cls.name,
-                    userId=userId,
-                    wallet=WalletType.SPOT,  # Default transaction are done with the Spot wallet
-                    note=f"Type={row['Type']}" + ('' if row.isna()['Note'] else (f", Note={str(row['Note'])}")),
-                    price_USD=row['Gross amount (USD)']/row['Gross amount'],
-                    amount_USD=- row['Gross amount (USD)'] if row['Type'] in cls.NegativeTransactionTypes else row['Gross amount (USD)']
-                ))
-                # If the transaction fee is not 0, add a new transaction for the fee
-                if (row['Fee'] != 0):
-                    transactions.append(dataclasses.replace(transactions[-1],
-                                                            amount=-row['Fee'],
-                                                            type=TransactionType.FEE,
-                                                            note=transactions[-1].note +
-                                                            ', Fee',
-                                                            amount_USD=-row['Fee (USD)']))
+        inTransactions, userId = cls.readStatement(filepath_or_buffer)
 
-            except KeyError as e:
-                print(f"The transaction type {e} is not supported by the loader")
-                exceptions_occurred = True
-
-        transactions_df = pd.DataFrame(transactions)
-        
-        if exceptions_occurred:
+        # Unknown transaction types are all reported before failing
+        unknownTypes = inTransactions.loc[~inTransactions['Type'].isin(cls.TransactionTypesMap.keys()), 'Type'].unique()
+        for transactionType in unknownTypes:
+            print(f"The transaction type '{transactionType}' is not supported by the loader")
+        if len(unknownTypes):
             raise Exception(
                 "Exceptions occurred during the loading of the transactions. See the logs for more details.")
 
+        with span('build_dataframe', rows=len(inTransactions)):
+            # Columnwise sign, price and note of the transactions
+            sign = np.where(inTransactions['Type'].isin(cls.NegativeTransactionTypes), -1.0, 1.0)
+            datetimes = pd.to_datetime(inTransactions['Time in UTC'], format='ISO8601')
+            if datetimes.dt.tz is not None:
+                datetimes = datetimes.dt.tz_localize(None)
+            notes = "Type=" + inTransactions['Type'].astype(str)
+            hasNote = inTransactions['Note'].notna()
+            notes[hasNote] += ", Note=" + inTransactions.loc[hasNote, 'Note'].astype(str)
+            transactions = pd.DataFrame({
+                'datetime': datetimes.dt.tz_localize('UTC'),
+                'asset': inTransactions['Currency'],
+                'amount': sign * inTransactions['Gross amount'],
+                'type': inTransactions['Type'].map(cls.TransactionTypesMap),
+                'exchange': cls.name,
+                'userId': userId,
+                'wallet': WalletType.SPOT,  # Default transaction are done with the Spot wallet
+                'note': notes,
+                'price_USD': inTransactions['Gross amount (USD)'] / inTransactions['Gross amount'],
+                'amount_USD': sign * inTransactions['Gross amount (USD)'],
+            })
+            # If the transaction fee is not 0, add a new transaction for the fee, right after the transaction
+            hasFee = (inTransactions['Fee'] != 0).to_numpy()
+            fees = transactions[hasFee].assign(amount=-inTransactions.loc[hasFee, 'Fee'], type=TransactionType.FEE,
+                                               note=transactions.loc[hasFee, 'note'] + ', Fee', amount_USD=-inTransactions.loc[hasFee, 'Fee (USD)'])
+            transactions_df = insertAfter(transactions, fees)
+
         return transactions_df
+
+    @classmethod
+    def readStatement(cls, filepath):
+        """Return the table of the transactions and the user id of an account statement, reading the workbook once."""
+        from openpyxl import load_workbook
+        with span('read_excel'):
+            # Read-only mode streams the rows of the sheet, without building the cells of the whole workbook
+            workbook = load_workbook(filepath, read_only=True, data_only=True)
+            try:
+                userId, header, rows = None, None, []
+                for i, row in enumerate(workbook.worksheets[0].iter_rows(values_only=True)):
+                    if i == cls.UserIdCell[0]:
+                        userId = row[cls.UserIdCell[1]] if len(row) > cls.UserIdCell[1] else None
+                    elif i == cls.HeaderRow:
+                        header = list(row[:cls.TableColumns])
+                    elif i > cls.HeaderRow:
+                        row = row[:cls.TableColumns]
+                        if any(value is not None for value in row):
+                            rows.append(row)
+            finally:
+                workbook.close()
+        if header is None:
+            raise Exception(f"No table of transactions in the row {cls.HeaderRow + 1} of {filepath}")
+        table = pd.DataFrame(rows, columns=header)
+        # Empty cells are missing values, as with read_excel
+        table = table.replace('', np.nan).infer_objects()
+        for column in ['Gross amount', 'Gross amount (USD)', 'Fee', 'Fee (USD)']:
+            table[column] = pd.to_numeric(table[column], errors='coerce').astype(float)
+        return table, userId
     
 class KucoinLoader:
     name = 'Kucoin'
+    version = 2
     TransactionTypesMap = {
             'Deposit': TransactionType.DEPOSIT,
             'Withdraw': TransactionType.WITHDRAW,
@@ -449,6 +511,7 @@ class KucoinLoader:
         }
     
     @classmethod
+    @traced
     def load(cls, folderpath) -> pd.DataFrame:
         print(f"Loading transactions from {folderpath} folder")
         # Check that the folderpath is a folder
@@ -456,12 +519,13 @@ class KucoinLoader:
             raise Exception(f"The path {folderpath} is not a folder. Kucoin store multiple CSV files in a folder")
 
         csv_files = [file for file in os.listdir(folderpath) if file.endswith('.csv')]
-        transactions = []
+        frames = []
         exceptions_occurred = False
         for file in csv_files:
             print(f"- Reading '{file}'")
             filepath = os.path.join(folderpath, file)
-            inTransactions = pd.read_csv(filepath)
+            with span('read_csv', path=filepath):
+                inTransactions = pd.read_csv(filepath)
             if inTransactions.empty:
                 continue
 
@@ -478,59 +542,46 @@ class KucoinLoader:
                 print(f"The file '{file}' is skipped. Only 'Account History' files are used by the loader.")
                 continue
 
-            # Get the time column name and timezone offset
+            # Get the time column name and timezone offset, once for the file
             time_column_name, timezone_offset_minutes  = cls.get_time_offset(inTransactions)
 
-            for idx, row in inTransactions.iterrows():
-                try:
-                    # manage amount sign
-                    if (row['Side'] == 'Deposit'):
-                        amount=row['Amount']
-                    elif (row['Side'] == 'Withdrawal'):
-                        amount=-row['Amount']
-                    else:
-                        raise KeyError(row['Side'])
-                    
-                    gross_amount = amount + row['Fee'] # Kucoin already substract the fee from the amount, so we need to add it back to get the gross amount
-                    
-                    transactions.append(Transaction(
-                        datetime=datetime.fromisoformat(str(row[time_column_name])).replace(tzinfo=timezone(
-                            timedelta(minutes=timezone_offset_minutes))).astimezone(timezone.utc),
-                        asset=row['Currency'],
-                        amount=gross_amount,
-                        type=cls.TransactionTypesMap[row['Type']],
-                        exchange=cls.name,
-                        userId=row['UID'],
-                        wallet=walletType,
-                        note=f"Remark={row['Remark']}, Type={row['Type']}, Side={row['Side']}"
-                    ))
-                    
-                    if (transactions[-1].type == TransactionType.TBD):
-                        # if the type is a transfer between two internal account, set the type to DEPOSIT or WITHDRAW
-                        if (row['Type'] == 'KuCoin Event'):
-                            transactions[-1].type = cls.TransactionTypesMap[row['Side']]
-                        else:
-                            raise KeyError(row['Type'])
-                    
-                except KeyError as e:
-                    # If a KeyError is raised, it means that the transaction type is not supported by the loader. As many missing transaction type can be missing, we don't raise an exception here. We analyse all the transactions and raise an exception at the end if needed.
-                    print(f"The key '{e}' is not supported by the loader")
+            with span('build_dataframe', rows=len(inTransactions)):
+                # manage amount sign
+                side = inTransactions['Side']
+                sign = side.map({'Deposit': 1.0, 'Withdrawal': -1.0})
+                # if the type is a transfer between two internal account, set the type to DEPOSIT or WITHDRAW
+                types = inTransactions['Type'].map(cls.TransactionTypesMap)
+                isEvent = (inTransactions['Type'] == 'KuCoin Event').to_numpy()
+                types[isEvent] = side[isEvent].map(cls.TransactionTypesMap)
+                # As many transaction types can be missing, all the unsupported keys are reported, and an exception is raised at the end
+                isInvalid = sign.isna() | types.isna() | (types == TransactionType.TBD)
+                if isInvalid.any():
+                    for key in pd.concat([side[sign.isna()], inTransactions.loc[(types.isna() | (types == TransactionType.TBD)) & sign.notna(), 'Type']]).unique():
+                        print(f"The key '{key}' is not supported by the loader")
                     exceptions_occurred = True
-                    continue
-                
+                valid = inTransactions[~isInvalid]
+
+                transactions = pd.DataFrame({
+                    'datetime': toUtc(valid[time_column_name], timezone_offset_minutes),
+                    'asset': valid['Currency'],
+                    'amount': sign[~isInvalid] * valid['Amount'] + valid['Fee'], # Kucoin already substract the fee from the amount, so we need to add it back to get the gross amount
+                    'type': types[~isInvalid],
+                    'exchange': cls.name,
+                    'userId': valid['UID'],
+                    'wallet': walletType,
+                    'note': "Remark=" + valid['Remark'].astype(str) + ", Type=" + valid['Type'].astype(str) + ", Side=" + valid['Side'].astype(str),
+                    'price_USD': np.nan,
+                    'amount_USD': np.nan,
+                })
                 # If the transaction fee is not 0, add a new transaction for the fee
-                if (row['Fee'] != 0):
-                    transactions.append(dataclasses.replace(transactions[-1],
-                                                            amount=-row['Fee'],
-                                                            type=TransactionType.FEE,
-                                                            note=transactions[-1].note + ', Fee'))
+                hasFee = (valid['Fee'] != 0).to_numpy()
+                fees = transactions[hasFee].assign(amount=-valid.loc[hasFee, 'Fee'], type=TransactionType.FEE, note=transactions.loc[hasFee, 'note'] + ', Fee')
+                frames.append(insertAfter(transactions, fees))
 
-        transactions_df = pd.DataFrame(transactions)
-        
         if exceptions_occurred:
             raise Exception(
                 "Exceptions occurred during the loading of the transactions. See the logs for more details.")
-        return transactions_df
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     
     
     @classmethod
@@ -548,6 +599,9 @@ class KucoinLoader:
 
 class BybitLoader:
     name = 'Bybit'
+    version = 3
+    # The times of the exports are labelled UTC, but have always been read in the local timezone of the machine (see
+    # localToUtc). Reading them as UTC would shift the transactions already in the databases, and a re-import would duplicate them.
     TransactionTypesMap = {
             'Deposit': TransactionType.DEPOSIT,
             'Withdrawal': TransactionType.WITHDRAW,
@@ -564,9 +618,12 @@ class BybitLoader:
             'TRANSFER_IN' : TransactionType.ACCOUNT_TRANSFER,
             np.nan : TransactionType.TBD  # To Be Determined
         }
-    StableCoinsUSD = {'USDT', 'USDC', 'DAI', 'BUSD', 'USD', 'USDS', 'USDe', 'FDUSD', 'USDD', 'PYUSD', 'TUSD'}
+    StableCoinsUSD = StableCoinsUSD
+    # Trading pairs containing a USD stablecoin
+    StableCoinsUSDPattern = re.compile('|'.join(re.escape(coin) for coin in sorted(StableCoinsUSD)))
     
     @classmethod
+    @traced
     def load(cls, folderpath) -> pd.DataFrame:
         print(f"Loading transactions from {folderpath} folder")
         # Check that the folderpath is a folder
@@ -576,7 +633,7 @@ class BybitLoader:
         csv_files = [file for file in os.listdir(folderpath) if file.endswith('.csv')]
         if not csv_files:
             raise Exception(f"No CSV files found in the folder {folderpath}")
-        transactions = []
+        frames = []
         exceptions_occurred = False
         for file in csv_files:
             print(f"- Reading '{file}'")
@@ -585,124 +642,116 @@ class BybitLoader:
             # Get the wallet type from the file name
             if file.startswith("Bybit_AssetChangeDetails_fund"):
                 transactions_funding, exceptions_funding = cls.load_funding(filepath)
-                transactions += transactions_funding
+                frames.append(transactions_funding)
                 exceptions_occurred = exceptions_occurred or exceptions_funding
             elif file.startswith("Bybit_AssetChangeDetails_uta"):
                 transactions_spot, exceptions_spot = cls.load_spot(filepath)
-                transactions += transactions_spot
+                frames.append(transactions_spot)
                 exceptions_occurred = exceptions_occurred or exceptions_spot
             else :
                 raise Exception(f"The file '{file}' is not supported by the loader.")
             
-            
-        transactions_df = pd.DataFrame(transactions)
-        
         if exceptions_occurred:
             raise Exception(
                 "Exceptions occurred during the loading of the transactions. See the logs for more details.")
             
-        return transactions_df
+        frames = [frame for frame in frames if not frame.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     
     @classmethod
+    @traced
     def load_funding(cls, filepath):
-        transactions = []
-        exceptions_occurred = False
-        inTransactions = pd.read_csv(filepath, skiprows=1)
+        with span('read_csv'):
+            inTransactions = pd.read_csv(filepath, skiprows=1)
         if inTransactions.empty:
-            return transactions, exceptions_occurred
+            return pd.DataFrame(), False
         
         # Get UID from the first row
         with open(filepath) as f:
             uid = f.readline().split(',')[0].split(':')[1].strip()
-            
-        for idx, row in inTransactions.iterrows():
-            try:                
-                transaction = Transaction(
-                    datetime=datetime.fromisoformat(str(row['Date & Time(UTC)'])).astimezone(timezone.utc),
-                    asset=row['Coin'],
-                    amount=row['QTY'],
-                    type=cls.TransactionTypesMap[row['Description']],
-                    exchange=cls.name,
-                    userId=uid,
-                    wallet=WalletType.FUNDING,
-                    note=f"Description={row['Description']}, Type={row['Type']}"
-                )
-                
-                if (transaction.type == TransactionType.TBD):
-                    if row['Type'] == 'Earn':
-                        if row['QTY'] < 0:
-                            transaction.type = TransactionType.SAVING_PURCHASE
-                            transaction.note += ', Move to SAVING wallet'
-                        else: 
-                            raise KeyError(row['Description'])
-                    else:
-                        raise KeyError(row['Description'])
-                
-                transactions.append(transaction)
-                
-            except KeyError as e:
-                # If a KeyError is raised, it means that the transaction type is not supported by the loader. As many missing transaction type can be missing, we don't raise an exception here. We analyse all the transactions and raise an exception at the end if needed.
-                print(f"The key '{e}' is not supported by the loader")
-                exceptions_occurred = True
-                continue
-            
-            if (transaction.type in {TransactionType.SAVING_PURCHASE, TransactionType.SAVING_REDEMPTION}):
-                transactions.append(dataclasses.replace(transaction,
-                                                        wallet=WalletType.SAVING,
-                                                        amount=-transaction.amount,
-                                                        note=transaction.note + ', Transaction not from Bybit'))
-                                    
-                
-        return transactions, exceptions_occurred
+
+        with span('build_dataframe', rows=len(inTransactions)):
+            description = inTransactions['Description']
+            types = cls.mapTypes(description)
+            notes = "Description=" + description.astype(str) + ", Type=" + inTransactions['Type'].astype(str)
+            # Earn rows without description are moves to the SAVING wallet
+            isSubscription = ((types == TransactionType.TBD) & (inTransactions['Type'] == 'Earn') & (inTransactions['QTY'] < 0)).to_numpy()
+            types[isSubscription] = TransactionType.SAVING_PURCHASE
+            notes[isSubscription] += ', Move to SAVING wallet'
+            # As many transaction types can be missing, all the unsupported keys are reported, and an exception is raised at the end
+            isInvalid = (types.isna() | (types == TransactionType.TBD)).to_numpy()
+            exceptions_occurred = cls.reportUnsupported(description[isInvalid])
+
+            valid = inTransactions[~isInvalid]
+            transactions = pd.DataFrame({
+                'datetime': localToUtc(valid['Date & Time(UTC)']),
+                'asset': valid['Coin'],
+                'amount': valid['QTY'],
+                'type': types[~isInvalid],
+                'exchange': cls.name,
+                'userId': uid,
+                'wallet': WalletType.FUNDING,
+                'note': notes[~isInvalid],
+                'price_USD': np.nan,
+                'amount_USD': np.nan,
+            })
+            # The savings are in the SAVING wallet, which is not in the Bybit exports
+            isSaving = transactions['type'].isin([TransactionType.SAVING_PURCHASE, TransactionType.SAVING_REDEMPTION]).to_numpy()
+            mirrors = transactions[isSaving].assign(wallet=WalletType.SAVING, amount=-transactions.loc[isSaving, 'amount'],
+                                                    note=transactions.loc[isSaving, 'note'] + ', Transaction not from Bybit')
+        return insertAfter(transactions, mirrors), exceptions_occurred
 
     @classmethod
+    @traced
     def load_spot(cls, filepath):
-        transactions = []
-        exceptions_occurred = False
-        inTransactions = pd.read_csv(filepath, skiprows=1)
+        with span('read_csv'):
+            inTransactions = pd.read_csv(filepath, skiprows=1)
         if inTransactions.empty:
-            return transactions, exceptions_occurred
+            return pd.DataFrame(), False
         
         # Get UID from the first row
         with open(filepath) as f:
             uid = f.readline().split(',')[0].split(':')[1].strip()
-            
-        for idx, row in inTransactions.iterrows():
-            try:
-                # Try to get the price of the asset
-                # Set price_USD to the 'Filled Price' if the 'Currency' is not an USD stablecoin, but a stablecoin is present in the trading pair ('Contract' column)
-                # Otherwise, set price_USD to NaN.
-                price_USD = row['Filled Price'] if (row['Currency'] not in cls.StableCoinsUSD and pd.notna(row['Contract']) and any(coin in row['Contract'] for coin in cls.StableCoinsUSD)) else np.nan
-                    
-                transaction = Transaction(
-                    datetime=datetime.fromisoformat(str(row['Time(UTC)'])).astimezone(timezone.utc),
-                    asset=row['Currency'],
-                    amount=row['Cash Flow'],
-                    type= cls.TransactionTypesMap[row['Type']],
-                    exchange=cls.name,
-                    userId=uid,
-                    wallet=WalletType.SPOT,
-                    note=f"Contract={row['Contract']}, Direction={row['Direction']}",
-                    price_USD=price_USD,
-                    amount_USD=row['Cash Flow']*price_USD
-                )
-                transactions.append(transaction)
-                
-                # If the transaction fee is not 0, add a new transaction for the fee
-                if (row['Fee Paid'] != 0):
-                    transactions.append(dataclasses.replace(transaction,
-                                                        amount=row['Fee Paid'],
-                                                        type=TransactionType.FEE,
-                                                        note=transaction.note +', Fee',
-                                                        amount_USD=row['Fee Paid']*price_USD))
 
-            except KeyError as e:
-                # If a KeyError is raised, it means that the transaction type is not supported by the loader. As many missing transaction type can be missing, we don't raise an exception here. We analyse all the transactions and raise an exception at the end if needed.
-                print(f"The key '{e}' is not supported by the loader")
-                exceptions_occurred = True
-                continue
-                        
+        with span('build_dataframe', rows=len(inTransactions)):
+            types = cls.mapTypes(inTransactions['Type'])
+            # As many transaction types can be missing, all the unsupported keys are reported, and an exception is raised at the end
+            isInvalid = types.isna().to_numpy()
+            exceptions_occurred = cls.reportUnsupported(inTransactions.loc[isInvalid, 'Type'])
+            valid = inTransactions[~isInvalid]
+
+            # Set price_USD to the 'Filled Price' if the 'Currency' is not an USD stablecoin, but a stablecoin is present in the trading pair ('Contract' column)
+            # Otherwise, set price_USD to NaN.
+            isUsdPair = valid['Contract'].astype('string').str.contains(cls.StableCoinsUSDPattern, na=False).to_numpy(dtype=bool) & ~valid['Currency'].isin(cls.StableCoinsUSD).to_numpy()
+            price_USD = valid['Filled Price'].where(isUsdPair, np.nan).astype(float)
+            transactions = pd.DataFrame({
+                'datetime': localToUtc(valid['Time(UTC)']),
+                'asset': valid['Currency'],
+                'amount': valid['Cash Flow'],
+                'type': types[~isInvalid],
+                'exchange': cls.name,
+                'userId': uid,
+                'wallet': WalletType.SPOT,
+                'note': "Contract=" + valid['Contract'].astype(str) + ", Direction=" + valid['Direction'].astype(str),
+                'price_USD': price_USD,
+                'amount_USD': valid['Cash Flow'] * price_USD,
+            })
+            # If the transaction fee is not 0, add a new transaction for the fee
+            hasFee = (valid['Fee Paid'] != 0).to_numpy()
+            fees = transactions[hasFee].assign(amount=valid.loc[hasFee, 'Fee Paid'], type=TransactionType.FEE, note=transactions.loc[hasFee, 'note'] + ', Fee',
+                                               amount_USD=valid.loc[hasFee, 'Fee Paid'] * price_USD[hasFee])
+        return insertAfter(transactions, fees), exceptions_occurred
 
+    @classmethod
+    def mapTypes(cls, keys) -> pd.Series:
+        # TransactionType of each key, NaN for the unsupported keys. A missing key is TBD.
+        # Object dtype, as the mapped keys of an all-NaN column are a float Series
+        types = keys.map({key: value for key, value in cls.TransactionTypesMap.items() if isinstance(key, str)}).astype(object)
+        types[keys.isna()] = cls.TransactionTypesMap[np.nan]
+        return types
 
-        return transactions, exceptions_occurred
-    
+    @staticmethod
+    def reportUnsupported(keys) -> bool:
+        for key in keys.unique():
+            print(f"The key '{key}' is not supported by the loader")
+        return len(keys) > 0
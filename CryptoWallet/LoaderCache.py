@@ -0,0 +1,59 @@
+import hashlib
+import os
+import pickle
+from .Storage import atomicWrite
+
+
+class LoaderCache:
+    """Values derived from the exports (parsed sheets, loaded transactions), stored under the hash of the export content.
+
+    An export whose content did not change is never parsed again, even if it was renamed, moved or touched.
+    The values are pickled, which is the fastest format to read back a DataFrame with its dtypes and enums.
+    Each kind of value has its own namespace, a subfolder of the cache folder.
+    """
+    DefaultDirpath = '.CryptoWallet/cache'
+    HashChunkSize = 1 << 20
+
+    def __init__(self, namespace, dirpath = DefaultDirpath):
+        self.namespace = namespace
+        self.dirpath = dirpath
+
+    def filename(self, key) -> str:
+        return os.path.join(self.dirpath, self.namespace, f"{key}.pkl")
+
+    def get(self, key):
+        """Cached value of the key, None if there is none or if it can't be read."""
+        try:
+            with open(self.filename(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Written by an incompatible version of pandas or of the package: parse the export again
+            print(f"Ignoring the unreadable cache file {self.filename(key)}: {e}")
+            return None
+
+    def put(self, key, value):
+        with atomicWrite(self.filename(key), 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def contentHash(path) -> str:
+        """SHA-256 of the content of a file, or of the names and contents of the files of a folder."""
+        digest = hashlib.sha256()
+        if os.path.isdir(path):
+            for directory, directories, filenames in os.walk(path):
+                directories.sort()
+                for name in sorted(filenames):
+                    filepath = os.path.join(directory, name)
+                    digest.update(os.path.relpath(filepath, path).replace(os.sep, '/').encode() + b'\0')
+                    LoaderCache._updateDigest(digest, filepath)
+        else:
+            LoaderCache._updateDigest(digest, path)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _updateDigest(digest, filepath):
+        with open(filepath, 'rb') as f:
+            while chunk := f.read(LoaderCache.HashChunkSize):
+                digest.update(chunk)
@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from .Transaction import TransactionType, WalletType
+from .Instrumentation import span
+from .Storage import atomicWrite
+
+
+class PartitionedStore:
+    """Transactions of a wallet in Parquet files partitioned by year and exchange, in a directory named *.parquet.
+
+    A JSON manifest lists the file, the number of rows, the first and last datetime and a hash of the content of each
+    partition. The queries only read the partitions of their time range and exchanges (partition pruning), and only the
+    columns they use (projection), e.g. 'asset' and 'amount' for the balances. The aggregates are computed partition by
+    partition, so the memory used depends on the size of a partition, not of the whole history.
+    Saving only rewrites the partitions whose content changed, under new file names, then replaces the manifest
+    atomically: a reader sees the previous or the new version of the store. pyarrow, an optional dependency (the
+    'parquet' extra), is imported on first use.
+    """
+    Columns = ['datetime', 'asset', 'amount', 'type', 'exchange', 'userId', 'wallet', 'note', 'price_USD', 'amount_USD']
+    Extension = '.parquet'
+    ManifestName = 'manifest.json'
+    ArchiveName = 'archive.parquet'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.manifestFilename = os.path.join(filename, self.ManifestName)
+
+    @staticmethod
+    def handles(filename) -> bool:
+        return isinstance(filename, str) and filename.rstrip('/\\').lower().endswith(PartitionedStore.Extension)
+
+    def manifest(self) -> dict:
+        if not os.path.exists(self.manifestFilename):
+            return {'version': 0, 'partitions': {}, 'archive': None}
+        with open(self.manifestFilename) as f:
+            return json.load(f)
+
+    def version(self) -> int:
+        # Incremented by each write, to detect the writes of the other processes
+        return self.manifest()['version']
+
+    # Reading
+
+    def read(self, columns = None, start = None, end = None, table = 'transactions', **keys) -> pd.DataFrame:
+        """Transactions in [start, end) matching the keys, sorted by datetime. Read by year, see iterChunks()."""
+        if table == 'archive':
+            return self.readArchive()
+        chunks = list(self.iterChunks(columns, start, end, **keys))
+        if not chunks:
+            return PartitionedStore.fromArrow(pd.DataFrame(columns=self.Columns if columns is None else list(columns)))
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    def iterChunks(self, columns = None, start = None, end = None, **keys):
+        """Yield the transactions in [start, end) matching the keys, a DataFrame per year, sorted by datetime."""
+        columns = self.Columns if columns is None else list(columns)
+        manifest = self.manifest()
+        partitions = self.prune(manifest, start, end, keys.get('exchange'))
+        with span('parquet:read', partitions=len(partitions)) as stage:
+            rows = 0
+            for year in sorted({partition['year'] for partition in partitions}):
+                frames = [self.readPartition(partition, columns, start, end, keys) for partition in partitions if partition['year'] == year]
+                chunk = pd.concat(frames, ignore_index=True).sort_values('datetime', kind='stable', ignore_index=True) \
+                    if 'datetime' in columns else pd.concat(frames, ignore_index=True)
+                rows += len(chunk)
+                if not chunk.empty:
+                    yield chunk
+            stage.set(rows=rows)
+
+    def aggregate(self, by, columns, start = None, end = None, **keys) -> pd.DataFrame:
+        """Sums of the columns per value of `by`, of the transactions matching the keys, one partition at a time."""
+        sums = []
+        for partition in self.prune(self.manifest(), start, end, keys.get('exchange')):
+            frame = self.readPartition(partition, [by] + list(columns), start, end, keys)
+            if not frame.empty:
+                sums.append(frame.groupby(by)[list(columns)].sum())
+        if not sums:
+            return pd.DataFrame(columns=list(columns), index=pd.Index([], name=by), dtype=float)
+        return pd.concat(sums).groupby(level=0).sum().rename_axis(by)
+
+    def distinct(self, column) -> pd.Series:
+        values = set()
+        for partition in self.manifest()['partitions'].values():
+            values.update(self.readPartition(partition, [column], None, None, {})[column].unique())
+        return pd.Series(sorted(values), name=column)
+
+    def prune(self, manifest, start, end, exchanges) -> list:
+        # Partitions which may contain transactions in [start, end) of the exchanges
+        if exchanges is not None and not isinstance(exchanges, (list, tuple, set, np.ndarray, pd.Series, pd.Index)):
+            exchanges = [exchanges]
+        startNs = None if start is None else PartitionedStore.toNs(start)
+        endNs = None if end is None else PartitionedStore.toNs(end)
+        return [partition for partition in manifest['partitions'].values()
+                if (exchanges is None or partition['exchange'] in set(exchanges))
+                and (startNs is None or partition['last'] >= startNs) and (endNs is None or partition['first'] < endNs)]
+
+    def readPartition(self, partition, columns, start, end, keys) -> pd.DataFrame:
+        _, pq = PartitionedStore.importPyarrow()
+        # Read only the requested columns, and the columns of the filters
+        for key, values in keys.items():
+            if values is not None and key not in ('asset', 'exchange', 'userId', 'wallet', 'type'):
+                raise KeyError(f"Unknown key '{key}'")
+        filterColumns = [key for key, values in keys.items() if values is not None] + (['datetime'] if start is not None or end is not None else [])
+        readColumns = list(dict.fromkeys(list(columns) + filterColumns))
+        frame = PartitionedStore.fromArrow(pq.read_table(os.path.join(self.filename, partition['file']), columns=readColumns).to_pandas())
+        mask = np.ones(len(frame), dtype=bool)
+        if start is not None:
+            mask &= (frame['datetime'] >= PartitionedStore.toTimestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (frame['datetime'] < PartitionedStore.toTimestamp(end)).to_numpy()
+        for key, values in keys.items():
+            if values is None:
+                continue
+            values = list(values) if isinstance(values, (list, tuple, set, np.ndarray, pd.Series, pd.Index)) else [values]
+            mask &= frame[key].isin(values).to_numpy()
+        return frame.loc[mask, list(columns)].reset_index(drop=True) if not mask.all() else frame[list(columns)]
+
+    def readArchive(self) -> pd.DataFrame:
+        _, pq = PartitionedStore.importPyarrow()
+        archive = self.manifest()['archive']
+        if archive is None:
+            return pd.DataFrame()
+        return PartitionedStore.fromArrow(pq.read_table(os.path.join(self.filename, archive)).to_pandas())
+
+    # Writing
+
+    def write(self, transactions: pd.DataFrame, archive: pd.DataFrame = None):
+        """Make the stored transactions equal to `transactions`, by rewriting the partitions that changed.
+
+        The archive is replaced if given. The manifest is replaced last, so nothing is visible if an error occurs.
+        """
+        pa, pq = PartitionedStore.importPyarrow()
+        unknown = transactions.columns.difference(self.Columns)
+        if len(unknown):
+            raise ValueError(f"Columns not stored in the Parquet files: {', '.join(unknown)}")
+        previous = self.manifest()
+        version = previous['version'] + 1
+        rows = PartitionedStore.toArrow(transactions.reindex(columns=self.Columns))
+        years = rows['datetime'].dt.year
+        partitions = {}
+        written = 0
+        with span('parquet:write', rows=len(rows)) as stage:
+            for (year, exchange), partition in rows.groupby([years, rows['exchange']], sort=True):
+                partition = partition.sort_values('datetime', kind='stable')
+                key = f"year={year}/exchange={exchange}"
+                contentHash = str(int(pd.util.hash_pandas_object(partition, index=False).to_numpy().view(np.int64).sum()))
+                old = previous['partitions'].get(key)
+                if old is not None and old['hash'] == contentHash and old['rows'] == len(partition):
+                    partitions[key] = old
+                    continue
+                file = f"{key}/part-{version}.parquet"
+                os.makedirs(os.path.join(self.filename, key), exist_ok=True)
+                pq.write_table(pa.Table.from_pandas(partition, preserve_index=False), os.path.join(self.filename, file))
+                times = PartitionedStore.toNsArray(partition['datetime'])
+                partitions[key] = {'year': int(year), 'exchange': exchange, 'file': file, 'rows': len(partition), 'hash': contentHash,
+                                   'first': int(times.min()), 'last': int(times.max())}
+                written += 1
+            archiveFile = previous['archive']
+            if archive is not None:
+                archiveFile = None
+                if not archive.empty:
+                    archiveFile = f"archive-{version}.parquet"
+                    pq.write_table(pa.Table.from_pandas(PartitionedStore.toArrow(archive), preserve_index=False), os.path.join(self.filename, archiveFile))
+            with atomicWrite(self.manifestFilename) as f:
+                json.dump({'version': version, 'partitions': partitions, 'archive': archiveFile}, f, indent=1)
+            stage.set(partitions=len(partitions), written=written)
+        # The files of the previous version are kept for the readers which read its manifest
+        self.removeFilesExcept(previous, {'version': version, 'partitions': partitions, 'archive': archiveFile})
+
+    def removeFilesExcept(self, *manifests):
+        kept = {os.path.normpath(os.path.join(self.filename, name)) for manifest in manifests
+                for name in [partition['file'] for partition in manifest['partitions'].values()] + [manifest['archive']] if name is not None}
+        for directory, _, filenames in os.walk(self.filename):
+            for name in filenames:
+                path = os.path.normpath(os.path.join(directory, name))
+                if name.endswith('.parquet') and path not in kept:
+                    os.remove(path)
+
+    def backup(self, filename):
+        # Copy of the files of the current version
+        manifest = self.manifest()
+        for name in [partition['file'] for partition in manifest['partitions'].values()] + [manifest['archive']]:
+            if name is not None:
+                os.makedirs(os.path.dirname(os.path.join(filename, name)), exist_ok=True)
+                shutil.copy2(os.path.join(self.filename, name), os.path.join(filename, name))
+        with open(os.path.join(filename, self.ManifestName), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    # Conversions
+
+    @staticmethod
+    def importPyarrow():
+        # pyarrow and its parquet module, only needed by the *.parquet databases
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("The *.parquet databases need pyarrow, install it with: pip install CryptoWallet[parquet]") from e
+        return pyarrow, pyarrow.parquet
+
+    @staticmethod
+    def toArrow(transactions: pd.DataFrame) -> pd.DataFrame:
+        rows = transactions.copy()
+        if 'datetime' in rows.columns:
+            datetimes = pd.DatetimeIndex(rows['datetime'])
+            rows['datetime'] = (datetimes.tz_convert('UTC') if datetimes.tz is not None else datetimes.tz_localize('UTC')).as_unit('ns')
+        for column, enum in (('type', TransactionType), ('wallet', WalletType)):
+            if column in rows.columns:
+                rows[column] = rows[column].map({member: member.name for member in enum})
+        if 'userId' in rows.columns:
+            rows['userId'] = rows['userId'].astype(str)
+        if 'note' in rows.columns:
+            rows['note'] = rows['note'].where(rows['note'].notna(), None)
+        for column in ('amount', 'price_USD', 'amount_USD'):
+            if column in rows.columns:
+                rows[column] = rows[column].astype(float)
+        return rows
+
+    @staticmethod
+    def fromArrow(rows: pd.DataFrame) -> pd.DataFrame:
+        if 'datetime' in rows.columns:
+            rows['datetime'] = pd.to_datetime(rows['datetime'], utc=True).dt.as_unit('ns')
+        if 'type' in rows.columns:
+            rows['type'] = rows['type'].map(TransactionType.__members__)
+        if 'wallet' in rows.columns:
+            rows['wallet'] = rows['wallet'].map(WalletType.__members__)
+        for column in ('amount', 'price_USD', 'amount_USD'):
+            if column in rows.columns:
+                rows[column] = rows[column].astype(float)
+        return rows
+
+    @staticmethod
+    def toTimestamp(value) -> pd.Timestamp:
+        value = pd.Timestamp(value)
+        return value.tz_localize('UTC') if value.tzinfo is None else value
+
+    @staticmethod
+    def toNs(value) -> int:
+        return PartitionedStore.toTimestamp(value).as_unit('ns').value
+
+    @staticmethod
+    def toNsArray(datetimes) -> np.ndarray:
+        return pd.DatetimeIndex(datetimes).as_unit('ns').asi8
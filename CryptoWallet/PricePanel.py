@@ -0,0 +1,179 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from .Storage import FileLock, atomicWrite
+
+
+class PricePanel:
+    """Daily USD close prices of the assets, as a date × asset float64 matrix in a memory-mapped file.
+
+    The matrix is stored row-major (a row per day) with room for `assetCapacity` columns. A JSON sidecar holds the
+    first date, the number of days, the asset of each column and the name of the data file.
+    Readers map the data file read-only: the processes share the pages of the OS cache, without parsing nor copying.
+    The prices of the existing days and new assets filling the free columns are written in place. New days, a price
+    older than the first date or full columns write a new data file, under a new name: a mapped file is never resized
+    nor deleted while it may be in use, which Windows forbids. The previous files are deleted when possible.
+    The writers take the lock of the sidecar, so there is a single writer at a time. Readers see its updates after reload().
+    """
+    DefaultDirpath = './data'
+    DefaultName = 'price_panel'
+    AssetCapacityStep = 64
+
+    def __init__(self, dirpath = DefaultDirpath, name = DefaultName):
+        self.dirpath = dirpath
+        self.name = name
+        self.indexFilename = os.path.join(dirpath, f"{name}.json")
+        self.reload()
+
+    def reload(self):
+        # Read the sidecar, to see the days and assets written since the panel was opened
+        if os.path.exists(self.indexFilename):
+            with open(self.indexFilename) as f:
+                index = json.load(f)
+            self.start = pd.Timestamp(index['start'], tz='UTC')
+            self.nDays = index['days']
+            self.assets = index['assets']
+            self.assetCapacity = index['assetCapacity']
+            self.dataFilename = os.path.join(self.dirpath, index['dataFile'])
+            self.generation = index['generation']
+        else:
+            self.start = None
+            self.nDays = 0
+            self.assets = []
+            self.assetCapacity = 0
+            self.dataFilename = None
+            self.generation = 0
+        self._columns = {asset: i for i, asset in enumerate(self.assets)}
+        self._array = None
+
+    @property
+    def array(self) -> np.ndarray:
+        """Read-only map of the (days, assetCapacity) matrix, NaN where there is no price."""
+        if self._array is None and self.nDays > 0:
+            try:
+                self._array = np.memmap(self.dataFilename, dtype=np.float64, mode='r', shape=(self.nDays, self.assetCapacity))
+            except FileNotFoundError:
+                # The writer rewrote the data file after the sidecar was read
+                self.reload()
+                return self.array
+        return self._array
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        if self.start is None:
+            return pd.DatetimeIndex([], tz='UTC', name='time')
+        return pd.date_range(self.start, periods=self.nDays, freq='D', name='time')
+
+    def prices(self, assets = None, start = None, end = None) -> pd.DataFrame:
+        """Prices between the dates start and end included, with a column per asset.
+
+        Without assets, the DataFrame is a view of the memory-mapped file. Otherwise the selected columns are copied.
+        """
+        if self.nDays == 0:
+            return pd.DataFrame(columns=[] if assets is None else list(assets), index=self.dates, dtype=float)
+        dates = self.dates
+        first = 0 if start is None else dates.searchsorted(PricePanel.toDay(start))
+        last = self.nDays if end is None else dates.searchsorted(PricePanel.toDay(end), side='right')
+        if assets is None:
+            columns = list(self.assets)
+            values = self.array[first:last, :len(columns)]
+        else:
+            columns = list(assets)
+            unknown = [asset for asset in columns if asset not in self._columns]
+            if unknown:
+                raise KeyError(f"No historical prices for {', '.join(unknown)} in the price panel {self.indexFilename}")
+            values = self.array[first:last, [self._columns[asset] for asset in columns]]
+        return pd.DataFrame(values, index=dates[first:last], columns=columns, copy=False)
+
+    def update(self, asset, prices: pd.Series):
+        """Write the daily prices of an asset, indexed by date, and publish them to the readers."""
+        prices = prices.dropna()
+        if prices.empty:
+            return
+        with FileLock(self.indexFilename):
+            # Another process may have written the panel since it was read
+            self.reload()
+            self._update(asset, prices)
+
+    def _update(self, asset, prices):
+        days = PricePanel.toDay(pd.DatetimeIndex(prices.index))
+        first, last = days.min(), days.max()
+
+        isNewAsset = asset not in self._columns
+        isFull = isNewAsset and len(self.assets) >= self.assetCapacity
+        start = first if self.start is None else min(first, self.start)
+        nDays = (last - start).days + 1 if self.start is None else max((last - start).days + 1, (self.start - start).days + self.nDays)
+        if self.start is None or start < self.start or nDays > self.nDays or isFull:
+            capacity = self.assetCapacity + self.AssetCapacityStep if isFull else self.assetCapacity
+            self._rewrite(start, nDays, max(capacity, self.AssetCapacityStep))
+        if isNewAsset:
+            self._columns[asset] = len(self.assets)
+            self.assets.append(asset)
+
+        array = np.memmap(self.dataFilename, dtype=np.float64, mode='r+', shape=(self.nDays, self.assetCapacity))
+        array[(days - self.start).days, self._columns[asset]] = prices.to_numpy(dtype=np.float64)
+        array.flush()
+        del array
+        self._saveIndex()
+
+    def _rewrite(self, start, nDays, assetCapacity):
+        # Copy the matrix in a new data file with the new dates and capacity. Readers of the previous file are not affected.
+        offset = 0 if self.start is None else (self.start - start).days
+        dataFilename = os.path.join(self.dirpath, f"{self.name}.{self.generation + 1}.f64")
+        os.makedirs(self.dirpath, exist_ok=True)
+        array = np.memmap(dataFilename, dtype=np.float64, mode='w+', shape=(nDays, assetCapacity))
+        array[:] = np.nan
+        if self.nDays > 0:
+            array[offset:offset + self.nDays, :len(self.assets)] = self.array[:, :len(self.assets)]
+        array.flush()
+        del array
+        self.start, self.nDays, self.assetCapacity = start, nDays, assetCapacity
+        self.dataFilename = dataFilename
+        self.generation += 1
+        self._saveIndex()
+        self._removePreviousFiles()
+
+    def _removePreviousFiles(self):
+        # Best effort: on Windows, a file mapped by a reader can't be deleted, it is deleted by a later rewrite
+        for filename in glob.glob(os.path.join(self.dirpath, f"{glob.escape(self.name)}.*.f64")):
+            if os.path.abspath(filename) != os.path.abspath(self.dataFilename):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def _saveIndex(self):
+        # Replace the sidecar atomically, so that readers never see a partial index
+        index = {
+            'start': self.start.strftime('%Y-%m-%d'),
+            'days': self.nDays,
+            'assets': self.assets,
+            'assetCapacity': self.assetCapacity,
+            'dataFile': os.path.basename(self.dataFilename),
+            'generation': self.generation,
+        }
+        with atomicWrite(self.indexFilename) as f:
+            json.dump(index, f)
+        self._array = None
+
+    @staticmethod
+    def toDay(value):
+        # UTC midnight of a date, a Timestamp or a DatetimeIndex
+        if isinstance(value, pd.DatetimeIndex):
+            value = value.tz_convert('UTC') if value.tz is not None else value.tz_localize('UTC')
+            return value.normalize()
+        value = pd.Timestamp(value)
+        value = value.tz_convert('UTC') if value.tzinfo is not None else value.tz_localize('UTC')
+        return value.normalize()
+
+    @classmethod
+    def fromCsv(cls, dirpath = DefaultDirpath, name = DefaultName) -> 'PricePanel':
+        """Build the panel from the historical_OHLCV_daily_<asset>.csv files of requestDailyHistoricalPrices."""
+        panel = cls(dirpath, name)
+        for filename in sorted(glob.glob(os.path.join(dirpath, 'historical_OHLCV_daily_*.csv'))):
+            asset = os.path.basename(filename)[len('historical_OHLCV_daily_'):-len('.csv')]
+            data = pd.read_csv(filename, parse_dates=['time'], index_col='time')
+            panel.update(asset, data['close'])
+        return panel
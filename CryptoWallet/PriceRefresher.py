@@ -0,0 +1,120 @@
+import threading
+import time
+from dataclasses import dataclass
+import pandas as pd
+from .CryptoCompareWrapper import CryptoCompareWrapper
+
+
+@dataclass(frozen=True)
+class PriceSnapshot:
+    prices: pd.Series  # asset: current price in USD
+    timestamp: float   # time.time() of the last successful fetch
+
+
+class PriceRefresher:
+    """Periodically fetch the current prices of a set of assets on a worker thread.
+
+    Each refresh publishes a new immutable PriceSnapshot. Readers access `snapshot`
+    without blocking, and subscribers are called with every new snapshot, from the worker thread.
+    The worker thread only reads its own copy of the assets to fetch, replaced with setAssets(). The assets which were
+    not part of the last refresh are fetched right away.
+    """
+
+    def __init__(self, assets, apiKey, interval=60*60, initialPrices=None, initialTimestamp=0.0):
+        self._assets = tuple(pd.unique(pd.Series(list(assets), dtype=object)))  # Replaced as a whole, never modified
+        self.apiKey = apiKey
+        self.interval = interval  # in seconds
+        prices = pd.Series(dtype=float) if initialPrices is None else pd.Series(initialPrices, dtype=float)
+        self._snapshot = PriceSnapshot(prices, initialTimestamp)
+        self._subscribers = []
+        self._subscribersLock = threading.Lock()
+        self._refreshLock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._wakeEvent = threading.Event()
+        self._thread = None
+        self._requestedAssets = frozenset(prices.index)  # Assets of the last refresh, or of the initial prices
+
+    @property
+    def snapshot(self) -> PriceSnapshot:
+        # The snapshot is replaced as a whole, never modified, so reading it needs no lock
+        return self._snapshot
+
+    def isRunning(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, callback):
+        """Register callback(snapshot), called after each refresh. Return the callback to allow unsubscribing."""
+        with self._subscribersLock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._subscribersLock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start(self):
+        if self.isRunning():
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name="PriceRefresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopEvent.set()
+        self._wakeEvent.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def requestRefresh(self):
+        """Ask the worker thread to refresh now, without waiting for the end of the interval."""
+        self._wakeEvent.set()
+
+    @property
+    def assets(self) -> tuple:
+        return self._assets
+
+    def setAssets(self, assets):
+        """Replace the assets to fetch. Ask for a refresh if some were not requested by the last refresh, e.g. new assets."""
+        self._assets = tuple(pd.unique(pd.Series(list(assets), dtype=object)))
+        if not set(self._assets) <= self._requestedAssets:
+            self.requestRefresh()
+
+    def refresh(self) -> PriceSnapshot:
+        """Fetch the prices synchronously, publish and return the new snapshot."""
+        with self._refreshLock:
+            assets = pd.Series(self._assets, dtype=object)
+            self._requestedAssets = frozenset(assets)
+            fetchTime = time.time()
+            newPrices = CryptoCompareWrapper.requestApiCurrentPrices(assets, self.apiKey)
+            # Keep the previous price of the assets the API did not return
+            prices = self._snapshot.prices.copy()
+            prices = pd.concat([prices.drop(newPrices.index, errors='ignore'), newPrices.astype(float)])
+            snapshot = PriceSnapshot(prices, fetchTime)
+            self._publish(snapshot)
+            return snapshot
+
+    def _publish(self, snapshot):
+        self._snapshot = snapshot
+        with self._subscribersLock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:  # A failing subscriber must not stop the refresher
+                print(f"Price refresher subscriber {callback} failed: {e}")
+
+    def _run(self):
+        # Wait for the remaining lifetime of the initial snapshot before the first fetch
+        delay = max(0.0, self._snapshot.timestamp + self.interval - time.time())
+        while not self._stopEvent.is_set():
+            self._wakeEvent.wait(delay)
+            self._wakeEvent.clear()
+            if self._stopEvent.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:  # Network errors are retried at the next interval
+                print(f"Price refresh failed: {e}")
+            delay = self.interval
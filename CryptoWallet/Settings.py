@@ -1,6 +1,7 @@
 import json
 import os.path
 from typing import ClassVar, Dict
+from .Storage import FileLock, atomicWrite
 
 class Settings:
     _default_values: ClassVar[dict] = {
@@ -12,14 +13,17 @@ class Settings:
     }
     _default_settings_filepath: ClassVar[str] = ".CryptoWallet/settings.json"
 
-    def __init__(self, **kwargs):
-        """Initialize Settings with given values or defaults."""
+    def __init__(self, create_file: bool = True, **kwargs):
+        """Initialize Settings with given values or defaults.
+
+        The default settings file is written if it does not exist, unless create_file is False.
+        """
         for key, default_value in self._default_values.items():
             private_key = f"_{key}"
             value = kwargs.get(key, default_value)
             setattr(self, private_key, value)
 
-        if not os.path.exists(self._default_settings_filepath):
+        if create_file and not os.path.exists(self._default_settings_filepath):
             self.save()
             
     def _to_dict(self) -> Dict[str, str]:
@@ -35,21 +39,18 @@ class Settings:
     
     def save(self, filepath: str = _default_settings_filepath) -> None:
         """Save settings to a JSON file."""
-        # Create directory to store settings file
-        directory = os.path.dirname(filepath)
-        if directory:  # Only create directories if there's actually a path component
-            os.makedirs(directory, exist_ok=True)
-        with open(filepath, 'w') as f:
+        # The file is replaced atomically, readers see the previous or the new settings
+        with FileLock(filepath), atomicWrite(filepath) as f:
             json.dump(self._to_dict(), f, indent=4)
 
     @classmethod
-    def load(cls, filepath: str = _default_settings_filepath) -> 'Settings':
-        """Load settings from a JSON file."""
+    def load(cls, filepath: str = _default_settings_filepath, create_file: bool = True) -> 'Settings':
+        """Load settings from a JSON file, the default values if it does not exist."""
         if not os.path.exists(filepath):
-            return cls()
+            return cls(create_file)
         with open(filepath, 'r') as f:
             data = json.load(f)
-        return cls(**data)
+        return cls(create_file, **data)
 
     @property
     def root_dirpath(self) -> str:
@@ -0,0 +1,229 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from .Transaction import TransactionType, WalletType
+from .Instrumentation import span
+
+
+class SqliteStore:
+    """Transactions of a wallet in a SQLite database, an alternative to the CSV file.
+
+    The columns of the transactions are stored as is, except the datetimes (UTC nanoseconds) and the enums (names).
+    Each row has a fingerprint of its identity columns, unique in the table: saving the wallet only deletes, inserts and
+    updates the rows that changed since the last save, in a single transaction. The filters of query() and the sums of
+    aggregate() are computed by SQLite with the indexes, so a lazy wallet answers them without reading the whole history.
+    """
+    Columns = ['datetime', 'asset', 'amount', 'type', 'exchange', 'userId', 'wallet', 'note', 'price_USD', 'amount_USD']
+    # Identity of a transaction. The prices are not part of it, they are updated in place.
+    IdentityColumns = ['datetime', 'asset', 'amount', 'type', 'exchange', 'userId', 'wallet', 'note']
+    Extensions = ('.db', '.sqlite', '.sqlite3')
+    ChunkSize = 100_000
+    Schema = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            datetime INTEGER NOT NULL, asset TEXT NOT NULL, amount REAL NOT NULL, type TEXT NOT NULL, exchange TEXT NOT NULL,
+            userId TEXT NOT NULL, wallet TEXT NOT NULL, note TEXT, price_USD REAL, amount_USD REAL, fingerprint INTEGER NOT NULL UNIQUE);
+        CREATE INDEX IF NOT EXISTS transactions_asset_datetime ON transactions (asset, datetime);
+        CREATE INDEX IF NOT EXISTS transactions_exchange_userId_datetime ON transactions (exchange, userId, datetime);
+        CREATE INDEX IF NOT EXISTS transactions_datetime ON transactions (datetime);
+        CREATE TABLE IF NOT EXISTS archive (
+            datetime INTEGER NOT NULL, asset TEXT NOT NULL, amount REAL NOT NULL, type TEXT NOT NULL, exchange TEXT NOT NULL,
+            userId TEXT NOT NULL, wallet TEXT NOT NULL, note TEXT, price_USD REAL, amount_USD REAL, compaction_id INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta VALUES ('version', 0);
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with self._connection() as connection:
+            connection.executescript(self.Schema)
+
+    @staticmethod
+    def handles(filename) -> bool:
+        return isinstance(filename, str) and filename.lower().endswith(SqliteStore.Extensions)
+
+    def connect(self) -> sqlite3.Connection:
+        # A connection per call: the store is used from the threads of the importer and the UI
+        connection = sqlite3.connect(self.filename, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")  # Readers are not blocked by the writer
+        return connection
+
+    def version(self) -> int:
+        # Incremented by each write, to detect the writes of the other processes
+        with self._connection() as connection:
+            return connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _connection(self):
+        return _ClosingConnection(self.connect())
+
+    # Reading
+
+    def read(self, columns = None, start = None, end = None, table = 'transactions', **keys) -> pd.DataFrame:
+        """Transactions in [start, end) matching the keys, sorted by datetime. Read in chunks, see iterChunks()."""
+        chunks = list(self.iterChunks(columns, start, end, table, **keys))
+        if not chunks:
+            return pd.DataFrame(columns=self.tableColumns(table) if columns is None else list(columns))
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    def iterChunks(self, columns = None, start = None, end = None, table = 'transactions', chunksize = None, **keys):
+        """Yield the transactions in [start, end) matching the keys by DataFrames of at most chunksize rows."""
+        columns = self.tableColumns(table) if columns is None else list(columns)
+        where, params = SqliteStore.where(start, end, **keys)
+        sql = f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY datetime"
+        with span('sqlite:read', table=table) as stage:
+            rows = 0
+            with self._connection() as connection:
+                for chunk in pd.read_sql_query(sql, connection, params=params, chunksize=chunksize or self.ChunkSize):
+                    rows += len(chunk)
+                    yield SqliteStore.fromSql(chunk)
+            stage.set(rows=rows)
+
+    def aggregate(self, by, columns, start = None, end = None, **keys) -> pd.DataFrame:
+        """Sums of the columns per value of `by`, of the transactions matching the keys, computed by SQLite."""
+        where, params = SqliteStore.where(start, end, **keys)
+        sums = ', '.join(f"TOTAL({column}) AS {column}" for column in columns)
+        sql = f"SELECT {by}, {sums} FROM transactions{where} GROUP BY {by} ORDER BY {by}"
+        with self._connection() as connection:
+            result = SqliteStore.fromSql(pd.read_sql_query(sql, connection, params=params))
+        return result.set_index(by)
+
+    def distinct(self, column) -> pd.Series:
+        with self._connection() as connection:
+            values = pd.read_sql_query(f"SELECT DISTINCT {column} FROM transactions", connection)
+        return SqliteStore.fromSql(values)[column]
+
+    def tableColumns(self, table = 'transactions') -> list:
+        return self.Columns + (['compaction_id'] if table == 'archive' else [])
+
+    @staticmethod
+    def where(start = None, end = None, **keys):
+        # WHERE clause of a time range and key values. Unknown keys raise a KeyError, as in TransactionIndex.
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("datetime >= ?")
+            params.append(SqliteStore.toNs(start))
+        if end is not None:
+            clauses.append("datetime < ?")
+            params.append(SqliteStore.toNs(end))
+        for key, values in keys.items():
+            if values is None:
+                continue
+            if key not in ('asset', 'exchange', 'userId', 'wallet', 'type'):
+                raise KeyError(f"Unknown key '{key}'")
+            values = list(values) if isinstance(values, (list, tuple, set, np.ndarray, pd.Series, pd.Index)) else [values]
+            clauses.append(f"{key} IN ({', '.join('?' * len(values))})")
+            params.extend(value.name if isinstance(value, (TransactionType, WalletType)) else str(value) for value in values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    # Writing
+
+    def write(self, transactions: pd.DataFrame, archive: pd.DataFrame = None):
+        """Make the stored transactions equal to `transactions`, by writing the differences in a single SQL transaction.
+
+        The archive is replaced if given. Nothing is written if an error occurs.
+        """
+        unknown = transactions.columns.difference(self.Columns)
+        if len(unknown):
+            raise ValueError(f"Columns not stored in the SQLite database: {', '.join(unknown)}")
+        rows = SqliteStore.toSql(transactions)
+        rows['fingerprint'] = SqliteStore.fingerprints(rows)
+        with span('sqlite:write', rows=len(rows)) as stage:
+            with self._connection() as connection:
+                stored = pd.read_sql_query("SELECT fingerprint, price_USD, amount_USD FROM transactions", connection)
+                isStored = rows['fingerprint'].isin(stored['fingerprint'])
+                removed = stored.loc[~stored['fingerprint'].isin(rows['fingerprint']), 'fingerprint']
+                # Rows stored with other prices, NaN being equal to NULL
+                merged = rows.loc[isStored, ['fingerprint', 'price_USD', 'amount_USD']].merge(stored, on='fingerprint', suffixes=('', '_stored'))
+                changed = merged[~(SqliteStore.same(merged['price_USD'], merged['price_USD_stored'])
+                                   & SqliteStore.same(merged['amount_USD'], merged['amount_USD_stored']))]
+                added = rows[~isStored]
+                with connection:
+                    connection.executemany("DELETE FROM transactions WHERE fingerprint = ?", ((int(f),) for f in removed))
+                    connection.executemany("UPDATE transactions SET price_USD = ?, amount_USD = ? WHERE fingerprint = ?",
+                                           SqliteStore.records(changed[['price_USD', 'amount_USD', 'fingerprint']]))
+                    insertColumns = self.Columns + ['fingerprint']
+                    connection.executemany(f"INSERT INTO transactions ({', '.join(insertColumns)}) VALUES ({', '.join('?' * len(insertColumns))})",
+                                           SqliteStore.records(added.reindex(columns=insertColumns)))
+                    if archive is not None:
+                        connection.execute("DELETE FROM archive")
+                        if not archive.empty:
+                            archiveColumns = self.tableColumns('archive')
+                            connection.executemany(f"INSERT INTO archive VALUES ({', '.join('?' * len(archiveColumns))})",
+                                                   SqliteStore.records(SqliteStore.toSql(archive).reindex(columns=archiveColumns)))
+                    connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            stage.set(removed=len(removed), updated=len(changed), added=len(added))
+
+    def backup(self, filename):
+        # Consistent copy of the database, including the pages of the write-ahead log
+        with self._connection() as connection, _ClosingConnection(sqlite3.connect(filename)) as target:
+            connection.backup(target)
+
+    # Conversions
+
+    @staticmethod
+    def fingerprints(rows: pd.DataFrame) -> pd.Series:
+        # Hash of the identity columns and of the occurrence of identical rows, which are distinct transactions
+        identity = rows.reindex(columns=SqliteStore.IdentityColumns)
+        identity['occurrence'] = identity.groupby(SqliteStore.IdentityColumns, dropna=False, sort=False).cumcount()
+        return pd.Series(pd.util.hash_pandas_object(identity, index=False).to_numpy().view(np.int64), index=rows.index)
+
+    @staticmethod
+    def toSql(transactions: pd.DataFrame) -> pd.DataFrame:
+        rows = transactions.copy()
+        if 'datetime' in rows.columns:
+            rows['datetime'] = SqliteStore.toNsArray(rows['datetime'])
+        for column, enum in (('type', TransactionType), ('wallet', WalletType)):
+            if column in rows.columns:
+                rows[column] = rows[column].map({member: member.name for member in enum})
+        if 'userId' in rows.columns:
+            rows['userId'] = rows['userId'].astype(str)
+        if 'note' in rows.columns:
+            rows['note'] = rows['note'].where(rows['note'].notna(), None)
+        return rows
+
+    @staticmethod
+    def fromSql(rows: pd.DataFrame) -> pd.DataFrame:
+        if 'datetime' in rows.columns:
+            rows['datetime'] = pd.to_datetime(rows['datetime'].astype(np.int64), unit='ns', utc=True)
+        if 'type' in rows.columns:
+            rows['type'] = rows['type'].map(TransactionType.__members__)
+        if 'wallet' in rows.columns:
+            rows['wallet'] = rows['wallet'].map(WalletType.__members__)
+        for column in ('amount', 'price_USD', 'amount_USD'):
+            if column in rows.columns:
+                rows[column] = rows[column].astype(float)
+        return rows
+
+    @staticmethod
+    def records(rows: pd.DataFrame):
+        # Python values for executemany. SQLite stores the NaN as NULL.
+        return zip(*[rows[column].tolist() for column in rows.columns])
+
+    @staticmethod
+    def same(a, b):
+        return (a == b) | (a.isna() & b.isna())
+
+    @staticmethod
+    def toNs(value) -> int:
+        value = pd.Timestamp(value)
+        if value.tzinfo is None:
+            value = value.tz_localize('UTC')
+        return value.as_unit('ns').value
+
+    @staticmethod
+    def toNsArray(datetimes) -> np.ndarray:
+        datetimes = pd.DatetimeIndex(datetimes)
+        if datetimes.tz is None:
+            datetimes = datetimes.tz_localize('UTC')
+        return datetimes.as_unit('ns').asi8
+
+
+class _ClosingConnection:
+    # sqlite3.Connection as a context manager commits, but does not close
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.close()
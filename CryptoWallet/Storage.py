@@ -0,0 +1,130 @@
+import contextlib
+import os
+import time
+import uuid
+
+# Storage helpers shared by the files of the wallet: the database, the archive, the price cache, the settings and the
+# historical prices. A single process writes a file at a time, under the exclusive lock of the file, and any number of
+# processes read it. Writes go to a temporary file which replaces the file atomically, so a reader opens either the
+# previous or the new version of the file, never a partial one, and needs no lock.
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """Advisory lock of a file, held on the companion file '<filename>.lock'.
+
+    The lock is exclusive by default, for the writer of the file. A shared lock lets several processes hold it at once,
+    e.g. to read several files consistently while no writer is active. On Windows, shared locks are exclusive.
+    The lock is not reentrant, and only excludes the processes that take it, it does not prevent other accesses.
+    """
+
+    PollInterval = 0.05  # Seconds between two attempts when a timeout is given
+
+    def __init__(self, filename, shared = False, timeout = None):
+        self.filename = filename
+        self.lockFilename = filename + '.lock'
+        self.shared = shared
+        self.timeout = timeout  # Seconds to wait for the lock, None to wait indefinitely
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None:
+            raise RuntimeError(f"The lock of {self.filename} is already held")
+        directory = os.path.dirname(self.lockFilename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file = open(self.lockFilename, 'a+b')
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            while not self._tryLock(file, blocking=deadline is None):
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timeout after {self.timeout} s waiting for the lock of {self.filename}")
+                time.sleep(self.PollInterval)
+        except BaseException:
+            file.close()
+            raise
+        self._file = file
+        return self
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    @property
+    def locked(self) -> bool:
+        return self._file is not None
+
+    def _tryLock(self, file, blocking) -> bool:
+        if os.name == 'nt':
+            file.seek(0)
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except OSError:
+                # LK_LOCK also gives up, after 10 attempts
+                return False
+            return True
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(file.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+@contextlib.contextmanager
+def atomicWrite(filename, mode = 'w', **kwargs):
+    """Open a temporary file to write the content of `filename`, and replace the file with it on success.
+
+    The temporary file is in the same directory, so the replacement is an atomic rename. Its content is flushed to
+    disk before, so the file is never replaced by a partial one, even after a crash. On error the file is unchanged.
+    kwargs are passed to open(), e.g. newline='' for pandas.to_csv().
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    temporaryFilename = os.path.join(directory, f"{os.path.basename(filename)}.{uuid.uuid4().hex[:12]}.tmp")
+    # Created with the permissions of a new file (0o666 minus the umask, applied by the system), never an existing file
+    fd = os.open(temporaryFilename, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with open(fd, mode, **kwargs) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(filename):
+            # Keep the permissions of the replaced file
+            os.chmod(temporaryFilename, os.stat(filename).st_mode & 0o777)
+        os.replace(temporaryFilename, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporaryFilename)
+        raise
+
+
+def fileSignature(filename):
+    """Identity of the current version of a file, None if it does not exist.
+
+    A file replaced by atomicWrite() has a new inode, so its signature changes even if its size and mtime do not.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
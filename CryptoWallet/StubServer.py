@@ -0,0 +1,133 @@
+import argparse
+import json
+import math
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class CryptoCompareStubServer:
+    """Local HTTP server implementing the pricemulti, histohour and histoday endpoints of the CryptoCompare API.
+
+    Prices are synthetic and deterministic: they only depend on the asset and the timestamp.
+    Use it with HttpTransport(baseUrl=server.url) to benchmark and test the fetch pipeline offline.
+    """
+    FirstTimestamp = 1420070400  # 2015-01-01, first candle returned when allData=true
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, unsupportedAssets=(), listings=None):
+        self.latency = latency  # in seconds, added to each request
+        self.unsupportedAssets = set(unsupportedAssets)
+        self.listings = dict(listings or {})  # asset: timestamp of its first candle, no candle is returned before
+        self.requestsCount = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._makeHandler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="CryptoCompareStubServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def price(asset, timestamp) -> float:
+        base = 1 + (zlib.crc32(asset.encode('utf-8')) % 100000) / 100
+        return base * (1 + 0.2 * math.sin(2 * math.pi * timestamp / (30 * 24 * 3600)))
+
+    def pricemulti(self, params):
+        fsyms = params.get('fsyms', '').split(',')
+        tsym = params.get('tsyms', 'USD').split(',')[0]
+        now = time.time()
+        data = {asset: {tsym: self.price(asset, now)} for asset in fsyms if asset and asset not in self.unsupportedAssets}
+        if not data:
+            return self._error(f"cccagg_or_exchange market does not exist for this coin pair ({fsyms[0]}-{tsym})")
+        return data
+
+    def histo(self, params, period):
+        asset = params.get('fsym', '')
+        if asset in self.unsupportedAssets:
+            return self._error(f"cccagg_or_exchange market does not exist for this coin pair ({asset}-USD)")
+        toTs = int(float(params.get('toTs', time.time())))
+        toTs -= toTs % period
+        if params.get('allData') == 'true':
+            fromTs = self.FirstTimestamp
+        else:
+            fromTs = toTs - int(params.get('limit', 1)) * period
+        candles = []
+        for ts in range(max(fromTs, self.listings.get(asset, fromTs)), toTs + 1, period):
+            price = self.price(asset, ts)
+            candles.append({'time': ts, 'high': price * 1.01, 'low': price * 0.99, 'open': price, 'close': price,
+                            'volumefrom': 1.0, 'volumeto': price, 'conversionType': 'direct', 'conversionSymbol': ''})
+        return {'Response': 'Success', 'Message': '', 'HasWarning': False, 'Type': 100, 'RateLimit': {},
+                'Data': {'Aggregated': False, 'TimeFrom': fromTs, 'TimeTo': toTs, 'Data': candles}}
+
+    @staticmethod
+    def _error(message):
+        return {'Response': 'Error', 'Message': message, 'HasWarning': False, 'Type': 2, 'RateLimit': {}, 'Data': {}}
+
+    def _makeHandler(self):
+        server = self
+        routes = {
+            '/data/pricemulti': server.pricemulti,
+            '/data/v2/histohour': lambda params: server.histo(params, 3600),
+            '/data/v2/histoday': lambda params: server.histo(params, 86400),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, so pooled sessions reuse their connections
+
+            def do_GET(self):
+                with server._lock:
+                    server.requestsCount += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                route = routes.get(url.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = json.dumps(route(params)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Don't print each request
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stub of the CryptoCompare API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Delay added to each request, in seconds")
+    args = parser.parse_args()
+    server = CryptoCompareStubServer(args.host, args.port, latency=args.latency)
+    print(f"CryptoCompare stub server listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
@@ -0,0 +1,235 @@
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from .Transaction import TransactionType
+from .Instrumentation import span
+
+# Disposal ledger of the wallet and tax reports per period, valued in USD.
+# The ledger is built once by replaying the transactions in datetime order, and extended with the transactions added
+# after its last transaction. The reports of any number of periods are then differences of prefix sums of the ledger.
+
+IncomeTypes = {TransactionType.STAKING_INTEREST, TransactionType.SAVING_INTEREST, TransactionType.REFERRAL_INTEREST,
+               TransactionType.DISTRIBUTION, TransactionType.MINING_INTEREST, TransactionType.INCOME}
+# Positive amounts are acquisitions and negative amounts are disposals
+TradeTypes = {TransactionType.SPOT_TRADE, TransactionType.REDENOMINATION}
+# Disposals without proceeds, or whose proceeds are the value spent
+SpendTypes = {TransactionType.SPEND, TransactionType.FEE, TransactionType.LOST, TransactionType.STOLEN}
+# Deposits, withdrawals, transfers, purchases and redemptions of savings and staking move the assets between
+# the wallets of the user. The lots of an asset are pooled across all the wallets and exchanges, so they are ignored.
+
+
+@dataclass(frozen=True)
+class TaxRules:
+    name: str
+    method: str = 'FIFO'             # 'FIFO' or 'AVERAGE' cost of the disposed assets
+    taxYearStart: tuple = (1, 1)     # (month, day) of the first day of the tax year
+    longTermDays: float = np.inf     # Holding period after which a gain is long term (FIFO only)
+    shortTermTaxed: bool = True
+    longTermTaxed: bool = True
+    incomeTaxed: bool = True
+    lossesDeductible: bool = True
+    lostIsDisposal: bool = True      # Lost and stolen assets realize a loss
+
+
+Jurisdictions = {
+    'US': TaxRules('US', longTermDays=365),
+    'UK': TaxRules('UK', method='AVERAGE', taxYearStart=(4, 6)),
+    'DE': TaxRules('DE', longTermDays=365, longTermTaxed=False),
+    'CH': TaxRules('CH', shortTermTaxed=False, longTermTaxed=False, lossesDeductible=False),
+}
+
+
+class DisposalLedger:
+    """Realized gains, income and fees of the transactions, one event per disposed lot, income or fee.
+
+    The lots still held are kept after each update, so that transactions added after the last processed one are
+    replayed from there, without replaying the history.
+    """
+    Columns = ['datetime', 'asset', 'type', 'amount', 'proceeds_USD', 'cost_USD', 'gain_USD', 'holding_days', 'income_USD', 'fees_USD', 'lost']
+
+    def __init__(self, method = 'FIFO', fiats = ()):
+        if method not in ('FIFO', 'AVERAGE'):
+            raise ValueError(f"Unknown cost method '{method}'. Use 'FIFO' or 'AVERAGE'.")
+        self.method = method
+        self.fiats = set(fiats)
+        self.version = 0  # Incremented at each change of the events, never reset
+        self.clear()
+
+    def clear(self):
+        self.version += 1
+        self.events = pd.DataFrame(columns=self.Columns)
+        self.lots = {}  # asset: deque of [amount, unit cost, acquisition datetime] (FIFO), or [amount, cost] (AVERAGE)
+        self.lastDatetime = None
+        self.fingerprint = None  # Fingerprint of the transactions up to lastDatetime, see fingerprintOf()
+
+    def update(self, transactions: pd.DataFrame) -> bool:
+        """Process the transactions not in the ledger yet. Return True if the events changed."""
+        if self.lastDatetime is not None:
+            isNew = (transactions['datetime'] > self.lastDatetime).to_numpy()
+            if DisposalLedger.fingerprintOf(transactions[~isNew]) == self.fingerprint:
+                if not isNew.any():
+                    return False
+                with span('ledger:extend', rows=int(isNew.sum())):
+                    self._process(transactions[isNew])
+                return True
+            # Transactions or prices were added, removed or modified before the end of the ledger
+            self.clear()
+        if transactions.empty:
+            return False
+        with span('ledger:build', rows=len(transactions)):
+            self._process(transactions)
+        return True
+
+    def _process(self, transactions):
+        transactions = transactions.sort_values('datetime', kind='stable')
+        self.lastDatetime = transactions['datetime'].iloc[-1]
+        relevant = transactions[~transactions['asset'].isin(self.fiats)
+                                & transactions['type'].isin(IncomeTypes | TradeTypes | SpendTypes)
+                                & (transactions['amount'] != 0)]
+        events = []
+        for datetime, asset, amount, transactionType, price in zip(relevant['datetime'], relevant['asset'], relevant['amount'],
+                                                                    relevant['type'], relevant['price_USD']):
+            if amount > 0:
+                self._acquire(asset, amount, price, datetime)
+                if transactionType in IncomeTypes:
+                    events.append((datetime, asset, transactionType, amount, 0.0, 0.0, 0.0, np.nan, amount * price, 0.0, False))
+            else:
+                proceeds = 0.0 if transactionType in (TransactionType.LOST, TransactionType.STOLEN) else -amount * price
+                for disposed, cost, holdingDays in self._dispose(asset, -amount, datetime):
+                    share = disposed / -amount
+                    events.append((datetime, asset, transactionType, disposed, proceeds * share, cost, proceeds * share - cost, holdingDays,
+                                   0.0, -amount * price * share if transactionType == TransactionType.FEE else 0.0,
+                                   transactionType in (TransactionType.LOST, TransactionType.STOLEN)))
+        if events:
+            newEvents = pd.DataFrame(events, columns=self.Columns)
+            self.events = newEvents if self.events.empty else pd.concat([self.events, newEvents], ignore_index=True)
+        fingerprint = DisposalLedger.fingerprintOf(transactions)
+        self.fingerprint = fingerprint if self.fingerprint is None else (self.fingerprint + fingerprint) % 2**64
+        self.version += 1
+
+    @staticmethod
+    def fingerprintOf(transactions) -> int:
+        # Sum modulo 2**64 of the hashes of the rows, like SqliteStore.fingerprints(). Changes when a transaction is added,
+        # removed, or its datetime, asset, type, amount or price is modified. The sum of two sets of rows is the sum of their fingerprints.
+        identity = pd.DataFrame({
+            'datetime': transactions['datetime'],
+            'asset': transactions['asset'],
+            'type': transactions['type'].astype(str),
+            'amount': transactions['amount'].astype(float),
+            'price_USD': transactions['price_USD'].astype(float),
+        })
+        return int(pd.util.hash_pandas_object(identity, index=False).to_numpy().sum(dtype=np.uint64))
+
+    def _acquire(self, asset, amount, price, datetime):
+        if self.method == 'FIFO':
+            self.lots.setdefault(asset, deque()).append([amount, price, datetime])
+        else:
+            pool = self.lots.setdefault(asset, [0.0, 0.0])
+            pool[0] += amount
+            pool[1] += amount * price
+
+    def _dispose(self, asset, amount, datetime):
+        # Yield (amount, cost, holding days) of the disposed lots. An amount not covered by the lots (e.g. history
+        # missing before the first export) has no cost.
+        if self.method == 'FIFO':
+            lots = self.lots.get(asset, ())
+            while amount > 1e-12 and lots:
+                lot = lots[0]
+                disposed = min(amount, lot[0])
+                yield disposed, disposed * lot[1], (datetime - lot[2]).total_seconds() / 86400
+                lot[0] -= disposed
+                amount -= disposed
+                if lot[0] <= 1e-12:
+                    lots.popleft()
+        else:
+            pool = self.lots.get(asset)
+            if pool is not None and pool[0] > 1e-12:
+                disposed = min(amount, pool[0])
+                cost = pool[1] * disposed / pool[0]
+                pool[0] -= disposed
+                pool[1] -= cost
+                amount -= disposed
+                yield disposed, cost, np.nan
+        if amount > 1e-12:
+            yield amount, 0.0, np.nan
+
+
+class TaxReport:
+    """Tax summaries of the periods of a disposal ledger, by the rules of a jurisdiction."""
+    SummaryColumns = ['proceeds_USD', 'cost_USD', 'gain_short_USD', 'gain_long_USD', 'income_USD', 'fees_USD',
+                      'taxable_gain_USD', 'taxable_income_USD']
+
+    def __init__(self, ledger: DisposalLedger, rules: TaxRules):
+        if ledger.method != rules.method:
+            raise ValueError(f"The rules of {rules.name} use the {rules.method} method, the ledger uses {ledger.method}")
+        self.ledger = ledger
+        self.rules = rules
+        self._version = None
+
+    def _prefixSums(self):
+        # Cumulative sums of the event columns, recomputed when the ledger changed
+        if self._version == self.ledger.version:
+            return
+        rules = self.rules
+        events = self.ledger.events
+        gain = events['gain_USD'].to_numpy(dtype=float)
+        isLong = events['holding_days'].to_numpy(dtype=float) > rules.longTermDays  # NaN holding days are short term
+        isLost = events['lost'].to_numpy(dtype=bool)
+        taxable = np.where(isLong, rules.longTermTaxed, rules.shortTermTaxed) & (~isLost | rules.lostIsDisposal)
+        taxableGain = np.where(taxable, gain, 0.0)
+        if not rules.lossesDeductible:
+            taxableGain = np.maximum(taxableGain, 0.0)
+        income = events['income_USD'].to_numpy(dtype=float)
+        values = np.column_stack([
+            events['proceeds_USD'].to_numpy(dtype=float), events['cost_USD'].to_numpy(dtype=float),
+            np.where(isLong, 0.0, gain), np.where(isLong, gain, 0.0),
+            income, events['fees_USD'].to_numpy(dtype=float),
+            taxableGain, income if rules.incomeTaxed else np.zeros_like(income),
+        ]) if len(events) else np.zeros((0, len(self.SummaryColumns)))
+        # Missing prices are counted as 0, the number of events without price is reported separately
+        self._missing = np.concatenate([[0], np.cumsum(np.isnan(values).any(axis=1))])
+        self._prefix = np.vstack([np.zeros((1, len(self.SummaryColumns))), np.nancumsum(values, axis=0)])
+        self._times = pd.DatetimeIndex(events['datetime']).as_unit('ns').asi8 if len(events) else np.zeros(0, dtype=np.int64)
+        self._version = self.ledger.version
+
+    def summary(self, start = None, end = None) -> pd.Series:
+        """Totals of the events in [start, end), in O(log n)."""
+        self._prefixSums()
+        first = 0 if start is None else np.searchsorted(self._times, TaxReport.toNs(start), side='left')
+        last = len(self._times) if end is None else np.searchsorted(self._times, TaxReport.toNs(end), side='left')
+        summary = pd.Series(self._prefix[last] - self._prefix[first], index=self.SummaryColumns)
+        summary['events_without_price'] = self._missing[last] - self._missing[first]
+        return summary
+
+    def periods(self, freq = 'Y') -> pd.DataFrame:
+        """Summary of each tax year ('Y'), quarter ('Q') or month ('M'), from the first to the last event."""
+        self._prefixSums()
+        if len(self._times) == 0:
+            return pd.DataFrame(columns=self.SummaryColumns + ['events_without_price'])
+        first, last = pd.Timestamp(self._times[0], tz='UTC'), pd.Timestamp(self._times[-1], tz='UTC')
+        month, day = self.rules.taxYearStart
+        if freq == 'Y':
+            bounds = [pd.Timestamp(year, month, day, tz='UTC') for year in range(first.year - 1, last.year + 2)]
+        elif freq in ('Q', 'M'):
+            bounds = list(pd.date_range(first.tz_convert(None).to_period(freq).start_time.tz_localize('UTC'), last + pd.offsets.MonthBegin(1),
+                                        freq='QS' if freq == 'Q' else 'MS'))
+        else:
+            raise ValueError(f"Unknown period '{freq}'. Use 'Y', 'Q' or 'M'.")
+        rows = {}
+        for periodStart, periodEnd in zip(bounds[:-1], bounds[1:]):
+            if periodEnd <= first or periodStart > last:
+                continue
+            label = periodStart.year if freq == 'Y' and (month, day) == (1, 1) else \
+                f"{periodStart.year}/{periodEnd.year}" if freq == 'Y' else periodStart.strftime('%Y-%m')
+            rows[label] = self.summary(periodStart, periodEnd)
+        report = pd.DataFrame(rows).T
+        report.index.name = 'period'
+        return report
+
+    @staticmethod
+    def toNs(value) -> int:
+        value = pd.Timestamp(value)
+        if value.tzinfo is None:
+            value = value.tz_localize('UTC')
+        return value.as_unit('ns').value
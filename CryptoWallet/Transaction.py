@@ -42,6 +42,10 @@ class WalletType(MyEnum):
     FUNDING = "Funding"
 
 
+# USD and the stablecoins pegged to it, valued 1 USD
+StableCoinsUSD = {'USDT', 'USDC', 'DAI', 'BUSD', 'USD', 'USDS', 'USDe', 'FDUSD', 'USDD', 'PYUSD', 'TUSD'}
+
+
 @dataclass
 class Transaction(object):
     datetime: datetime
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+
+class TransactionIndex:
+    """Row positions of a transactions DataFrame, sorted by datetime and grouped by key column.
+
+    A query by time range and key values is answered with a binary search in the positions of the
+    smallest selected group, in O(log n + k), instead of a boolean mask over the whole DataFrame.
+    The groups of a key column are only built on the first query using this column.
+    The index is immutable: it must be rebuilt when the transactions are replaced or their indexed columns modified.
+    """
+    Keys = ('asset', 'exchange', 'userId', 'wallet', 'type')
+
+    def __init__(self, transactions: pd.DataFrame):
+        self.transactions = transactions
+        self.length = len(transactions)
+        if 'datetime' in transactions.columns and self.length > 0:
+            datetimes = pd.DatetimeIndex(transactions['datetime'])
+            self.tz = datetimes.tz
+            times = datetimes.as_unit('ns').asi8
+        else:
+            self.tz = None
+            times = np.zeros(self.length, dtype=np.int64)
+        self.order = np.argsort(times, kind='stable')  # Positions sorted by datetime
+        self.times = times[self.order]
+        self._groups = {}  # key: {value: (positions, times)}, both sorted by datetime
+
+    def isValidFor(self, transactions) -> bool:
+        # Catch the replacement of the DataFrame, not the in-place modification of its columns
+        return self.transactions is transactions and self.length == len(transactions)
+
+    def _group(self, key) -> dict:
+        if key not in self._groups:
+            groups = {}
+            if key in self.transactions.columns:
+                codes, uniques = pd.factorize(self.transactions[key].to_numpy()[self.order])
+                # Stable sort by code, to keep each group sorted by datetime
+                byCode = np.argsort(codes, kind='stable')
+                bounds = np.searchsorted(codes[byCode], np.arange(len(uniques) + 1))
+                for code, value in enumerate(uniques):
+                    inGroup = byCode[bounds[code]:bounds[code + 1]]
+                    groups[value] = (self.order[inGroup], self.times[inGroup])
+            self._groups[key] = groups
+        return self._groups[key]
+
+    def _toNs(self, value) -> int:
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is None and self.tz is not None:
+            timestamp = timestamp.tz_localize(self.tz)
+        elif timestamp.tzinfo is not None and self.tz is None:
+            timestamp = timestamp.tz_convert(None)
+        return timestamp.as_unit('ns').value
+
+    def _slice(self, positions, times, start, end):
+        first = 0 if start is None else np.searchsorted(times, self._toNs(start), side='left')
+        last = len(times) if end is None else np.searchsorted(times, self._toNs(end), side='left')
+        return positions[first:last], times[first:last]
+
+    def positions(self, start=None, end=None, **keys) -> np.ndarray:
+        """Return the row positions of the transactions in [start, end), sorted by datetime.
+
+        keys are column names of TransactionIndex.Keys, with a value or a list of values, e.g. asset=['BTC', 'ETH'].
+        """
+        unknown = set(keys) - set(self.Keys)
+        if unknown:
+            raise KeyError(f"Transactions can't be queried by {', '.join(sorted(unknown))}. Use one of {', '.join(self.Keys)}.")
+        selections = {key: (value if isinstance(value, (list, tuple, set)) else [value]) for key, value in keys.items() if value is not None}
+        if not selections:
+            return self._slice(self.order, self.times, start, end)[0]
+
+        # Slice the smallest selected group(s), and check the other keys only on the k rows found
+        def size(key):
+            groups = self._group(key)
+            return sum(len(groups[v][0]) for v in selections[key] if v in groups)
+        mainKey = min(selections, key=size)
+        groups = self._group(mainKey)
+        slices = [self._slice(*groups[v], start, end) for v in selections[mainKey] if v in groups]
+        if not slices:
+            return np.empty(0, dtype=np.intp)
+        positions = np.concatenate([p for p, _ in slices])
+        if len(slices) > 1:
+            positions = positions[np.argsort(np.concatenate([t for _, t in slices]), kind='stable')]
+        for key, values in selections.items():
+            if key != mainKey:
+                positions = positions[pd.Series(self.transactions[key].to_numpy()[positions]).isin(values).to_numpy()]
+        return positions
+
+    def query(self, start=None, end=None, **keys) -> pd.DataFrame:
+        return self.transactions.iloc[self.positions(start, end, **keys)]
@@ -0,0 +1,214 @@
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .Instrumentation import span
+
+API_BASE_URL = 'https://min-api.cryptocompare.com/'
+# Parameters that don't change the content of a response, and are not stored in the archives
+IgnoredParams = {'apiKey', 'extraParams'}
+
+
+class TransportError(Exception):
+    pass
+
+
+class Response:
+    """Minimal response returned by the offline transports, with the same interface as requests.Response."""
+    def __init__(self, status_code, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Transport:
+    """Send the GET requests of CryptoCompareWrapper.
+
+    Subclasses implement request(), which is synchronous. session() wraps it in a thread pool,
+    with the same interface as a FuturesSession: get(url=endpoint, params=...) returns a Future.
+    """
+
+    def request(self, endpoint, params):
+        raise NotImplementedError
+
+    def get(self, endpoint, params):
+        return self.tracedRequest(endpoint, params)
+
+    def tracedRequest(self, endpoint, params):
+        # Record a span for each API call, with the requested asset(s) and the size of the response
+        with span(f"api:{endpoint}", asset=params.get('fsym', params.get('fsyms'))) as stage:
+            response = self.request(endpoint, params)
+            stage.set(status=response.status_code, bytes=len(response.content))
+            return response
+
+    def session(self, max_workers=1):
+        return TransportSession(self, max_workers)
+
+    def close(self):
+        pass
+
+
+class TransportSession:
+    def __init__(self, transport, max_workers=1):
+        self.transport = transport
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+    def get(self, url, params):
+        return self.executor.submit(self.transport.tracedRequest, url, params)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HttpTransport(Transport):
+    """Send the requests to the CryptoCompare API, or any server implementing it, over a pooled session."""
+
+    def __init__(self, baseUrl=API_BASE_URL, poolSize=16, timeout=30):
+        self.baseUrl = baseUrl if baseUrl.endswith('/') else baseUrl + '/'
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self._session = None
+        self._sessionLock = threading.Lock()
+
+    def _getSession(self):
+        # requests is imported and the session created on the first request, to keep the package import fast
+        with self._sessionLock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.poolSize, pool_maxsize=self.poolSize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def request(self, endpoint, params):
+        import requests
+        session = self._getSession()
+        try:
+            return session.get(url=self.baseUrl + endpoint, params=params, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise TransportError(e)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def requestKey(endpoint, params) -> str:
+    # Key identifying a request in an archive. The parameters are sorted and the API key is removed.
+    params = {k: str(v) for k, v in params.items() if k not in IgnoredParams}
+    return endpoint + '?' + '&'.join(f"{k}={params[k]}" for k in sorted(params))
+
+
+class RecordingTransport(Transport):
+    """Forward the requests to an other transport, and record the responses in a gzipped JSON archive.
+
+    The archive is written by save(), or when leaving the `with` block.
+    """
+
+    def __init__(self, archiveFilename, transport=None):
+        self.archiveFilename = archiveFilename
+        self.transport = HttpTransport() if transport is None else transport
+        self.records = loadArchive(archiveFilename, missingOk=True)
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, params):
+        response = self.transport.request(endpoint, params)
+        with self._lock:
+            self.records[requestKey(endpoint, params)] = {
+                'status_code': response.status_code,
+                'body': response.content.decode('utf-8')
+            }
+        return response
+
+    def save(self):
+        with self._lock:
+            records = dict(self.records)
+        saveArchive(self.archiveFilename, records)
+        print(f"{len(records)} responses recorded in {self.archiveFilename}")
+
+    def close(self):
+        self.save()
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayTransport(Transport):
+    """Serve the responses recorded by a RecordingTransport, without any network access.
+
+    latency: delay in seconds added to each request, or a (min, max) tuple for a random delay.
+    rateLimitEvery: return a rate limit error every n requests (0 to disable).
+    rateLimitProbability: probability of returning a rate limit error for each request.
+    """
+    RateLimitBody = {
+        'Response': 'Error',
+        'Message': 'You are over your rate limit please upgrade your account!',
+        'HasWarning': False,
+        'Type': 99,
+        'RateLimit': {},
+        'Data': {}
+    }
+
+    def __init__(self, archiveFilename, latency=0.0, rateLimitEvery=0, rateLimitProbability=0.0, seed=None):
+        self.records = loadArchive(archiveFilename)
+        self.latency = latency
+        self.rateLimitEvery = rateLimitEvery
+        self.rateLimitProbability = rateLimitProbability
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requestsCount = 0
+
+    def request(self, endpoint, params):
+        with self._lock:
+            self.requestsCount += 1
+            count = self.requestsCount
+            delay = self.latency if not isinstance(self.latency, tuple) else self._random.uniform(*self.latency)
+            rateLimited = ((self.rateLimitEvery and count % self.rateLimitEvery == 0)
+                           or self._random.random() < self.rateLimitProbability)
+        if delay:
+            time.sleep(delay)
+        if rateLimited:
+            return Response(429, json.dumps(self.RateLimitBody).encode('utf-8'))
+
+        key = requestKey(endpoint, params)
+        if key not in self.records:
+            raise TransportError(f"No recorded response for the request '{key}'")
+        record = self.records[key]
+        return Response(record['status_code'], record['body'].encode('utf-8'))
+
+
+def loadArchive(archiveFilename, missingOk=False) -> dict:
+    try:
+        with gzip.open(archiveFilename, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if missingOk:
+            return {}
+        raise FileNotFoundError(f"Archive {archiveFilename} not found")
+
+
+def saveArchive(archiveFilename, records):
+    directory = os.path.dirname(archiveFilename)
+    if directory:  # Only create directories if there's actually a path component
+        os.makedirs(directory, exist_ok=True)
+    with gzip.open(archiveFilename, 'wt', encoding='utf-8') as f:
+        json.dump(records, f, separators=(',', ':'))
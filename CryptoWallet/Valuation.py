@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from .CryptoCompareWrapper import CryptoCompareWrapper
+
+
+class Valuation:
+    """Convert values in USD to another currency, with the daily rates of the price panel.
+
+    The rate of a currency is its daily USD close price, requested once a day with requestDailyHistoricalPrices(),
+    and stored in the price panel with the prices of the other assets. A value at a datetime is converted with the
+    rate of its day, or of the last day before with a rate. The conversion is a binary search of the datetimes in the
+    dates of the rates, so any number of transactions is converted without API call nor copy of the transactions.
+    """
+
+    def __init__(self, currency, apiKey = None):
+        self.currency = currency
+        self.apiKey = apiKey
+        self._rates = None
+        self._ratesDay = None  # Day of the last update of the rates
+
+    def rates(self) -> pd.Series:
+        """USD value of one unit of the currency, per day."""
+        if self.currency == 'USD':
+            return pd.Series(dtype=float)
+        today = pd.Timestamp.now(tz='UTC').normalize()
+        if self._rates is None or self._ratesDay != today:
+            if self.apiKey is not None:
+                CryptoCompareWrapper.requestDailyHistoricalPrices(self.currency, self.apiKey)
+            panel = CryptoCompareWrapper.getPricePanel()
+            panel.reload()
+            if self.currency not in panel.assets:
+                raise Exception(f"No exchange rate of {self.currency} in the price panel, and no API key to request it")
+            self._rates = panel.prices([self.currency])[self.currency].ffill().dropna()
+            self._ratesDay = today
+        return self._rates
+
+    def currentRate(self) -> float:
+        # Rate of the last day, used for the current values
+        if self.currency == 'USD':
+            return 1.0
+        return float(self.rates().iloc[-1])
+
+    def rateAt(self, datetimes) -> np.ndarray:
+        """USD value of one unit of the currency at each datetime, NaN before the first rate."""
+        if self.currency == 'USD':
+            return np.ones(len(datetimes))
+        rates = self.rates()
+        positions = rates.index.searchsorted(pd.DatetimeIndex(datetimes), side='right') - 1
+        return np.where(positions >= 0, rates.to_numpy()[np.maximum(positions, 0)], np.nan)
+
+    def convertAt(self, valuesUSD, datetimes):
+        """Convert each value in USD at its datetime. Values before the first rate are NaN."""
+        if self.currency == 'USD':
+            return valuesUSD
+        converted = np.asarray(valuesUSD, dtype=float) / self.rateAt(datetimes)
+        if isinstance(valuesUSD, pd.Series):
+            return pd.Series(converted, index=valuesUSD.index, name=valuesUSD.name)
+        return converted
+
+    def convertCurrent(self, valuesUSD):
+        """Convert current values in USD, e.g. holdings valued with the current prices."""
+        return valuesUSD / self.currentRate()
+
+    def convertSeries(self, valuesUSD):
+        """Convert a time series in USD, indexed by datetime, e.g. the value of the historical holdings."""
+        if self.currency == 'USD':
+            return valuesUSD
+        rates = self.rates()
+        positions = rates.index.searchsorted(valuesUSD.index, side='right') - 1
+        valueRates = np.where(positions >= 0, rates.to_numpy()[np.maximum(positions, 0)], np.nan)
+        if isinstance(valuesUSD, pd.DataFrame):
+            return valuesUSD.div(valueRates, axis=0)
+        return valuesUSD / valueRates
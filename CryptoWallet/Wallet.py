@@ -1,50 +1,177 @@
 #!/usr/bin/env python3
 
-from .Transaction import TransactionType, WalletType
+from .Transaction import TransactionType, WalletType, StableCoinsUSD
 import pandas as pd
 import numpy as np
 import os
+import sys
 import time
 import pickle
-from .CryptoCompareWrapper import CryptoCompareWrapper
+import weakref
+from .Instrumentation import span, traced
+from .Storage import FileLock, atomicWrite, fileSignature
+# The other modules of the package are imported by the methods which use them, to keep the import of the wallet fast
 
 # from dotenv import load_dotenv
 # load_dotenv()
 
 class Wallet(object):
-    def __init__(self, apiKey = None, databaseFilename = None):
+    def __init__(self, apiKey = None, databaseFilename = None, lazy = False):
+        # With lazy=True, the database and the price cache are only read on first access
         self.apiKey = apiKey
         self.databaseFilename = databaseFilename
+        self._transactions = None
+        self._archive = None
+        self._store = None
+        self._transactionIndex = None
+        self._databaseSignature = None  # (filename, signature) of the database version read by open(), see save()
+        self._historicalAmountsCache = {}  # (freq, by): (holdings, number of rows before the last period)
+        self._disposalLedgers = {}  # cost method: DisposalLedger
+        self._taxReports = {}  # TaxRules: TaxReport
+        self._valuations = {}  # currency: Valuation
+        self._transactionsValues = {}  # currency: (transactions, amount_USD of the transactions converted to the currency)
         if self.databaseFilename is not None and os.path.exists(self.databaseFilename):
-            self.open(self.databaseFilename)
+            if not lazy:
+                self.open(self.databaseFilename)
         else:
             print("No database file provided or file not found, creating an empty wallet.")
             self.transactions = pd.DataFrame()
         
-        # Load cache from the pickle file "cache.pkl" if it exists
-        self.cacheFilename = ".CryptoWallet/currentPriceCache.pkl"
+        # The cache is loaded from the pickle file on first access, see the cache property.
+        # Absolute, so that the cache saved by __del__ goes where it was read, whatever the working directory is then.
+        self.cacheFilename = os.path.abspath(".CryptoWallet/currentPriceCache.pkl")
+        self._cache = None
             
         self.cacheLifetime = 60*60 # 60 min in seconds
-        if os.path.exists(self.cacheFilename):
-          with open(self.cacheFilename, 'rb') as file:
-            self.cache = pickle.load(file)
-        else:
-            self.cache = {}
+        if not lazy:
+            self.cache
+        
+        # Optional background refresher of the current prices, see startPriceRefresher()
+        self.priceRefresher = None
 
     def __del__(self):
+        if getattr(self, 'priceRefresher', None) is not None:
+            self.priceRefresher.stop(timeout=1)
         self.saveCache()
+
+    @property
+    def transactions(self) -> pd.DataFrame:
+        if self._transactions is None:
+            # Lazy wallet: read the database on first access
+            self.open(self.databaseFilename, displaySummary=False)
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, value):
+        self._transactions = value
+        self._transactionIndex = None
+        if getattr(self, 'priceRefresher', None) is not None and 'asset' in value:
+            # The refresher thread fetches its own copy of the assets, it never reads the transactions
+            self.priceRefresher.setAssets(value['asset'].unique())
+
+    @property
+    def store(self):
+        # Database backend selected by the extension of databaseFilename: SqliteStore for .db, PartitionedStore for a
+        # .parquet directory, None for a CSV file
+        if self._store is None or self._store.filename != self.databaseFilename:
+            self._store = Wallet.openStore(self.databaseFilename)
+        return self._store
+
+    @staticmethod
+    def openStore(filename):
+        from .SqliteStore import SqliteStore
+        if SqliteStore.handles(filename):
+            return SqliteStore(filename)
+        from .PartitionedStore import PartitionedStore
+        if PartitionedStore.handles(filename):
+            return PartitionedStore(filename)
+        return None
+
+    @property
+    def outOfCore(self) -> bool:
+        # Lazy wallet with a database store, before the first access to the transactions: the getters which support it
+        # are computed by the store, without reading the whole history
+        return self._transactions is None and self.store is not None
+
+    @property
+    def archive(self) -> pd.DataFrame:
+        # Raw rows replaced by compactInterestRows(), with the compaction_id of the row replacing them. Read on first access.
+        if self._archive is None:
+            if self.store is not None:
+                self._archive = self.store.read(table='archive')
+            elif self.archiveFilename is not None and os.path.exists(self.archiveFilename):
+                self._archive = Wallet.readTransactionsCsv(self.archiveFilename)
+            else:
+                self._archive = pd.DataFrame()
+        return self._archive
+
+    @property
+    def archiveFilename(self):
+        if self.databaseFilename is None:
+            return None
+        root, extension = os.path.splitext(self.databaseFilename)
+        return f"{root}_archive{extension}"
+
+    @property
+    def transactionIndex(self) -> 'TransactionIndex':
+        # Rebuilt when the transactions are replaced. Call invalidateTransactionIndex() after modifying
+        # the datetime or the key columns of the transactions in place.
+        from .TransactionIndex import TransactionIndex
+        if self._transactionIndex is None or not self._transactionIndex.isValidFor(self.transactions):
+            with span('build_index', rows=len(self.transactions)):
+                self._transactionIndex = TransactionIndex(self.transactions)
+        return self._transactionIndex
+
+    def invalidateTransactionIndex(self):
+        self._transactionIndex = None
+        self._historicalAmountsCache = {}
+        self._transactionsValues = {}
+
+    def query(self, start = None, end = None, asset = None, exchange = None, userId = None, wallet = None, type = None) -> pd.DataFrame:
+        """Return the transactions in [start, end) matching the given keys, sorted by datetime.
+
+        Each key is a value or a list of values, e.g. wallet.query('2023', '2024', asset='ETH', wallet=WalletType.STAKING).
+        """
+        if self.outOfCore:
+            return self.store.read(None, start, end, asset=asset, exchange=exchange, userId=userId, wallet=wallet, type=type)
+        return self.transactionIndex.query(start, end, asset=asset, exchange=exchange, userId=userId, wallet=wallet, type=type)
+
+    @property
+    def cache(self) -> dict:
+        if self._cache is None:
+            # Load cache from the pickle file if it exists
+            self._cache = Wallet.readCache(self.cacheFilename)
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        self._cache = value
     
-    def open(self, filepath_or_buffer):
+    @traced
+    def open(self, filepath_or_buffer, displaySummary = True):
         #Check that filepath_or_buffer exists
         if not os.path.exists(filepath_or_buffer):
             raise FileNotFoundError(f"File {filepath_or_buffer} not found")
-        self.transactions = pd.read_csv(filepath_or_buffer, parse_dates=['datetime'], date_format='ISO8601', converters={
+        # The file is replaced atomically by the writers, the signature is the one of the version read
+        signature = Wallet.databaseSignature(filepath_or_buffer)
+        store = self.store if filepath_or_buffer == self.databaseFilename else Wallet.openStore(filepath_or_buffer)
+        if store is not None:
+            self.transactions = store.read()
+        else:
+            self.transactions = Wallet.readTransactionsCsv(filepath_or_buffer)
+        self._databaseSignature = (os.path.abspath(filepath_or_buffer), signature)
+        if displaySummary:
+            self.printFirstLastTransactionDatetime()
+
+    @staticmethod
+    def readTransactionsCsv(filepath_or_buffer) -> pd.DataFrame:
+        return pd.read_csv(filepath_or_buffer, parse_dates=['datetime'], date_format='ISO8601', converters={
             'type' : lambda s: TransactionType[s],
             'wallet' : lambda s: WalletType[s],
             'userId' : lambda s: str(s)
         })
-        self.printFirstLastTransactionDatetime()
         
+    @traced
     def save(self):
         if self.databaseFilename is None:
             raise ValueError("No database filename provided. Set Wallet.databaseFilename.")
@@ -54,12 +181,45 @@ class Wallet(object):
         
         self.checkIntegrity()
         
-        self.backup()
-            
-        # After backup, save the transactions to the original file
-        self.transactions.to_csv(self.databaseFilename, index=False)
+        # Single writer: the database and its archive are written under the lock of the database, and replaced
+        # atomically, so that the readers see either the previous or the new version of the files.
+        with FileLock(self.databaseFilename):
+            self.checkNotModified()
+            self.backup()
+                
+            # After backup, save the transactions to the original file
+            if self.store is not None:
+                # Only the changes are written, in a single SQL transaction. The archive is only written if it was read.
+                self.store.write(self.transactions, self._archive)
+            else:
+                with span('to_csv', rows=len(self.transactions)) as stage:
+                    with atomicWrite(self.databaseFilename, newline='') as file:
+                        self.transactions.to_csv(file, index=False)
+                    stage.set(bytes=os.path.getsize(self.databaseFilename))
+                # The archive is only written if it was read or modified
+                if self._archive is not None and (not self._archive.empty or os.path.exists(self.archiveFilename)):
+                    with atomicWrite(self.archiveFilename, newline='') as file:
+                        self._archive.to_csv(file, index=False)
+            self._databaseSignature = (os.path.abspath(self.databaseFilename), Wallet.databaseSignature(self.databaseFilename))
         print(f"Transactions saved to {self.databaseFilename}")
+
+    def checkNotModified(self):
+        # Another process saved the database since this wallet read it: saving would silently drop its transactions
+        filename = os.path.abspath(self.databaseFilename)
+        readSignature = self._databaseSignature[1] if self._databaseSignature is not None and self._databaseSignature[0] == filename else None
+        if Wallet.databaseSignature(filename) != readSignature:
+            raise Exception(f"The database {self.databaseFilename} was modified by another process since it was read. "
+                            "Open it again and redo the changes.")
+
+    @staticmethod
+    def databaseSignature(filename):
+        # Version of the database, None if it does not exist. A database store counts its writes, a CSV file is replaced.
+        if not os.path.exists(filename):
+            return None
+        store = Wallet.openStore(filename)
+        return store.version() if store is not None else fileSignature(filename)
     
+    @traced
     def backup(self):
         if self.databaseFilename is None:
             raise ValueError("No database filename provided. Set Wallet.databaseFilename.")
@@ -77,11 +237,15 @@ class Wallet(object):
             backup_path = os.path.join(backup_folder, base_filename)
             
             # Copy the file to the backup location
-            # Use shutil.copy2 to preserve metadata, or shutil.copy if metadata is not important
-            import shutil
-            shutil.copy2(self.databaseFilename, backup_path)
+            if self.store is not None:
+                self.store.backup(backup_path)
+            else:
+                # Use shutil.copy2 to preserve metadata, or shutil.copy if metadata is not important
+                import shutil
+                shutil.copy2(self.databaseFilename, backup_path)
             print(f"Backup saved to {backup_path}")
 
+    @traced
     def checkIntegrity(self):        
         # Check that datetime, asset, amount, type, exchange, userId, wallet are not null
         required_columns = ['datetime', 'asset', 'amount', 'type', 'exchange', 'userId', 'wallet']
@@ -100,14 +264,28 @@ class Wallet(object):
         
         
     def saveCache(self):
-        # create the directory to store the cache
-        directory = os.path.dirname(self.cacheFilename)
-        if directory:  # Only create directories if there's actually a path component
-            os.makedirs(directory, exist_ok=True)
-            
-        with open(self.cacheFilename, 'wb') as file:
-            pickle.dump(self.cache, file)
+        # Nothing to save if the cache was never loaded
+        if getattr(self, '_cache', None) is None:
+            return
+        # The cache is shared by the processes: merge it with the cache saved by the others, keeping the latest prices
+        with FileLock(self.cacheFilename):
+            cache = Wallet.readCache(self.cacheFilename)
+            for asset, info in self._cache.items():
+                if asset not in cache or cache[asset]['timestamp'] <= info['timestamp']:
+                    cache[asset] = info
+            with atomicWrite(self.cacheFilename, 'wb') as file:
+                pickle.dump(cache, file)
+        self._cache = cache
+
+    @staticmethod
+    def readCache(filename) -> dict:
+        # The file is replaced atomically by saveCache(), it is read without lock
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'rb') as file:
+            return pickle.load(file)
             
+    @traced
     def addTransactions(self, transactions, mergeSimilar = True, removeExisting = True):
         if transactions.empty:
             return
@@ -118,32 +296,56 @@ class Wallet(object):
             transactions = self.mergeTransactionsInWindow(transactions, window=15*60)
             
         if removeExisting:
-            # Remove transactions that are already in the wallet transactions. For each unique group of "exchange" and "userId", keep the transaction that have a datetime ouside the range between the earliest and latest datetime of the group.
-            for (exchange, userId), group in transactions.groupby(['exchange', 'userId']):
-                # Test if there is already transactions in the wallet for the same exchange and userId
-                if 'exchange' in self.transactions.columns and 'userId' in self.transactions.columns:
-                    existingGroupTransactions = self.transactions[(self.transactions['exchange'] == exchange) & (self.transactions['userId'] == userId)]
-                    if not existingGroupTransactions.empty:
-                        earliest, latest = existingGroupTransactions["datetime"].agg(['min', 'max'])
-                        mask = (group['datetime'] >= earliest) & (group['datetime'] <= latest)
-                        if mask.any():
-                            print(f"Removing {mask.sum()}/{len(group)} transactions from {exchange} {userId} already existing in the wallet.")
-                        transactions = transactions.drop(group.index[mask])
+            with span('dedup', rowsIn=len(transactions)) as stage:
+                # Remove transactions that are already in the wallet transactions. For each unique group of "exchange" and "userId", keep the transaction that have a datetime ouside the range between the earliest and latest datetime of the group.
+                for (exchange, userId), group in transactions.groupby(['exchange', 'userId']):
+                    # Test if there is already transactions in the wallet for the same exchange and userId
+                    if 'exchange' in self.transactions.columns and 'userId' in self.transactions.columns:
+                        existingGroupTransactions = self.query(exchange=exchange, userId=userId)
+                        if not self.archive.empty:
+                            # The raw rows of the compacted rows are also in the wallet
+                            existingGroupTransactions = pd.concat([existingGroupTransactions, self.archive[(self.archive['exchange'] == exchange) & (self.archive['userId'] == userId)]])
+                        if not existingGroupTransactions.empty:
+                            earliest, latest = existingGroupTransactions["datetime"].agg(['min', 'max'])
+                            mask = (group['datetime'] >= earliest) & (group['datetime'] <= latest)
+                            if mask.any():
+                                print(f"Removing {mask.sum()}/{len(group)} transactions from {exchange} {userId} already existing in the wallet.")
+                            transactions = transactions.drop(group.index[mask])
+                stage.set(rows=len(transactions))
             
-        newDf = pd.concat([self.transactions, transactions], ignore_index=True)
-        
-        self.transactions = newDf.sort_values("datetime")         
+        with span('concat_sort', rows=len(self.transactions) + len(transactions)):
+            newDf = pd.concat([self.transactions, transactions], ignore_index=True)
+            
+            self.transactions = newDf.sort_values("datetime")         
                     
     def getAmountTotByAsset(self):
+        if self.outOfCore:
+            return self.store.aggregate('asset', ['amount'])['amount']
         return self.transactions.groupby("asset")['amount'].sum()
             
     
-    def getCostTot(self):
-        transactions = self.transactions[(self.transactions['type'].isin([
-        TransactionType.SPOT_TRADE, TransactionType.STAKING_PURCHASE, TransactionType.STAKING_REDEMPTION, TransactionType.SAVING_PURCHASE, 
-        TransactionType.SAVING_REDEMPTION,TransactionType.DEPOSIT, TransactionType.WITHDRAW, TransactionType.SPEND, TransactionType.INCOME, TransactionType.REDENOMINATION, TransactionType.ACCOUNT_TRANSFER]))]
-
-        return transactions.groupby(["asset"])['amount_USD'].sum().rename("cost_USD")
+    def getCostTot(self, currency = 'USD'):
+        if self.outOfCore and currency == 'USD':
+            return self.store.aggregate('asset', ['amount_USD'], type=Wallet.CostTypes)['amount_USD'].rename(f"cost_{currency}")
+        mask = self.transactions['type'].isin(Wallet.CostTypes)
+
+        return self.getTransactionsValue(currency)[mask].groupby(self.transactions.loc[mask, 'asset']).sum().rename(f"cost_{currency}")
+
+    def getValuation(self, currency) -> 'Valuation':
+        from .Valuation import Valuation
+        if currency not in self._valuations:
+            self._valuations[currency] = Valuation(currency, self.apiKey)
+        return self._valuations[currency]
+
+    def getTransactionsValue(self, currency = 'USD') -> pd.Series:
+        # amount_USD of the transactions converted at their datetime. Cached until the transactions are replaced.
+        if currency == 'USD':
+            return self.transactions['amount_USD']
+        cached = self._transactionsValues.get(currency)
+        if cached is None or cached[0] is not self.transactions:
+            values = self.getValuation(currency).convertAt(self.transactions['amount_USD'], self.transactions['datetime'])
+            self._transactionsValues[currency] = (self.transactions, values.rename(f"amount_{currency}"))
+        return self._transactionsValues[currency][1]
     
     def getTransactions(self, remove_datetime_timezone = False):
         transactions = self.transactions.copy()
@@ -153,8 +355,47 @@ class Wallet(object):
         
     
     def getAssetsList(self) -> pd.Series:
+        if self.outOfCore:
+            return self.store.distinct('asset')
         return pd.Series(self.transactions['asset'].unique())
           
+    def startPriceRefresher(self, interval = None):
+        # Fetch the current prices periodically on a worker thread. While the refresher is running,
+        # getCurrentPrices() is always served immediately from its latest snapshot.
+        if self.apiKey is None:
+            print("No API key provided, price refresher not started")
+            return None
+        from .PriceRefresher import PriceRefresher
+        if self.priceRefresher is None:
+            # Seed the first snapshot with the cached prices, so that reads are served before the first fetch
+            cachedPrices = {asset: info['value'] for asset, info in self.cache.items()}
+            oldestTimestamp = min((info['timestamp'] for info in self.cache.values()), default=0.0)
+            self.priceRefresher = PriceRefresher(self.getAssetsList(), self.apiKey,
+                                                 interval=self.cacheLifetime if interval is None else interval,
+                                                 initialPrices=cachedPrices, initialTimestamp=oldestTimestamp)
+            # The refresher thread holds the wallet weakly, so that the wallet can be collected, which stops the refresher
+            walletRef = weakref.ref(self)
+            def updateCache(snapshot):
+                wallet = walletRef()
+                if wallet is not None:
+                    wallet._updateCacheFromSnapshot(snapshot)
+            self.priceRefresher.subscribe(updateCache)
+        elif interval is not None:
+            self.priceRefresher.interval = interval
+        self.priceRefresher.start()
+        return self.priceRefresher
+
+    def stopPriceRefresher(self):
+        if self.priceRefresher is not None:
+            self.priceRefresher.stop()
+
+    def _updateCacheFromSnapshot(self, snapshot):
+        # Called from the refresher thread. Build a new dict and swap it, to never expose a half updated cache.
+        cache = dict(self.cache)
+        for asset, price in snapshot.prices.items():
+            cache[asset] = {'value': price, 'timestamp': snapshot.timestamp}
+        self.cache = cache
+
     def getCurrentPrices(self):
       if self.apiKey is None:
             print("No API key provided, returning empty Series")
@@ -163,6 +404,12 @@ class Wallet(object):
       # Get the list of assets
       assets = self.getAssetsList()
 
+      # Serve the prices from the latest snapshot of the background refresher, without any network request
+      if self.priceRefresher is not None and self.priceRefresher.isRunning():
+          # The assets added since the last refresh are fetched by the refresher, their price is NaN until then
+          self.priceRefresher.setAssets(assets)
+          return self.priceRefresher.snapshot.prices.reindex(assets.values)
+
       # Check if prices are already cached and not too old
       current_time = time.time()
       cached_assets = [asset for asset, price_info in self.cache.items() if (current_time - price_info['timestamp']) < self.cacheLifetime] 
@@ -172,6 +419,7 @@ class Wallet(object):
 
       # Fetch prices for assets not in cache or where cache is too old
       if assets_to_fetch:
+          from .CryptoCompareWrapper import CryptoCompareWrapper
           new_prices = CryptoCompareWrapper.requestApiCurrentPrices(pd.Series(assets_to_fetch), self.apiKey)
           # Update cache with new prices
           for asset, price in new_prices.items():
@@ -184,92 +432,116 @@ class Wallet(object):
 
       return prices
 
-    def getCurrentValueTot(self):
+    def getCurrentValueTot(self, currency = 'USD'):
         amount = self.getAmountTotByAsset()
         prices = self.getCurrentPrices()
-        value = amount * prices
-        value.name = "current_value_USD"
+        value = self.getValuation(currency).convertCurrent(amount * prices)
+        value.name = f"current_value_{currency}"
         return value
 
-    def getPotentialRevenueTot(self):
-        value = self.getCurrentValueTot()
-        cost = self.getCostTot()
+    def getPotentialRevenueTot(self, currency = 'USD'):
+        value = self.getCurrentValueTot(currency)
+        cost = self.getCostTot(currency)
         revenue = value.sub(cost, fill_value=0)
-        revenue.name = "potential_revenue_USD"
+        revenue.name = f"potential_revenue_{currency}"
         return revenue
 
-    def getBuyPriceTot(self):
+    def getBuyPriceTot(self, currency = 'USD'):
         amount = self.getAmountTotByAsset()
-        cost = self.getCostTot()
+        cost = self.getCostTot(currency)
         # replace the amount of less than 0.0001 to NaN to avoid division by zero, negative and huge results due to really small amounts
         amount = amount.where(amount >= 0.0001)
         buyPrice = cost / amount
         # remove negative buy prices (when profit is already realized)
         buyPrice = buyPrice.where(buyPrice >= 0)
-        buyPrice.name = "buy_price_USD"
+        buyPrice.name = f"buy_price_{currency}"
         return buyPrice
         
         
-    def getFeesTot(self):
-        feesTot = self.transactions[(self.transactions['type'] == TransactionType.FEE)].groupby("asset")[['amount', 'amount_USD']].sum()
-        feesTot.columns = ['fees_amount', 'fees_USD']
-        feesTot['fees_current_USD'] = feesTot['fees_amount'] * self.getCurrentPrices()
+    def getFeesTot(self, currency = 'USD'):
+        if self.outOfCore and currency == 'USD':
+            feesTot = self.store.aggregate('asset', ['amount', 'amount_USD'], type=TransactionType.FEE).set_axis(['fees_amount', f'fees_{currency}'], axis=1)
+        else:
+            mask = self.transactions['type'] == TransactionType.FEE
+            feesTot = pd.DataFrame({'fees_amount': self.transactions.loc[mask, 'amount'], f'fees_{currency}': self.getTransactionsValue(currency)[mask]}) \
+                .groupby(self.transactions.loc[mask, 'asset']).sum()
+        feesTot[f'fees_current_{currency}'] = self.getValuation(currency).convertCurrent(feesTot['fees_amount'] * self.getCurrentPrices())
         return feesTot
     
-    def getInterestsTot(self):
-        interestsTot = self.transactions[(self.transactions['type'].isin([TransactionType.STAKING_INTEREST, TransactionType.SAVING_INTEREST, 
-                                                                  TransactionType.REFERRAL_INTEREST, TransactionType.DISTRIBUTION]))].groupby("asset")[['amount', 'amount_USD']].sum()
-        interestsTot.columns = ['interests_amount', 'interests_USD']
-        interestsTot['interests_current_USD'] = interestsTot['interests_amount'] * self.getCurrentPrices()
+    def getInterestsTot(self, currency = 'USD'):
+        if self.outOfCore and currency == 'USD':
+            interestsTot = self.store.aggregate('asset', ['amount', 'amount_USD'], type=Wallet.InterestTypes) \
+                .set_axis(['interests_amount', f'interests_{currency}'], axis=1)
+        else:
+            mask = self.transactions['type'].isin(Wallet.InterestTypes)
+            interestsTot = pd.DataFrame({'interests_amount': self.transactions.loc[mask, 'amount'], f'interests_{currency}': self.getTransactionsValue(currency)[mask]}) \
+                .groupby(self.transactions.loc[mask, 'asset']).sum()
+        interestsTot[f'interests_current_{currency}'] = self.getValuation(currency).convertCurrent(interestsTot['interests_amount'] * self.getCurrentPrices())
         return interestsTot
     
+
+    @traced
+    def getInterestApr(self, freq = 'M', end = None) -> pd.DataFrame:
+        """Realized APR of the SAVING and STAKING products per period, exchange and asset, see YieldAnalytics.apr()."""
+        from .YieldAnalytics import YieldAnalytics
+        return YieldAnalytics.apr(self.transactions, freq, end)
     
-    def getCoinsStats(self):
+    @traced
+    def getCoinsStats(self, currency = 'USD'):
+        # The values are in USD by default. In another currency, the historical values are converted at the rate of their
+        # day, and the current values at the last rate, see Valuation.
         amount = self.getAmountTotByAsset()
-        cost = self.getCostTot()
-        value = self.getCurrentValueTot()
-        revenue = self.getPotentialRevenueTot()
-        buyPrice = self.getBuyPriceTot()
-        fees = self.getFeesTot()
-        interest = self.getInterestsTot()
+        cost = self.getCostTot(currency)
+        value = self.getCurrentValueTot(currency)
+        revenue = self.getPotentialRevenueTot(currency)
+        buyPrice = self.getBuyPriceTot(currency)
+        fees = self.getFeesTot(currency)
+        interest = self.getInterestsTot(currency)
         stats = pd.concat([amount, cost, value, revenue, buyPrice, fees, interest], axis=1).fillna(0)
         return stats
 
-    def getSummary(self):
-        total_holding_USD = self.getCurrentValueTot().drop(self.Fiats).sum()
-        total_fiat_expenses_USD = self.getCurrentValueTot().loc[self.Fiats].sum()
-        profit_USD = total_holding_USD + total_fiat_expenses_USD
-        total_fees_USD = self.getFeesTot()['fees_USD'].sum()
-        total_interests_USD = self.getInterestsTot()['interests_USD'].sum()
+    @traced
+    def getSummary(self, currency = 'USD'):
+        total_holding = self.getCurrentValueTot(currency).drop(self.Fiats).sum()
+        total_fiat_expenses = self.getCurrentValueTot(currency).loc[self.Fiats].sum()
+        profit = total_holding + total_fiat_expenses
+        total_fees = self.getFeesTot(currency)[f'fees_{currency}'].sum()
+        total_interests = self.getInterestsTot(currency)[f'interests_{currency}'].sum()
             
         return pd.Series({
-            'total_holding_USD': total_holding_USD,
-            'total_fiat_expenses_USD': total_fiat_expenses_USD,
-            'profit_USD': profit_USD,
-            'total_fees_USD': total_fees_USD,
-            'total_interests_USD': total_interests_USD
+            f'total_holding_{currency}': total_holding,
+            f'total_fiat_expenses_{currency}': total_fiat_expenses,
+            f'profit_{currency}': profit,
+            f'total_fees_{currency}': total_fees,
+            f'total_interests_{currency}': total_interests
         })
     
     def getAmountSpot(self):
-        return self.transactions[(self.transactions['wallet'] == WalletType.SPOT)].groupby("asset")['amount'].sum()
+        if self.outOfCore:
+            return self.store.aggregate('asset', ['amount'], wallet=WalletType.SPOT)['amount']
+        return self.query(wallet=WalletType.SPOT).groupby("asset")['amount'].sum()
 
     def getAmountSaving(self):
-        return self.transactions[(self.transactions['wallet'] == WalletType.SAVING)].groupby("asset")['amount'].sum()
+        if self.outOfCore:
+            return self.store.aggregate('asset', ['amount'], wallet=WalletType.SAVING)['amount']
+        return self.query(wallet=WalletType.SAVING).groupby("asset")['amount'].sum()
 
     def getAmountStaking(self):
-        return self.transactions[(self.transactions['wallet'] == WalletType.STAKING)].groupby("asset")['amount'].sum()
+        if self.outOfCore:
+            return self.store.aggregate('asset', ['amount'], wallet=WalletType.STAKING)['amount']
+        return self.query(wallet=WalletType.STAKING).groupby("asset")['amount'].sum()
     
     def getAmountFunding(self):
-        return self.transactions[(self.transactions['wallet'] == WalletType.FUNDING)].groupby("asset")['amount'].sum()
+        if self.outOfCore:
+            return self.store.aggregate('asset', ['amount'], wallet=WalletType.FUNDING)['amount']
+        return self.query(wallet=WalletType.FUNDING).groupby("asset")['amount'].sum()
         
     def get_historical_amount(self, asset: str) -> pd.DataFrame:
-        asset_txs = self.transactions[self.transactions['asset'] == asset].copy()
+        asset_txs = self.query(asset=asset)  # Already sorted by datetime
         
         if asset_txs.empty:
             return pd.DataFrame(columns=['timestamp', 'amount'])
         
-        asset_txs = asset_txs.sort_values('datetime')
-        
         daily_amounts = (
             asset_txs
             .set_index('datetime')
@@ -286,12 +558,185 @@ class Wallet(object):
             'amount': cumulative.values
         })
     
+
+    def getHistoricalAmounts(self, assets = None, freq = 'D', by = None) -> pd.DataFrame:
+        """Holdings of the assets at the end of each period, with a row per period and a column per asset.
+
+        freq is a pandas period frequency ('h', 'D', 'W'...), the rows are indexed by the start of the periods, in UTC.
+        With by='exchange' or by='wallet', the columns are (exchange or wallet, asset).
+        The holdings of all the assets are cached per (freq, by). When the transactions before the last period are
+        unchanged, the cached holdings are extended from the last period instead of being recomputed.
+        An out-of-core wallet reads the store chunk by chunk, with only the columns used, and does not cache the holdings.
+        """
+        if by is not None and by not in ('exchange', 'userId', 'wallet'):
+            raise ValueError(f"Unknown breakdown '{by}'. Use 'exchange', 'userId' or 'wallet'.")
+        if self.outOfCore:
+            holdings = self._storeHoldings(freq, by)
+            if holdings is None:
+                return pd.DataFrame(dtype=float)
+        else:
+            if self.transactions.empty:
+                return pd.DataFrame(dtype=float)
+            key = (freq, by)
+            cached = self._historicalAmountsCache.get(key)
+            holdings = None
+            if cached is not None:
+                cachedHoldings, fingerprintBefore = cached
+                positions = self.transactionIndex.positions(start=cachedHoldings.index[-1].start_time)
+                # Extend only if no transaction was added, removed or modified before the last period
+                if Wallet.holdingsFingerprint(self.transactionsBefore(positions), by) == fingerprintBefore:
+                    with span('historical_amounts:extend', rows=len(positions)):
+                        holdings = Wallet.extendHoldings(cachedHoldings, Wallet.periodFlows(self.transactions.iloc[positions], freq, by))
+            if holdings is None:
+                with span('historical_amounts:compute', rows=len(self.transactions)):
+                    holdings = Wallet.periodFlows(self.transactions, freq, by).cumsum()
+            positions = self.transactionIndex.positions(start=holdings.index[-1].start_time)
+            self._historicalAmountsCache[key] = (holdings, Wallet.holdingsFingerprint(self.transactionsBefore(positions), by))
+
+        if assets is not None:
+            if by is None:
+                holdings = holdings.reindex(columns=list(assets), fill_value=0)
+            else:
+                holdings = holdings.loc[:, holdings.columns.get_level_values('asset').isin(list(assets))]
+        holdings = holdings.copy()  # The cached holdings must not be modified by the caller
+        holdings.index = holdings.index.to_timestamp().tz_localize('UTC')
+        return holdings
+
+    def transactionsBefore(self, positions) -> pd.DataFrame:
+        # Transactions which are not at the given positions
+        isBefore = np.ones(len(self.transactions), dtype=bool)
+        isBefore[positions] = False
+        return self.transactions[isBefore]
+
+    @staticmethod
+    def holdingsFingerprint(transactions, by = None) -> int:
+        # Sum modulo 2**64 of the hashes of the columns of the holdings of each row, like DisposalLedger.fingerprintOf()
+        identity = pd.DataFrame({
+            'datetime': transactions['datetime'],
+            'asset': transactions['asset'],
+            'amount': transactions['amount'].astype(float),
+        })
+        if by is not None:
+            identity[by] = transactions[by].astype(str)
+        return int(pd.util.hash_pandas_object(identity, index=False).to_numpy().sum(dtype=np.uint64))
+
+    def _storeHoldings(self, freq, by):
+        # Sum of the flows of each chunk of the store, None if the store is empty
+        columns = ['datetime', 'asset', 'amount'] + ([by] if by is not None else [])
+        with span('historical_amounts:store') as stage:
+            flows = [Wallet.periodFlows(chunk, freq, by) for chunk in self.store.iterChunks(columns) if not chunk.empty]
+            if not flows:
+                return None
+            stage.set(chunks=len(flows))
+            flows = pd.concat(flows).fillna(0).groupby(level=0).sum().sort_index(axis=1)
+        return flows.reindex(pd.period_range(flows.index.min(), flows.index.max(), freq=freq, name='period'), fill_value=0).cumsum()
+
+    @staticmethod
+    def periodFlows(transactions, freq, by = None) -> pd.DataFrame:
+        # Net amount per period and asset (and per `by` column), with a row for each period between the first and the last transaction
+        datetimes = transactions['datetime']
+        if datetimes.dt.tz is not None:
+            datetimes = datetimes.dt.tz_convert(None)
+        periods = datetimes.dt.to_period(freq)
+        keys = [periods] + ([transactions[by]] if by is not None else []) + [transactions['asset']]
+        flows = transactions['amount'].groupby(keys).sum().unstack(list(range(1, len(keys))), fill_value=0)
+        if by is not None:
+            flows.columns = flows.columns.set_names([by, 'asset'])
+        flows.index = flows.index.set_names('period')
+        return flows.reindex(pd.period_range(periods.min(), periods.max(), freq=freq, name='period'), fill_value=0)
+
+    @staticmethod
+    def extendHoldings(holdings, flows) -> pd.DataFrame:
+        # Replace the last period of the holdings, and append the next ones, from the flows starting at the last period
+        previous = holdings.iloc[:-1]
+        columns = holdings.columns.union(flows.columns, sort=False)
+        start = previous.iloc[-1].reindex(columns, fill_value=0) if len(previous) else 0
+        extension = flows.reindex(columns=columns, fill_value=0).cumsum() + start
+        return pd.concat([previous.reindex(columns=columns, fill_value=0), extension])
+
+    def getTaxReport(self, jurisdiction = 'CH', freq = 'Y') -> pd.DataFrame:
+        """Realized gains, income and fees in USD per tax year ('Y'), quarter ('Q') or month ('M').
+
+        jurisdiction is a key of TaxReport.Jurisdictions or a TaxRules. The disposal ledger is built on the first call,
+        and only the transactions added after its end are processed by the next calls.
+        """
+        from .TaxReport import DisposalLedger, TaxReport, TaxRules, Jurisdictions
+        if isinstance(jurisdiction, TaxRules):
+            rules = jurisdiction
+        elif jurisdiction in Jurisdictions:
+            rules = Jurisdictions[jurisdiction]
+        else:
+            raise ValueError(f"Unknown jurisdiction '{jurisdiction}'. Use one of {', '.join(Jurisdictions)} or a TaxRules.")
+        if rules.method not in self._disposalLedgers:
+            self._disposalLedgers[rules.method] = DisposalLedger(rules.method, self.Fiats)
+        ledger = self._disposalLedgers[rules.method]
+        ledger.update(self.transactions)
+        if rules not in self._taxReports:
+            self._taxReports[rules] = TaxReport(ledger, rules)
+        return self._taxReports[rules].periods(freq)
             
+    def compactInterestRows(self, freq = 'D', types = None) -> int:
+        """Replace the interest rows of each asset, exchange, userId, wallet and type in each period by a single row.
+
+        freq is a pandas period frequency ('D', 'W', 'M'...). The compacted row is at the datetime of the last raw row,
+        with the total amount and USD amount, and the USD-weighted price. Its USD values are NaN if a raw row has no price.
+        The raw rows are moved to the archive, linked by the '#<compaction_id>' at the end of the note of the compacted row,
+        see expandCompactedRows(). Already compacted rows are not compacted again. Return the number of rows removed.
+        """
+        types = Wallet.CompactableTypes if types is None else types
+        transactions = self.transactions
+        candidates = transactions[transactions['type'].isin(types) & ~transactions['note'].fillna('').str.startswith(Wallet.CompactedNotePrefix)]
+        if candidates.empty:
+            return 0
+        datetimes = candidates['datetime'].dt.tz_convert(None) if candidates['datetime'].dt.tz is not None else candidates['datetime']
+        keys = [datetimes.dt.to_period(freq), candidates['asset'], candidates['exchange'], candidates['userId'], candidates['wallet'], candidates['type']]
+        groupIds = candidates.groupby(keys, sort=False).ngroup()
+        sizes = groupIds.map(groupIds.value_counts())
+        # A single row in its period is left as is
+        candidates, groupIds = candidates[sizes > 1], groupIds[sizes > 1]
+        if candidates.empty:
+            return 0
+
+        with span('compact', rowsIn=len(candidates)) as stage:
+            archive = self.archive
+            firstId = int(archive['compaction_id'].max()) + 1 if not archive.empty else 0
+            compactionIds = firstId + pd.Series(pd.factorize(groupIds)[0], index=groupIds.index)
+            grouped = candidates.groupby(compactionIds)
+            compacted = grouped.agg(datetime=('datetime', 'max'), asset=('asset', 'first'), amount=('amount', 'sum'), type=('type', 'first'),
+                                    exchange=('exchange', 'first'), userId=('userId', 'first'), wallet=('wallet', 'first'), amount_USD=('amount_USD', 'sum'))
+            missingPrice = candidates['price_USD'].isna().groupby(compactionIds).any()
+            compacted['amount_USD'] = compacted['amount_USD'].where(~missingPrice)
+            compacted['price_USD'] = compacted['amount_USD'] / compacted['amount']
+            compacted['note'] = Wallet.CompactedNotePrefix + grouped.size().astype(str) + " rows #" + compacted.index.astype(str)
+
+            self._archive = pd.concat([archive, candidates.assign(compaction_id=compactionIds)], ignore_index=True)
+            newDf = pd.concat([transactions.drop(candidates.index), compacted[transactions.columns.intersection(compacted.columns)]], ignore_index=True)
+            self.transactions = newDf.sort_values("datetime")
+            stage.set(rows=len(compacted))
+        print(f"{len(candidates)} interest rows compacted into {len(compacted)} rows")
+        return len(candidates) - len(compacted)
+
+    def expandCompactedRows(self, compactionIds = None):
+        """Replace the compacted rows (all, or those of the given compaction ids) by their raw rows from the archive."""
+        if self.archive.empty:
+            return
+        ids = self.transactions['note'].fillna('').str.extract('^' + Wallet.CompactedNotePrefix + r'\d+ rows #(\d+)$')[0].astype(float)
+        isCompacted = ids.notna() if compactionIds is None else ids.isin(list(compactionIds))
+        expanded = self.archive['compaction_id'].isin(ids[isCompacted])
+        raw = self.archive[expanded].drop(columns='compaction_id')
+        newDf = pd.concat([self.transactions[~isCompacted], raw], ignore_index=True)
+        self.transactions = newDf.sort_values("datetime")
+        self._archive = self.archive[~expanded].reset_index(drop=True)
+
     def printFirstLastTransactionDatetime(self):
-        from IPython.display import display
         # Group by 'exchange' and aggregate with min and max on 'datetime'
         grouped = self.transactions.groupby(["exchange", "userId"])['datetime'].agg(earliest=('min'), latest=('max'))
-        display(grouped)
+        # Use the rich display only when running in IPython/Jupyter, to not import IPython in scripts
+        if 'IPython' in sys.modules:
+            from IPython.display import display
+            display(grouped)
+        else:
+            print(grouped)
     
     def removeTransactionsExchange(self, exchange):
         self.backup()
@@ -358,6 +803,7 @@ class Wallet(object):
 
 
     @staticmethod
+    @traced
     def mergeTransactionsInWindow(transactions, window): # window in seconds
         # Group transactions based on unique combination of attributes
         grouped_transactions = transactions.groupby(['asset', 'type', 'exchange', 'userId', 'wallet', 'note'], sort=False)
@@ -381,10 +827,79 @@ class Wallet(object):
         merged_transactions.drop(columns='group', inplace=True)
         return merged_transactions
       
-    def addUsdData(self):
-        self.transactions = CryptoCompareWrapper.addMissingUsdPrice(self.transactions, self.apiKey)
+    @traced
+    def addUsdData(self, progress = None, cancelled = None):
+        # The prices implied by the trades are free, only the remaining ones are requested to the API
+        isFiatTrade = (self.transactions['type'] == TransactionType.SPOT_TRADE) & self.transactions['asset'].isin(self.Fiats)
+        valuations = {fiat: self.getValuation(fiat) for fiat in self.transactions.loc[isFiatTrade, 'asset'].unique() if fiat not in StableCoinsUSD}
+        self.transactions = self.inferTradePrices(self.transactions, valuations)
+        from .CryptoCompareWrapper import CryptoCompareWrapper
+        self.transactions = CryptoCompareWrapper.addMissingUsdPrice(self.transactions, self.apiKey, progress, cancelled)
         self.transactions = self.addMissingUsdAmount(self.transactions)
 
+    @staticmethod
+    @traced
+    def inferTradePrices(transactions, valuations = None):
+        """Set the missing USD price of the trades against a fiat currency or a USD stablecoin, from the amount of these legs.
+
+        The legs of a trade are the SPOT_TRADE transactions with the same exchange, userId and datetime. The quote legs
+        are in USD or a USD stablecoin, valued 1 USD, or in a fiat currency of `valuations` ({currency: Valuation}),
+        valued at the daily rate of the currency. The quote legs get this price. If all the other legs are in a single
+        asset, its price is the USD value of the quote legs received or spent divided by the amount of the asset.
+        The fees paid in this asset by the trade get the same price. Without a rate, the legs of a fiat are ignored.
+        """
+        if transactions.empty:
+            return transactions
+        isTrade = (transactions['type'] == TransactionType.SPOT_TRADE).to_numpy()
+        if not isTrade.any():
+            return transactions
+        trades = transactions.loc[isTrade, ['exchange', 'userId', 'datetime', 'asset', 'amount', 'price_USD']]
+        group = trades.groupby(['exchange', 'userId', 'datetime'], sort=False, dropna=False).ngroup().to_numpy()
+        # USD price of the quote legs, NaN for the other legs
+        quotePrice = np.where(trades['asset'].isin(StableCoinsUSD).to_numpy(), 1.0, np.nan)
+        for currency, valuation in (valuations or {}).items():
+            isCurrency = (trades['asset'] == currency).to_numpy()
+            if not isCurrency.any():
+                continue
+            try:
+                quotePrice[isCurrency] = valuation.rateAt(trades.loc[isCurrency, 'datetime'])
+            except Exception as e:  # No rate of the currency, its legs are not used
+                print(f"No exchange rate of {currency}, the trades against it are not priced: {e}")
+        isQuote = ~np.isnan(quotePrice)
+        amounts = trades['amount'].to_numpy(dtype=float)
+
+        # Per trade: USD value, amount and number of distinct assets of the other legs
+        nGroups = group.max() + 1
+        usdAmount = np.bincount(group, weights=np.where(isQuote, amounts * np.nan_to_num(quotePrice), 0.0), minlength=nGroups)
+        hasQuote = np.bincount(group, weights=isQuote, minlength=nGroups) > 0
+        assetAmount = np.bincount(group, weights=np.where(isQuote, 0.0, amounts), minlength=nGroups)
+        nAssets = pd.Series(trades['asset'].to_numpy()[~isQuote]).groupby(group[~isQuote]).nunique().reindex(range(nGroups), fill_value=0).to_numpy()
+        # Only the trades exchanging an asset for quote legs, in opposite directions
+        isPriced = hasQuote & (nAssets == 1) & (usdAmount * assetAmount < 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price = np.where(isPriced, -usdAmount / assetAmount, np.nan)
+
+        rowPrice = pd.Series(np.where(isQuote, quotePrice, price[group]), index=trades.index)
+        isMissing = trades['price_USD'].isna().to_numpy()
+        inferred = ~isQuote & isPriced[group] & isMissing
+        transactions.loc[trades.index[inferred], 'price_USD'] = rowPrice[inferred]
+        # The quote legs are priced too, so that they are not requested to the API
+        quotes = isQuote & isMissing
+        transactions.loc[trades.index[quotes], 'price_USD'] = rowPrice[quotes]
+
+        # Fees paid in the traded asset
+        isFee = ((transactions['type'] == TransactionType.FEE) & transactions['price_USD'].isna()).to_numpy()
+        inferredFees = 0
+        isPricedLeg = ~isQuote & isPriced[group]
+        if isFee.any() and isPricedLeg.any():
+            keys = ['exchange', 'userId', 'datetime', 'asset']
+            legPrices = trades.loc[isPricedLeg, keys].assign(price=rowPrice[isPricedLeg]).drop_duplicates(keys)
+            fees = transactions.loc[isFee, keys].rename_axis('row').reset_index().merge(legPrices, on=keys, how='inner')
+            transactions.loc[fees['row'].to_numpy(), 'price_USD'] = fees['price'].to_numpy()
+            inferredFees = len(fees)
+        print(f"USD prices inferred from the trades: {inferred.sum()} trades, {quotes.sum()} quote legs, {inferredFees} fees")
+        return transactions
+
     @staticmethod
     def addMissingUsdAmount(transactions):
         missingUsdAmount = transactions['amount_USD'].isna()
@@ -401,5 +916,17 @@ class Wallet(object):
     }
     Fiats = ['USD', 'EUR', 'CHF']
 
+    # Transactions counted in the cost of the assets, see getCostTot()
+    CostTypes = [TransactionType.SPOT_TRADE, TransactionType.STAKING_PURCHASE, TransactionType.STAKING_REDEMPTION, TransactionType.SAVING_PURCHASE,
+                 TransactionType.SAVING_REDEMPTION, TransactionType.DEPOSIT, TransactionType.WITHDRAW, TransactionType.SPEND, TransactionType.INCOME,
+                 TransactionType.REDENOMINATION, TransactionType.ACCOUNT_TRANSFER]
+    # Transactions counted in the interests, see getInterestsTot()
+    InterestTypes = [TransactionType.STAKING_INTEREST, TransactionType.SAVING_INTEREST, TransactionType.REFERRAL_INTEREST, TransactionType.DISTRIBUTION]
+
+    # Interest rows compacted by compactInterestRows()
+    CompactableTypes = [TransactionType.STAKING_INTEREST, TransactionType.SAVING_INTEREST, TransactionType.REFERRAL_INTEREST,
+                        TransactionType.DISTRIBUTION, TransactionType.MINING_INTEREST]
+    CompactedNotePrefix = 'Compacted '
+
 
 
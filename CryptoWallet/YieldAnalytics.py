@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from .Transaction import TransactionType, WalletType
+
+SecondsPerYear = 365.25 * 24 * 3600
+
+
+class YieldAnalytics:
+    # Realized APR of the savings and staking products, from the interests and the balance of the SAVING and STAKING
+    # wallets. The balance of these wallets is given by the mirror rows of the purchases and redemptions added by the loaders.
+
+    ProductInterestTypes = {
+        WalletType.SAVING: TransactionType.SAVING_INTEREST,
+        WalletType.STAKING: TransactionType.STAKING_INTEREST,
+    }
+
+    @staticmethod
+    def apr(transactions: pd.DataFrame, freq = 'M', end = None) -> pd.DataFrame:
+        """Interests, time-weighted average balance and APR per period, exchange, asset and product.
+
+        The average balance of a period is the integral of the balance over the period divided by its duration:
+        the balance at the start of the period, plus each flow weighted by the time left until the end of the period.
+        All the sums are grouped by period and product in a single pass, so the cost does not depend on the number of periods.
+        `apr` is the APR of the period, and `cumulative_apr` the APR from the first period to the end of the period.
+        The periods end at `end` at the latest (now by default).
+        """
+        end = pd.Timestamp.now(tz='UTC') if end is None else pd.Timestamp(end)
+        if end.tzinfo is None:
+            end = end.tz_localize('UTC')
+        keys = ['exchange', 'asset', 'product']
+
+        # Balance flows of the SAVING and STAKING wallets, and the interests of each product
+        isFlow = transactions['wallet'].isin(list(YieldAnalytics.ProductInterestTypes))
+        flows = transactions.loc[isFlow, ['datetime', 'exchange', 'asset', 'amount']].assign(product=transactions.loc[isFlow, 'wallet'])
+        interestProducts = {interestType: product for product, interestType in YieldAnalytics.ProductInterestTypes.items()}
+        isInterest = transactions['type'].isin(list(interestProducts))
+        interests = transactions.loc[isInterest, ['datetime', 'exchange', 'asset', 'amount', 'amount_USD']] \
+            .assign(product=transactions.loc[isInterest, 'type'].map(interestProducts))
+        # The flows and interests after the end of the last period are not part of any period
+        flows = flows[flows['datetime'] < end]
+        interests = interests[interests['datetime'] < end]
+        if flows.empty and interests.empty:
+            return pd.DataFrame(columns=['interest_amount', 'interest_USD', 'average_balance', 'apr', 'cumulative_apr'])
+
+        # Positions of the periods of the flows and interests, by binary search in the period starts (ns, UTC).
+        # The last period is the one containing the instant before `end`.
+        toNs = lambda datetimes: pd.DatetimeIndex(datetimes).tz_convert('UTC').as_unit('ns').asi8
+        endNs = pd.Timestamp(end).tz_convert('UTC').as_unit('ns').value
+        first = pd.concat([flows['datetime'], interests['datetime']]).min()
+        periods = pd.period_range(first.tz_convert('UTC').tz_localize(None), pd.Timestamp(endNs - 1).tz_localize(None), freq=freq, name='period')
+        startsNs = periods.start_time.as_unit('ns').asi8
+        endsNs = np.minimum(periods.end_time.as_unit('ns').asi8 + 1, endNs)
+        durations = np.maximum((endsNs - startsNs) / 1e9, 1.0)
+
+        flowsNs = toNs(flows['datetime'])
+        flowPositions = np.searchsorted(startsNs, flowsNs, side='right') - 1
+        flows = flows.assign(period=flowPositions, weighted=flows['amount'].to_numpy() * (endsNs[flowPositions] - flowsNs) / 1e9)
+        interests = interests.assign(period=np.searchsorted(startsNs, toNs(interests['datetime']), side='right') - 1)
+        flowSums = flows.groupby(['period'] + keys)[['amount', 'weighted']].sum().unstack(keys, fill_value=0)
+        interestSums = interests.groupby(['period'] + keys)[['amount', 'amount_USD']].sum().unstack(keys, fill_value=0)
+
+        columns = pd.MultiIndex.from_tuples(sorted(set(flowSums['amount'].columns if not flowSums.empty else [])
+                                                   | set(interestSums['amount'].columns if not interestSums.empty else [])), names=keys)
+        def grid(frame, column):
+            # Period x (exchange, asset, product) matrix, with all the periods and products
+            if frame.empty:
+                return pd.DataFrame(0.0, index=range(len(periods)), columns=columns)
+            return frame[column].reindex(index=range(len(periods)), columns=columns, fill_value=0)
+        netFlow = grid(flowSums, 'amount')
+        startBalance = netFlow.cumsum().shift(fill_value=0)
+        balanceSeconds = startBalance.mul(durations, axis=0) + grid(flowSums, 'weighted')
+        interestAmount = grid(interestSums, 'amount')
+        interestUSD = grid(interestSums, 'amount_USD')
+
+        positive = lambda frame: frame.where(frame > 0)
+        averageBalance = balanceSeconds.div(durations, axis=0)
+        apr = (interestAmount / positive(averageBalance)).mul(SecondsPerYear / durations, axis=0)
+        cumulativeApr = interestAmount.cumsum() / positive(balanceSeconds.cumsum()) * SecondsPerYear
+
+        result = pd.concat({
+            'interest_amount': interestAmount, 'interest_USD': interestUSD, 'average_balance': averageBalance,
+            'apr': apr, 'cumulative_apr': cumulativeApr,
+        }, axis=1).set_axis(periods, axis=0).stack(keys, future_stack=True)
+        # Keep the periods where the product had a balance or paid interests
+        return result[(result['average_balance'].abs() > 1e-12) | (result['interest_amount'] != 0)]
@@ -0,0 +1,89 @@
+"""Benchmark of the exchange loaders on synthetic exports, optionally against the loaders of a previous commit.
+
+Usage:
+    python -m benchmarks.bench_loaders --sizes 10000 100000 --output bench_loaders.json
+    python -m benchmarks.bench_loaders --sizes 20000 --exchanges Kucoin Bybit --reference HEAD~1
+
+With --reference, the loaders of CryptoWallet/Loader.py at that git revision are timed on the same exports, and
+their output is checked to be identical to the output of the current loaders.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+RepositoryPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RepositoryPath)
+
+from benchmarks import generators
+from CryptoWallet import Loader
+
+
+def referenceLoader(revision):
+    # Loader module of a git revision, imported in the CryptoWallet package for its relative imports
+    source = subprocess.check_output(['git', 'show', f"{revision}:CryptoWallet/Loader.py"], cwd=RepositoryPath, text=True)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader('CryptoWallet._ReferenceLoader', loader=None))
+    module.__package__ = 'CryptoWallet'
+    exec(compile(source, f"{revision}:CryptoWallet/Loader.py", 'exec'), module.__dict__)
+    return module
+
+
+def timeLoad(loader, path, repeat):
+    # Best time of `repeat` loads, and the loaded transactions. The logs of the loaders are discarded.
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            transactions = loader.load(path)
+            times.append(time.perf_counter() - start)
+    return min(times), transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the exchange loaders")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help="Number of rows of each generated export")
+    parser.add_argument('--exchanges', nargs='+', default=list(generators.Writers), choices=list(generators.Writers))
+    parser.add_argument('--repeat', type=int, default=1, help="Number of loads of each export, the best time is kept")
+    parser.add_argument('--reference', help="Git revision whose loaders are timed and compared with the current ones")
+    parser.add_argument('--output', default='bench_loaders.json')
+    args = parser.parse_args()
+
+    reference = referenceLoader(args.reference) if args.reference else None
+    # Time the parsing of the exports, not the Swissborg sheet cache of the revisions that had one
+    if reference is not None and hasattr(reference.SwissborgLoader, 'sheetCache'):
+        reference.SwissborgLoader.sheetCache = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for exchange in args.exchanges:
+                writer, loaderName = generators.Writers[exchange]
+                path = writer(workdir, size)
+                seconds, transactions = timeLoad(getattr(Loader, loaderName), path, args.repeat)
+                record = {'exchange': exchange, 'size': size, 'rows': len(transactions), 'seconds': seconds}
+                line = f"{exchange:<10} size={size:<8} rows={len(transactions):<8} {seconds:9.3f} s"
+                if reference is not None:
+                    referenceSeconds, expected = timeLoad(getattr(reference, loaderName), path, args.repeat)
+                    pd.testing.assert_frame_equal(transactions, expected)
+                    record.update({'reference_seconds': referenceSeconds, 'speedup': referenceSeconds / seconds})
+                    line += f"   {args.reference}: {referenceSeconds:9.3f} s  x{referenceSeconds / seconds:6.1f}  identical output"
+                results.append(record)
+                print(line)
+
+    with open(args.output, 'w') as f:
+        json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'pandas': pd.__version__,
+                   'numpy': np.__version__, 'reference': args.reference, 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
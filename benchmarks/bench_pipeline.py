@@ -0,0 +1,179 @@
+"""Benchmark of the import -> enrich -> report pipeline on synthetic exports.
+
+Usage:
+    python -m benchmarks.bench_pipeline --sizes 10000 100000 --output bench_results.json
+    python -m benchmarks.bench_pipeline --sizes 10000 --compare bench_results_previous.json
+
+The results are written as JSON, one record per (stage, size), to compare commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+RepositoryPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RepositoryPath)
+
+from benchmarks import generators
+from CryptoWallet import Importer, Loader
+from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+from CryptoWallet.StubServer import CryptoCompareStubServer
+from CryptoWallet.Transport import HttpTransport
+from CryptoWallet.Wallet import Wallet
+
+
+class Benchmark:
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, stage, size, func, rows=None, bytes=None, exchange=None):
+        # Run func `repeat` times and keep the best time. Return the result of the last run.
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        record = {'stage': stage, 'size': size, 'exchange': exchange, 'seconds': min(times), 'rows': rows, 'bytes': bytes}
+        self.results.append(record)
+        print(f"{stage:<28} {exchange or '':<10} size={size:<8} {min(times):9.3f} s")
+        return result
+
+
+def pathSize(path) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def runSize(bench, size, exchanges, workdir, enrichRows):
+    # Generate the exports (not timed)
+    exports = {}
+    for exchange in exchanges:
+        writer, _ = generators.Writers[exchange]
+        exports[exchange] = writer(workdir, size)
+
+    # Loaders, parsing the exports
+    loaded = {}
+    for exchange in exchanges:
+        _, loaderName = generators.Writers[exchange]
+        loader = getattr(Loader, loaderName)
+        path = exports[exchange]
+        loaded[exchange] = bench.run('load', size, lambda: loader.load(path), bytes=pathSize(path), exchange=exchange)
+        bench.results[-1]['rows'] = len(loaded[exchange])
+
+    # Unchanged exports, read back from the loader cache (filled by the first run, not timed)
+    cacheDirpath = os.path.join(workdir, f"cache_{size}")
+    for exchange in exchanges:
+        _, loaderName = generators.Writers[exchange]
+        path = exports[exchange]
+        Importer.loadExport(loaderName, path, cacheDirpath)
+        bench.run('load_cached', size, lambda: Importer.loadExport(loaderName, path, cacheDirpath), rows=len(loaded[exchange]),
+                  bytes=pathSize(path), exchange=exchange)
+
+    allLoaded = pd.concat(loaded.values(), ignore_index=True)
+    bench.run('mergeTransactionsInWindow', size, lambda: Wallet.mergeTransactionsInWindow(allLoaded.copy(), window=15*60), rows=len(allLoaded))
+
+    # Import all the exchanges in an empty wallet
+    databaseFilename = os.path.join(workdir, f"transactions_{size}.csv")
+
+    def addAll():
+        wallet = Wallet(apiKey='benchmark', databaseFilename=databaseFilename)
+        for transactions in loaded.values():
+            wallet.addTransactions(transactions.copy())
+        return wallet
+    wallet = bench.run('addTransactions', size, addAll, rows=len(allLoaded))
+
+    # Prices implied by the USD legs of the trades, without API request
+    bench.run('inferTradePrices', size, lambda: Wallet.inferTradePrices(wallet.transactions.copy()), rows=len(wallet.transactions))
+
+    # Price enrichment against the stub API, on a bounded sample of the missing prices
+    missing = wallet.transactions[wallet.transactions['price_USD'].isna()]
+    sample = missing.head(enrichRows).copy()
+    bench.run('addMissingUsdPrice', size, lambda: CryptoCompareWrapper.addMissingUsdPrice(sample.copy(), 'benchmark'), rows=len(sample))
+    # Same prices again, from the hourly candles cached by the previous stage
+    bench.run('addMissingUsdPrice_cached', size, lambda: CryptoCompareWrapper.addMissingUsdPrice(sample.copy(), 'benchmark'), rows=len(sample))
+
+    # Synthetic prices for the rest of the database, so that save() does not request the API.
+    # Merged rows have an averaged price, recompute their USD amount to pass the integrity check.
+    wallet.transactions['price_USD'] = wallet.transactions['price_USD'].fillna(1.0)
+    wallet.transactions['amount_USD'] = wallet.transactions['amount'] * wallet.transactions['price_USD']
+
+    bench.run('save', size, wallet.save, rows=len(wallet.transactions))
+    bench.results[-1]['bytes'] = os.path.getsize(databaseFilename)
+    opened = bench.run('open', size, lambda: Wallet(apiKey='benchmark', databaseFilename=databaseFilename),
+                       rows=len(wallet.transactions), bytes=os.path.getsize(databaseFilename))
+
+    bench.run('getCoinsStats', size, opened.getCoinsStats, rows=len(opened.transactions))
+    bench.run('getSummary', size, opened.getSummary, rows=len(opened.transactions))
+
+
+def commitId() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=RepositoryPath, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, previousFilename):
+    with open(previousFilename) as f:
+        previous = json.load(f)
+    key = lambda r: (r['stage'], r['size'], r['exchange'])
+    previousTimes = {key(r): r['seconds'] for r in previous['results']}
+    print(f"\nComparison with {previousFilename} (commit {previous.get('commit')}):")
+    for r in results:
+        if key(r) in previousTimes and previousTimes[key(r)] > 0:
+            ratio = r['seconds'] / previousTimes[key(r)]
+            flag = '  <-- regression' if ratio > 1.2 else ''
+            print(f"{r['stage']:<28} {r['exchange'] or '':<10} size={r['size']:<8} x{ratio:6.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import -> enrich -> report pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help="Number of rows of each generated export (e.g. 10000 100000 1000000)")
+    parser.add_argument('--exchanges', nargs='+', default=list(generators.Writers), choices=list(generators.Writers))
+    parser.add_argument('--repeat', type=int, default=1, help="Number of runs of each stage, the best time is kept")
+    parser.add_argument('--enrich-rows', type=int, default=200, help="Number of rows enriched through the stub API")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Latency of the stub API, in seconds")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="Previous results file to compare with")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    bench = Benchmark(repeat=args.repeat)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir, CryptoCompareStubServer(latency=args.api_latency) as server:
+        # The Wallet stores its caches and logs in the working directory
+        os.chdir(workdir)
+        previousTransport = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        try:
+            for size in args.sizes:
+                runSize(bench, size, args.exchanges, workdir, args.enrich_rows)
+        finally:
+            CryptoCompareWrapper.setTransport(previousTransport)
+            os.chdir(cwd)
+
+    report = {
+        'commit': commitId(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'results': bench.results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Startup time of the CryptoWallet package, measured in fresh interpreters.
+
+Usage:
+    python -m benchmarks.bench_startup --rows 100000 --output bench_startup.json
+
+Each scenario runs in a new Python process, to include the import time of the package and its dependencies.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+RepositoryPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported by a CLI one-shot
+LazyModules = ['requests', 'tqdm', 'IPython', 'openpyxl']
+
+Scenarios = {
+    # Baseline: the import of pandas alone, which the package can't avoid
+    'import_pandas': "import pandas",
+    'import': "import CryptoWallet.Wallet",
+    'lazy_wallet': "from CryptoWallet.Wallet import Wallet\nwallet = Wallet(databaseFilename=DATABASE, lazy=True)",
+    'eager_wallet': "from CryptoWallet.Wallet import Wallet\nwallet = Wallet(databaseFilename=DATABASE)",
+    'amount_by_asset': "from CryptoWallet.Wallet import Wallet\nwallet = Wallet(databaseFilename=DATABASE, lazy=True)\nwallet.getAmountTotByAsset()",
+    # Same summary from a SQLite database: a GROUP BY instead of parsing the whole CSV file
+    'amount_by_asset_sqlite': "from CryptoWallet.Wallet import Wallet\nwallet = Wallet(databaseFilename=SQLITE_DATABASE, lazy=True)\nwallet.getAmountTotByAsset()",
+}
+
+
+def writeDatabase(filename, nRows, seed=0):
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(1546300800, 1704067200, nRows))
+    amounts = rng.normal(0, 10, nRows)
+    prices = rng.uniform(0.1, 1000, nRows)
+    pd.DataFrame({
+        'datetime': pd.to_datetime(seconds, unit='s', utc=True),
+        'asset': rng.choice(['BTC', 'ETH', 'BNB', 'ADA', 'SOL', 'USD', 'EUR', 'CHF'], nRows),
+        'amount': amounts,
+        'type': rng.choice(['SPOT_TRADE', 'DEPOSIT', 'SAVING_INTEREST', 'FEE'], nRows),
+        'exchange': rng.choice(['Binance', 'Kucoin'], nRows),
+        'userId': '123',
+        'wallet': 'SPOT',
+        'note': '',
+        'price_USD': prices,
+        'amount_USD': amounts * prices,
+    }).to_csv(filename, index=False)
+
+
+def writeSqliteDatabase(filename, csvFilename):
+    sys.path.insert(0, RepositoryPath)
+    from CryptoWallet.SqliteStore import SqliteStore
+    from CryptoWallet.Wallet import Wallet
+    SqliteStore(filename).write(Wallet.readTransactionsCsv(csvFilename))
+
+
+def runScenario(code, databases, workdir):
+    # Return the wall time of the process, and the lazy modules it imported. databases: variable name: database filename
+    variables = ''.join(f"{name} = {filename!r}\n" for name, filename in databases.items())
+    script = f"import sys\nsys.path.insert(0, {RepositoryPath!r})\n{variables}{code}\n" \
+             f"print('LAZY_MODULES:' + ','.join(m for m in {LazyModules!r} if m in sys.modules))"
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', script], cwd=workdir, capture_output=True, text=True, check=True).stdout
+    elapsed = time.perf_counter() - start
+    imported = [line for line in output.splitlines() if line.startswith('LAZY_MODULES:')][-1][len('LAZY_MODULES:'):]
+    return elapsed, [m for m in imported.split(',') if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the CryptoWallet package")
+    parser.add_argument('--rows', type=int, default=100000, help="Number of rows of the synthetic database")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_startup.json')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, 'transactions.csv')
+        writeDatabase(database, args.rows)
+        databases = {'DATABASE': database, 'SQLITE_DATABASE': os.path.join(workdir, 'transactions.db')}
+        writeSqliteDatabase(databases['SQLITE_DATABASE'], database)
+        # Python startup alone, to subtract from the scenarios
+        baseline = statistics.median(runScenario("pass", databases, workdir)[0] for _ in range(args.repeat))
+        for name, code in Scenarios.items():
+            times = []
+            for _ in range(args.repeat):
+                elapsed, imported = runScenario(code, databases, workdir)
+                times.append(elapsed)
+            results.append({'scenario': name, 'median_s': statistics.median(times), 'min_s': min(times),
+                            'python_startup_s': baseline, 'rows': args.rows, 'lazy_modules_imported': imported})
+            print(f"{name:<24} median={statistics.median(times):.3f} s  min={min(times):.3f} s  imported={imported}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
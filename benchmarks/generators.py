@@ -0,0 +1,209 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic exports in the formats understood by the loaders. The content is random but valid:
+# every generated file can be loaded by the corresponding loader and saved by the Wallet.
+
+Coins = ['BTC', 'ETH', 'BNB', 'ADA', 'SOL', 'DOT', 'LINK', 'AVAX', 'NEAR', 'ATOM', 'XRP', 'DOGE', 'MATIC', 'UNI', 'AAVE']
+Fiats = ['USD', 'EUR', 'CHF']
+StartTimestamp = pd.Timestamp('2019-01-01').value // 10**9
+EndTimestamp = pd.Timestamp('2024-01-01').value // 10**9
+
+
+def randomTimes(rng, n) -> pd.Series:
+    seconds = np.sort(rng.integers(StartTimestamp, EndTimestamp, n))
+    return pd.Series(pd.to_datetime(seconds, unit='s'))
+
+
+def randomAmounts(rng, n, scale=10.0) -> np.ndarray:
+    return np.round(rng.exponential(scale, n), 8) + 1e-8
+
+
+def binance(rng, nRows) -> pd.DataFrame:
+    # Trades are 3 rows at the same time: the bought asset, the spent USDT and the BNB fee
+    nEvents = nRows // 2
+    kinds = rng.choice(['Deposit', 'Withdraw', 'Trade', 'Simple Earn Flexible Interest', 'Simple Earn Flexible Subscription',
+                        'Simple Earn Flexible Redemption', 'Staking Rewards'], nEvents, p=[0.05, 0.03, 0.3, 0.5, 0.04, 0.03, 0.05])
+    times = randomTimes(rng, nEvents).dt.strftime('%Y-%m-%d %H:%M:%S')
+    coins = rng.choice(Coins, nEvents)
+    amounts = randomAmounts(rng, nEvents)
+    # Fiat deposits
+    fiatDeposit = (kinds == 'Deposit') & (rng.random(nEvents) < 0.3)
+    coins = np.where(fiatDeposit, rng.choice(Fiats, nEvents), coins)
+    interest = np.isin(kinds, ['Simple Earn Flexible Interest', 'Staking Rewards'])
+    amounts = np.where(interest, amounts / 10000, amounts)
+    sign = np.where(np.isin(kinds, ['Withdraw', 'Simple Earn Flexible Subscription']), -1, 1)
+
+    events = pd.DataFrame({'UTC_Time': times, 'Account': 'Spot', 'Operation': kinds, 'Coin': coins, 'Change': sign * amounts})
+    trades = events[events['Operation'] == 'Trade']
+    buy = trades.assign(Operation='Transaction Buy')
+    spend = trades.assign(Operation='Transaction Spend', Coin='USDT', Change=-trades['Change'] * rng.uniform(1, 1000, len(trades)))
+    fee = trades.assign(Operation='Transaction Fee', Coin='BNB', Change=-trades['Change'] / 1000)
+    rows = pd.concat([events[events['Operation'] != 'Trade'], buy, spend, fee]).sort_index(kind='stable').head(nRows)
+    rows.insert(0, 'User_ID', 141795728)
+    rows['Change'] = rows['Change'].round(8)
+    rows['Remark'] = ''
+    return rows
+
+
+def ledger(rng, nRows) -> pd.DataFrame:
+    kinds = rng.choice(['IN', 'OUT', 'FEES', 'NFT_IN'], nRows, p=[0.45, 0.2, 0.34, 0.01])
+    accounts = rng.integers(0, 5, nRows)
+    return pd.DataFrame({
+        'Operation Date': randomTimes(rng, nRows).dt.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        'Status': rng.choice(['Confirmed', 'Failed'], nRows, p=[0.98, 0.02]),
+        'Currency Ticker': rng.choice(['ETH', 'USDC', 'LINK', 'UNI', 'AAVE'], nRows),
+        'Operation Type': kinds,
+        'Operation Amount': randomAmounts(rng, nRows),
+        'Operation Fees': randomAmounts(rng, nRows, 0.001),
+        'Operation Hash': [f"0x{h:064x}" for h in rng.integers(0, 2**62, nRows)],
+        'Account Name': [f"Ethereum {a + 1}" for a in accounts],
+        'Account xpub': [f"0x{a:040x}" for a in accounts],
+        'Countervalue Ticker': 'USD',
+        'Countervalue at Operation Date': randomAmounts(rng, nRows, 100),
+        'Countervalue at CSV Export': randomAmounts(rng, nRows, 100),
+    })
+
+
+def swissborg(rng, nRows) -> pd.DataFrame:
+    kinds = rng.choice(['Deposit', 'Withdrawal', 'Buy', 'Sell', 'Payouts'], nRows, p=[0.1, 0.05, 0.3, 0.15, 0.4])
+    times = randomTimes(rng, nRows)
+    gross = randomAmounts(rng, nRows)
+    grossUsd = np.round(gross * rng.uniform(0.5, 100, nRows), 2) + 0.01
+    fee = np.where(np.isin(kinds, ['Buy', 'Sell']), np.round(gross / 100, 8), 0.0)
+    return pd.DataFrame({
+        'Local time': (times + pd.Timedelta(hours=1)).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Time in UTC': times.dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Type': kinds,
+        'Currency': rng.choice(Coins[:6] + ['CHSB', 'BORG'], nRows),
+        'Gross amount': gross,
+        'Gross amount (USD)': grossUsd,
+        'Fee': fee,
+        'Fee (USD)': fee * grossUsd / gross,
+        'Net amount': gross - fee,
+        'Net amount (USD)': grossUsd,
+        'Note': '',
+    })
+
+
+def kucoin(rng, nRows) -> pd.DataFrame:
+    kinds = rng.choice(['Spot', 'Deposit', 'Withdrawal', 'Rewards', 'Transfer', 'KuCoin Event'], nRows, p=[0.6, 0.1, 0.05, 0.15, 0.08, 0.02])
+    side = np.where(kinds == 'Deposit', 'Deposit', np.where(kinds == 'Withdrawal', 'Withdrawal', rng.choice(['Deposit', 'Withdrawal'], nRows)))
+    side = np.where(kinds == 'Rewards', 'Deposit', side)
+    amounts = randomAmounts(rng, nRows)
+    return pd.DataFrame({
+        'UID': 87654321,
+        'Account Type': 'mainAccount',
+        'Currency': rng.choice(Coins + ['KCS', 'USDT'], nRows),
+        'Side': side,
+        'Amount': amounts,
+        'Fee': np.where((kinds == 'Spot') & (rng.random(nRows) < 0.5), np.round(amounts / 1000, 8), 0.0),
+        'Time(UTC+02:00)': (randomTimes(rng, nRows) + pd.Timedelta(hours=2)).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Remark': '',
+        'Type': kinds,
+    })
+
+
+def bybitSpot(rng, nRows) -> pd.DataFrame:
+    kinds = rng.choice(['TRADE', 'TRANSFER_IN', 'TRANSFER_OUT'], nRows, p=[0.9, 0.05, 0.05])
+    currencies = rng.choice(Coins + ['USDT', 'USDC'], nRows)
+    quotes = rng.choice(['USDT', 'USDC', 'BTC'], nRows)
+    contracts = np.where(kinds == 'TRADE', np.char.add(currencies.astype(str), quotes.astype(str)), '')
+    direction = np.where(kinds == 'TRADE', rng.choice(['BUY', 'SELL'], nRows), '')
+    cashFlow = randomAmounts(rng, nRows) * np.where((direction == 'SELL') | (kinds == 'TRANSFER_OUT'), -1, 1)
+    return pd.DataFrame({
+        'Uid': 12345678,
+        'Currency': currencies,
+        'Contract': pd.Series(contracts).replace('', np.nan),
+        'Type': kinds,
+        'Direction': direction,
+        'Quantity': np.abs(cashFlow),
+        'Position': 0,
+        'Filled Price': np.round(rng.uniform(0.1, 1000, nRows), 4),
+        'Funding': 0,
+        'Fee Paid': np.where(kinds == 'TRADE', -np.round(np.abs(cashFlow) / 1000, 8), 0.0),
+        'Cash Flow': cashFlow,
+        'Change': cashFlow,
+        'Wallet Balance': 0,
+        'Action': '',
+        'Time(UTC)': randomTimes(rng, nRows).dt.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def bybitFunding(rng, nRows) -> pd.DataFrame:
+    kinds = rng.choice(['Deposit', 'Withdrawal', 'Flexible Savings Interest Distribution', 'Earn'], nRows, p=[0.2, 0.1, 0.6, 0.1])
+    qty = randomAmounts(rng, nRows) * np.where(kinds == 'Withdrawal', -1, 1)
+    # Earn rows without description are moves to the SAVING wallet
+    subscription = kinds == 'Earn'
+    return pd.DataFrame({
+        'Date & Time(UTC)': randomTimes(rng, nRows).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'Coin': rng.choice(Coins + ['USDT'], nRows),
+        'QTY': np.where(subscription, -np.abs(qty), qty),
+        'Description': pd.Series(np.where(subscription, '', kinds)).replace('', np.nan),
+        'Type': np.where(subscription, 'Earn', 'Other'),
+    })
+
+
+def writeBinance(dirpath, nRows, seed=0) -> str:
+    filepath = os.path.join(dirpath, f"binance_{nRows}.csv")
+    binance(np.random.default_rng(seed), nRows).to_csv(filepath, index=False)
+    return filepath
+
+
+def writeLedger(dirpath, nRows, seed=0) -> str:
+    filepath = os.path.join(dirpath, f"ledger_{nRows}.csv")
+    ledger(np.random.default_rng(seed), nRows).to_csv(filepath, index=False)
+    return filepath
+
+
+def writeSwissborg(dirpath, nRows, seed=0) -> str:
+    from openpyxl import Workbook
+    filepath = os.path.join(dirpath, f"swissborg_{nRows}.xlsx")
+    rows = swissborg(np.random.default_rng(seed), nRows)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    # Account statement header: the user id is in cell E6, the table header in row 14
+    for line in range(1, 14):
+        if line == 5:
+            sheet.append(['Account statement', None, None, None, 'User ID'])
+        elif line == 6:
+            sheet.append(['', None, None, None, 'a1b2c3d4-0000-1111-2222-333344445555'])
+        else:
+            sheet.append([f"Header line {line}"])
+    sheet.append(list(rows.columns))
+    for row in rows.itertuples(index=False):
+        sheet.append(list(row))
+    workbook.save(filepath)
+    return filepath
+
+
+def writeKucoin(dirpath, nRows, seed=0) -> str:
+    folderpath = os.path.join(dirpath, f"kucoin_{nRows}")
+    os.makedirs(folderpath, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    kucoin(rng, nRows - nRows // 4).to_csv(os.path.join(folderpath, "Account History_Trading Account_2019-2024.csv"), index=False)
+    kucoin(rng, nRows // 4).to_csv(os.path.join(folderpath, "Account History_Funding Account_2019-2024.csv"), index=False)
+    return folderpath
+
+
+def writeBybit(dirpath, nRows, seed=0) -> str:
+    folderpath = os.path.join(dirpath, f"bybit_{nRows}")
+    os.makedirs(folderpath, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for prefix, rows in [("Bybit_AssetChangeDetails_uta", bybitSpot(rng, nRows - nRows // 4)),
+                         ("Bybit_AssetChangeDetails_fund", bybitFunding(rng, nRows // 4))]:
+        with open(os.path.join(folderpath, f"{prefix}_2019-2024.csv"), 'w', newline='') as f:
+            f.write("UID: 12345678,\n")
+            rows.to_csv(f, index=False)
+    return folderpath
+
+
+# Exchange name: (function writing the export and returning its path, loader class name)
+Writers = {
+    'Binance': (writeBinance, 'BinanceLoader'),
+    'Ledger': (writeLedger, 'LedgerLoader'),
+    'Swissborg': (writeSwissborg, 'SwissborgLoader'),
+    'Kucoin': (writeKucoin, 'KucoinLoader'),
+    'Bybit': (writeBybit, 'BybitLoader'),
+}
@@ -1,19 +1,24 @@
+import os
 import sys
+import threading
+import numpy as np
 import pandas as pd
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QTableWidget, 
-                           QTableWidgetItem, QVBoxLayout, QHBoxLayout,
+from PyQt6.QtWidgets import (QApplication, QMainWindow, QTableView,
+                           QVBoxLayout, QHBoxLayout,
                            QWidget, QLineEdit, QComboBox, QDialog, 
-                           QCheckBox, QPushButton, QScrollArea, QLabel)
-from PyQt6.QtCore import Qt, QSignalBlocker
-from collections import defaultdict
+                           QCheckBox, QPushButton, QScrollArea, QLabel,
+                           QProgressBar, QTabWidget)
+from PyQt6.QtCore import Qt, QSignalBlocker, QObject, pyqtSignal, QAbstractTableModel, QModelIndex, QRunnable, QThreadPool
+import time
 
 from CryptoWallet.Loader import BinanceLoader, SwissborgLoader, KucoinLoader, BybitLoader, ManualTransactionsLoader, CoinbaseLoader
 from CryptoWallet.Wallet import Wallet
 from CryptoWallet.Settings import Settings
+from CryptoWallet import Importer
 
 
 class FilterDialog(QDialog):
-    def __init__(self, parent, column_values, column_name):
+    def __init__(self, parent, value_counts, column_name, selected_values=None):
         super().__init__(parent)
         self.setWindowTitle(f"Filter {column_name}")
         self.setMinimumWidth(250)
@@ -36,13 +41,12 @@ class FilterDialog(QDialog):
         self.select_all.checkStateChanged.connect(self.toggle_all)
         self.checkbox_layout.addWidget(self.select_all)
 
-        # Add value checkboxes with counts
+        # Add value checkboxes with counts. value_counts is computed by the model, in pandas.
         self.checkboxes = {}
-        value_counts = pd.Series(column_values).value_counts()
         for value in sorted(value_counts.index):
             count = value_counts[value]
             checkbox = QCheckBox(f"{value} ({count})")
-            checkbox.setChecked(True)
+            checkbox.setChecked(selected_values is None or value in selected_values)
             self.checkboxes[value] = checkbox
             self.checkbox_layout.addWidget(checkbox)
 
@@ -103,52 +107,157 @@ class FilterDialog(QDialog):
         return {value for value, checkbox in self.checkboxes.items() 
                 if checkbox.isChecked()}
 
-class DataFrameTable(QTableWidget):
+class DataFrameModel(QAbstractTableModel):
+    """Table model backed directly by a DataFrame.
+
+    Cells are formatted only when the view asks for them, i.e. for the visible rows.
+    Filtering and sorting compute an array of row positions with pandas, the DataFrame itself is never copied.
+    """
+    def __init__(self, df=None):
+        super().__init__()
+        self.filters = {}  # Column index: set of allowed display values
+        self.sort_column = None
+        self.sort_order = Qt.SortOrder.AscendingOrder
+        self.setDataFrame(pd.DataFrame() if df is None else df)
+
+    def setDataFrame(self, df):
+        self.beginResetModel()
+        self.df = df  # Rows are accessed by position, whatever the index
+        self._values = [self.df[column].to_numpy() for column in self.df.columns]
+        self._display_columns = {}  # Cache of the columns formatted as strings, only for the filtered columns
+        self.filters = {}
+        self._rows = np.arange(len(self.df))  # Positions of the displayed rows in self.df
+        self.endResetModel()
+        if self.sort_column is not None and self.sort_column < len(self.df.columns):
+            self.sort(self.sort_column, self.sort_order)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.df.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        return str(self._values[index.column()][self._rows[index.row()]])
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return str(self.df.columns[section])
+        return str(self._rows[section])
+
+    def display_column(self, column):
+        # Column formatted as in the cells, computed once per column
+        if column not in self._display_columns:
+            self._display_columns[column] = self.df.iloc[:, column].astype(str)
+        return self._display_columns[column]
+
+    def value_counts(self, column):
+        return self.display_column(column).value_counts()
+
+    def setFilter(self, column, allowed_values):
+        if allowed_values is None:
+            self.filters.pop(column, None)
+        else:
+            self.filters[column] = set(allowed_values)
+        self.apply_filters()
+
+    def apply_filters(self):
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, allowed_values in self.filters.items():
+            mask &= self.display_column(column).isin(allowed_values).to_numpy()
+        self.beginResetModel()
+        self._rows = np.flatnonzero(mask)
+        self.endResetModel()
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_order)
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        if not 0 <= column < len(self.df.columns):  # -1 when the sort indicator is cleared
+            return
+        self.sort_column, self.sort_order = column, order
+        # Values of the displayed rows, indexed by their position in self._rows
+        values = pd.Series(self._values[column][self._rows])
+        # Enums are sorted by name, like they are displayed
+        if values.dtype == object:
+            values = values.map(str, na_action='ignore')
+        sorted_values = values.sort_values(ascending=(order == Qt.SortOrder.AscendingOrder), kind='stable', na_position='last')
+        self.layoutAboutToBeChanged.emit()
+        self._rows = self._rows[sorted_values.index.to_numpy()]
+        self.layoutChanged.emit()
+
+
+class DataFrameTable(QTableView):
     def __init__(self, df):
         super().__init__()
-        self.df = df
-        self.filters = defaultdict(set)  # Column filters
-        self.setDataFrame(df)
+        self.setModel(DataFrameModel(df))
         self.setSortingEnabled(True)
+        self.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        # Fixed row height, so the view never measures the content of the rows
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 6)
+        self.verticalHeader().setSectionResizeMode(self.verticalHeader().ResizeMode.Fixed)
         
         # Enable context menu for headers
         header = self.horizontalHeader()
         header.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         header.customContextMenuRequested.connect(self.show_filter_dialog)
+
+    def setDataFrame(self, df):
+        self.model().setDataFrame(df)
     
     def show_filter_dialog(self, pos):
+        model = self.model()
         column_index = self.horizontalHeader().logicalIndexAt(pos)
-        column_name = self.horizontalHeaderItem(column_index).text()
+        column_name = model.headerData(column_index, Qt.Orientation.Horizontal)
         
-        # Get all values in the column
-        column_values = [self.item(row, column_index).text() 
-                        for row in range(self.rowCount())]
-        
-        dialog = FilterDialog(self, column_values, column_name)
+        dialog = FilterDialog(self, model.value_counts(column_index), column_name, model.filters.get(column_index))
         if dialog.exec():
-            self.filters[column_index] = dialog.get_selected_values()
-            self.apply_filters()
+            selected_values = dialog.get_selected_values()
+            # No filter if all the values are selected
+            model.setFilter(column_index, None if len(selected_values) == len(dialog.checkboxes) else selected_values)
 
-    def apply_filters(self):
-        for row in range(self.rowCount()):
-            show_row = True
-            for col, allowed_values in self.filters.items():
-                value = self.item(row, col).text()
-                if value not in allowed_values:
-                    show_row = False
-                    break
-            self.setRowHidden(row, not show_row)
+class PriceSnapshotBridge(QObject):
+    # The price refresher calls its subscribers from its worker thread. Emitting a signal
+    # queues the snapshot to the GUI thread, where widgets can safely be updated.
+    snapshotReceived = pyqtSignal(object)
 
-    def setDataFrame(self, df):
-        self.setRowCount(len(df.index))
-        self.setColumnCount(len(df.columns))
-        self.setHorizontalHeaderLabels(df.columns)
-        
-        for i in range(len(df.index)):
-            for j in range(len(df.columns)):
-                value = str(df.iloc[i, j])
-                item = QTableWidgetItem(value)
-                self.setItem(i, j, item)
+class WorkerSignals(QObject):
+    # Signals of a Worker, emitted from the thread pool and delivered in the GUI thread
+    progress = pyqtSignal(int, int, str)  # done, total, message
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    finished = pyqtSignal()
+
+class Worker(QRunnable):
+    # Run fn(progress, cancelled) in the global thread pool, so the GUI thread never blocks on
+    # the parsing of the database, the exports or the API requests.
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = WorkerSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def report_progress(self, done, total, message=''):
+        self.signals.progress.emit(done, total, message)
+
+    def run(self):
+        try:
+            result = self.fn(self.report_progress, self.is_cancelled)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -157,24 +266,164 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, 800, 600)
         
         self.settings = Settings.load()
-        self.wallet = Wallet(apiKey=self.settings.cryptocompare_api_key, databaseFilename=self.settings.root_dirpath)
-        
-        # Create sample DataFrame
-        data = {
-            'Column' + str(i): [f'Value{i}-{j}' for j in range(10)]
-            for i in range(5)
-        }
-        df = pd.DataFrame(data)
+        self.wallet = None
+        self.worker = None
+        self.thread_pool = QThreadPool.globalInstance()
         
-        # Simplified layout with just the table
         main_widget = QWidget()
         layout = QVBoxLayout()
-        self.table = DataFrameTable(df)
-        layout.addWidget(self.table)
+
+        # Actions, run in background one at a time
+        buttons_layout = QHBoxLayout()
+        self.import_button = QPushButton("Import exports")
+        self.import_button.clicked.connect(self.import_exports)
+        self.backfill_button = QPushButton("Backfill prices")
+        self.backfill_button.clicked.connect(self.backfill_prices)
+        self.refresh_button = QPushButton("Refresh prices")
+        self.refresh_button.clicked.connect(self.refresh_prices)
+        self.stats_button = QPushButton("Compute stats")
+        self.stats_button.clicked.connect(self.compute_stats)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_job)
+        self.action_buttons = [self.import_button, self.backfill_button, self.refresh_button, self.stats_button]
+        for button in self.action_buttons + [self.cancel_button]:
+            buttons_layout.addWidget(button)
+        layout.addLayout(buttons_layout)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        layout.addWidget(self.progress_bar)
+
+        # The tables start empty and are filled when the background jobs finish
+        self.tabs = QTabWidget()
+        self.table = DataFrameTable(pd.DataFrame())
+        self.stats_table = DataFrameTable(pd.DataFrame())
+        self.tabs.addTab(self.table, "Transactions")
+        self.tabs.addTab(self.stats_table, "Stats")
+        layout.addWidget(self.tabs)
         
         main_widget.setLayout(layout)
         self.setCentralWidget(main_widget)
 
+        # Refresh the current prices in background, and show the time of the last refresh
+        self.price_bridge = PriceSnapshotBridge()
+        self.price_bridge.snapshotReceived.connect(self.on_prices_updated)
+
+        self.run_job("Loading the wallet", self.load_wallet, self.on_wallet_loaded)
+
+    def run_job(self, description, fn, on_result=None):
+        # Start fn(progress, cancelled) in the thread pool. Only one job runs at a time, as they all modify the wallet.
+        if self.worker is not None:
+            return
+        self.worker = Worker(fn)
+        self.worker.signals.progress.connect(self.on_progress)
+        self.worker.signals.error.connect(self.on_error)
+        self.worker.signals.finished.connect(self.on_finished)
+        if on_result is not None:
+            self.worker.signals.result.connect(on_result)
+        self.set_busy(True)
+        self.progress_bar.setRange(0, 0)  # Busy indicator until the first progress
+        self.progress_bar.setFormat(description)
+        self.statusBar().showMessage(f"{description}...")
+        self.thread_pool.start(self.worker)
+
+    def set_busy(self, busy):
+        for button in self.action_buttons:
+            button.setEnabled(not busy and self.wallet is not None)
+        self.cancel_button.setEnabled(busy)
+
+    def cancel_job(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.statusBar().showMessage("Cancelling...")
+
+    def on_progress(self, done, total, message):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f"%v/%m {message}")
+
+    def on_error(self, message):
+        self.statusBar().showMessage(f"Error: {message}")
+
+    def on_finished(self):
+        self.worker = None
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("")
+        self.set_busy(False)
+
+    # Background jobs, they must not touch the widgets
+
+    def load_wallet(self, progress, cancelled):
+        wallet = Wallet(apiKey=self.settings.cryptocompare_api_key, databaseFilename=self.settings.database_filepath, lazy=True)
+        wallet.transactions  # Parse the database here rather than in the GUI thread
+        return wallet
+
+    def on_wallet_loaded(self, wallet):
+        self.wallet = wallet
+        # The jobs modify the transactions in the pool thread, the model holds views of its own copy
+        self.table.setDataFrame(wallet.transactions.copy())
+        self.statusBar().showMessage(f"{len(wallet.transactions)} transactions loaded")
+        refresher = self.wallet.startPriceRefresher()
+        if refresher is not None:
+            refresher.subscribe(self.price_bridge.snapshotReceived.emit)
+
+    def import_exports(self):
+        def job(progress, cancelled):
+            count_before = len(self.wallet.transactions)
+            Importer.importExports(self.wallet, self.settings.exported_transactions_dirpath,
+                                   progress=lambda done, total, path, result, seconds: progress(done, total, os.path.basename(path)),
+                                   cancelled=cancelled)
+            self.request_prices_and_save(progress, cancelled)
+            return len(self.wallet.transactions) - count_before
+        self.run_job("Importing the exports", job, self.on_transactions_changed)
+
+    def backfill_prices(self):
+        def job(progress, cancelled):
+            missing = self.wallet.transactions['price_USD'].isna().sum()
+            self.request_prices_and_save(progress, cancelled)
+            return missing - self.wallet.transactions['price_USD'].isna().sum()
+        self.run_job("Requesting the missing prices", job, self.on_transactions_changed)
+
+    def request_prices_and_save(self, progress, cancelled):
+        # Wallet.save() requests the missing prices itself, request them before to report the progress and allow cancellation.
+        # The prices received before a cancellation are kept in memory, but the database is not saved.
+        self.wallet.addUsdData(progress=lambda done, total: progress(done, total, "prices"), cancelled=cancelled)
+        if not cancelled():
+            self.wallet.save()
+
+    def on_transactions_changed(self, count):
+        self.table.setDataFrame(self.wallet.transactions.copy())
+        self.statusBar().showMessage(f"{count} transactions updated")
+
+    def refresh_prices(self):
+        # The refresher fetches the prices in its own thread, the snapshot is received by on_prices_updated
+        if self.wallet.priceRefresher is not None and self.wallet.priceRefresher.isRunning():
+            self.wallet.priceRefresher.requestRefresh()
+            self.statusBar().showMessage("Refreshing the prices...")
+        else:
+            self.run_job("Refreshing the prices", lambda progress, cancelled: self.wallet.getCurrentPrices(),
+                         lambda prices: self.statusBar().showMessage(f"{prices.notna().sum()} prices updated"))
+
+    def compute_stats(self):
+        self.run_job("Computing the stats", lambda progress, cancelled: self.wallet.getCoinsStats(), self.on_stats_computed)
+
+    def on_stats_computed(self, stats):
+        self.stats_table.setDataFrame(stats)
+        self.tabs.setCurrentWidget(self.stats_table)
+        self.statusBar().showMessage("Stats computed")
+
+    def on_prices_updated(self, snapshot):
+        self.statusBar().showMessage(f"Prices updated at {time.strftime('%H:%M:%S', time.localtime(snapshot.timestamp))}")
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+        self.thread_pool.waitForDone()
+        if self.wallet is not None:
+            self.wallet.stopPriceRefresher()
+        super().closeEvent(event)
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
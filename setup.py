@@ -11,4 +11,12 @@ setup(
         'numpy',
         'pandas',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': [
+            'cryptowallet=CryptoWallet.CommandLine:main',
+        ],
+    },
 )
\ No newline at end of file
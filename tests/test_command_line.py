@@ -0,0 +1,64 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.generators import writeBinance, writeLedger
+from CryptoWallet import CommandLine, Importer
+from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+from CryptoWallet.StubServer import CryptoCompareStubServer
+from CryptoWallet.Transport import HttpTransport
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Settings, exports, database and caches in a temporary folder, prices from the stub server
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("exports/Binance")
+    os.makedirs("exports/Ledger")
+    writeBinance("exports/Binance", 40)
+    writeLedger("exports/Ledger", 40)
+    # Fiat deposits, the summary reports the expenses of each fiat
+    os.makedirs("exports/Manual")
+    pd.DataFrame({'datetime': ['2018-06-01T00:00:00+00:00'] * 3, 'asset': ['USD', 'EUR', 'CHF'], 'amount': 1000.0, 'type': 'DEPOSIT',
+                  'exchange': 'Bank', 'userId': '1', 'wallet': 'SPOT', 'note': 'Initial deposit', 'price_USD': [1.0, 1.1, 1.05],
+                  'amount_USD': [1000.0, 1100.0, 1050.0]}).to_csv("exports/Manual/fiat.csv", index=False)
+    with CryptoCompareStubServer() as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        yield tmp_path
+        CryptoCompareWrapper.setTransport(previous)
+
+def writeSettings(apiKey):
+    with open("settings.json", 'w') as f:
+        json.dump({'root_dirpath': ".", 'database_filepath': "transactions.csv", 'exported_transactions_dirpath': "exports", 'output_dirpath': "output",
+                   'cryptocompare_api_key': apiKey}, f)
+    return ['--settings', "settings.json", '--quiet']
+
+def test_importAndReport(workdir, capsys):
+    settings = writeSettings("key")
+    assert CommandLine.main(settings + ['import', '--no-cache', '--workers', '1']) == CommandLine.EXIT_OK
+    transactions = pd.read_csv("transactions.csv")
+    assert set(transactions['exchange']) == {'Binance', 'Ledger', 'Bank'}
+    assert transactions['price_USD'].notna().all()
+    assert not os.path.exists(os.path.join(".CryptoWallet", "cache", "transactions"))  # Nothing cached with --no-cache
+
+    capsys.readouterr()
+    assert CommandLine.main(settings + ['report', '--format', 'json']) == CommandLine.EXIT_OK
+    summary = json.loads(capsys.readouterr().out)
+    assert summary
+
+def test_missingApiKey(workdir, capsys, monkeypatch):
+    settings = writeSettings("")
+    monkeypatch.setattr(Importer, 'importExports', lambda *args, **kwargs: pytest.fail("Exports loaded without API key"))
+    for command in (['import'], ['enrich']):
+        assert CommandLine.main(settings + command) == CommandLine.EXIT_ERROR
+        assert "No CryptoCompare API key" in capsys.readouterr().err
+    assert not os.path.exists("transactions.csv")
+
+def test_settingsOnlyWrittenByInit(workdir):
+    arguments = ['--quiet']
+    CommandLine.main(arguments + ['report'])
+    assert not os.path.exists(os.path.join(".CryptoWallet", "settings.json"))
+    assert CommandLine.main(arguments + ['init']) == CommandLine.EXIT_OK
+    assert os.path.exists(os.path.join(".CryptoWallet", "settings.json"))
+    assert CommandLine.main(arguments + ['init']) == CommandLine.EXIT_ERROR  # Never overwritten
@@ -0,0 +1,97 @@
+import pytest
+
+from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+from CryptoWallet.StubServer import CryptoCompareStubServer
+from CryptoWallet.Transport import HttpTransport, RecordingTransport, ReplayTransport
+import pandas as pd
+
+@pytest.fixture
+def stubServer():
+    with CryptoCompareStubServer(unsupportedAssets=['UNKNOWN']) as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        yield server
+        CryptoCompareWrapper.setTransport(previous)
+
+def test_batchAssets():
+    assets = [f"COIN{i}" for i in range(500)]
+    batches = CryptoCompareWrapper.batchAssets(assets)
+    assert [asset for batch in batches for asset in batch] == assets
+    assert all(len(','.join(batch)) <= CryptoCompareWrapper.MAX_FSYMS_LENGTH for batch in batches)
+
+def test_requestApiCurrentPrices(stubServer):
+    assets = pd.Series([f"COIN{i}" for i in range(500)] + ['IOTA', 'UNKNOWN'])
+    prices = CryptoCompareWrapper.requestApiCurrentPrices(assets, "key")
+    assert set(prices.index) == set(assets)
+    assert prices['UNKNOWN'] != prices['UNKNOWN']  # NaN
+    assert prices.drop('UNKNOWN').notna().all()
+
+def test_recordAndReplay(stubServer, tmp_path):
+    archive = str(tmp_path / "cryptocompare.json.gz")
+    assets = pd.Series(['BTC', 'ETH'])
+    with RecordingTransport(archive, HttpTransport(baseUrl=stubServer.url)) as recorder:
+        CryptoCompareWrapper.setTransport(recorder)
+        recorded = CryptoCompareWrapper.requestApiCurrentPrices(assets, "key")
+
+    CryptoCompareWrapper.setTransport(ReplayTransport(archive))
+    count = stubServer.requestsCount
+    replayed = CryptoCompareWrapper.requestApiCurrentPrices(assets, "other key")
+    assert replayed.equals(recorded)
+    assert stubServer.requestsCount == count
+
+    CryptoCompareWrapper.setTransport(ReplayTransport(archive, rateLimitEvery=1))
+    with pytest.raises(Exception):
+        CryptoCompareWrapper.requestApiCurrentPrices(assets, "key")
+
+def test_addMissingUsdPrice(stubServer, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The hourly candles are cached in the working directory
+    transactions = pd.DataFrame({
+        'datetime': pd.to_datetime(['2023-01-01 10:30', '2023-06-01 12:00'], utc=True),
+        'asset': ['BTC', 'ETH'],
+        'price_USD': [float('nan'), 10.0]
+    })
+    transactions = CryptoCompareWrapper.addMissingUsdPrice(transactions, "key")
+    expected = CryptoCompareStubServer.price('BTC', transactions['datetime'][0].floor('h').timestamp())
+    assert transactions['price_USD'][0] == pytest.approx(expected)
+    assert transactions['price_USD'][1] == 10.0
+
+def test_addMissingUsdPriceCachedCandles(stubServer, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    datetimes = pd.date_range('2023-01-01', '2023-03-01', freq='37min', tz='UTC')
+    transactions = pd.DataFrame({'datetime': datetimes, 'asset': ['BTC', 'IOTA', 'UNKNOWN'] * (len(datetimes) // 3) + ['BTC'] * (len(datetimes) % 3),
+                                 'price_USD': float('nan')})
+    count = stubServer.requestsCount
+    enriched = CryptoCompareWrapper.addMissingUsdPrice(transactions.copy(), "key")
+    # A request per asset and range of up to 2000 hours, instead of a request per transaction
+    assert stubServer.requestsCount - count == 3
+    isKnown = transactions['asset'] != 'UNKNOWN'
+    expected = [CryptoCompareStubServer.price(CryptoCompareWrapper.AssetNameMap.get(asset, asset), datetime.floor('h').timestamp())
+                for datetime, asset in zip(transactions.loc[isKnown, 'datetime'], transactions.loc[isKnown, 'asset'])]
+    assert enriched.loc[isKnown, 'price_USD'].tolist() == pytest.approx(expected)
+    assert enriched.loc[~isKnown, 'price_USD'].isna().all()
+
+    # Re-enriching is done from the cached candles
+    count = stubServer.requestsCount
+    reenriched = CryptoCompareWrapper.addMissingUsdPrice(transactions[isKnown].copy(), "key")
+    assert stubServer.requestsCount == count
+    pd.testing.assert_series_equal(reenriched['price_USD'], enriched.loc[isKnown, 'price_USD'])
+
+def test_addMissingUsdPriceBeforeListing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    listing = pd.Timestamp('2023-02-01', tz='UTC')
+    with CryptoCompareStubServer(listings={'NEW': int(listing.timestamp())}) as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        try:
+            datetimes = pd.date_range('2023-01-20', '2023-02-10', freq='5h', tz='UTC')
+            transactions = pd.DataFrame({'datetime': datetimes, 'asset': 'NEW', 'price_USD': float('nan')})
+            enriched = CryptoCompareWrapper.addMissingUsdPrice(transactions.copy(), "key")
+            isListed = transactions['datetime'] >= listing
+            assert enriched.loc[isListed, 'price_USD'].notna().all()
+            assert enriched.loc[~isListed, 'price_USD'].isna().all()
+
+            # The hours without candle are cached as such, and not requested again
+            count = server.requestsCount
+            reenriched = CryptoCompareWrapper.addMissingUsdPrice(transactions.copy(), "key")
+            assert server.requestsCount == count
+            pd.testing.assert_series_equal(reenriched['price_USD'], enriched['price_USD'])
+        finally:
+            CryptoCompareWrapper.setTransport(previous)
@@ -1,7 +1,8 @@
 import pytest 
 
 from CryptoWallet.Wallet import Wallet
-from CryptoWallet.Loader import BinanceLoader
+from CryptoWallet.Loader import BinanceLoader, SwissborgLoader, KucoinLoader, BybitLoader, LedgerLoader
+from CryptoWallet.Transaction import TransactionType, WalletType
 import pandas as pd
 
 def test_BinanceUnknowTransactionType():
@@ -11,3 +12,168 @@ def test_BinanceUnknowTransactionType():
 def test_BinanceNonStdCoins():
     df = BinanceLoader.load("tests/data/test_BinanceNonStdCoins.csv")
     assert df.asset.equals(pd.Series(['MIOTA','SHIB']))
+
+def writeSwissborgStatement(filepath, rows):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet['E6'] = 'user-1'
+    header = ['Local time', 'Time in UTC', 'Type', 'Currency', 'Gross amount', 'Gross amount (USD)', 'Fee', 'Fee (USD)', 'Net amount', 'Net amount (USD)', 'Note']
+    for column, name in enumerate(header, start=1):
+        sheet.cell(row=14, column=column, value=name)
+    for line, row in enumerate(rows, start=15):
+        for column, value in enumerate(row, start=1):
+            sheet.cell(row=line, column=column, value=value)
+    workbook.save(filepath)
+
+def test_SwissborgStatement(tmp_path, monkeypatch):
+    filepath = str(tmp_path / "statement.xlsx")
+    writeSwissborgStatement(filepath, [
+        ['', '2024-01-01 10:00:00', 'Buy', 'BTC', 0.5, 20000.0, 0.005, 200.0, 0.495, 19800.0, None],
+        ['', '2024-01-02 11:00:00', 'Withdrawal', 'ETH', 2.0, 4000.0, 0, 0, 2.0, 4000.0, 'To Ledger'],
+        ['', '2024-01-03 12:00:00', 'Payouts', 'CHSB', 10.0, 3.0, 0, 0, 10.0, 3.0, None],
+    ])
+    df = SwissborgLoader.load(filepath)
+    assert df['type'].tolist() == [TransactionType.SPOT_TRADE, TransactionType.FEE, TransactionType.WITHDRAW, TransactionType.STAKING_INTEREST]
+    assert df['amount'].tolist() == [0.5, -0.005, -2.0, 10.0]
+    assert df['amount_USD'].tolist() == [20000.0, -200.0, -4000.0, 3.0]
+    assert df['price_USD'].tolist() == [40000.0, 40000.0, 2000.0, 0.3]
+    assert df['note'].tolist() == ['Type=Buy', 'Type=Buy, Fee', 'Type=Withdrawal, Note=To Ledger', 'Type=Payouts']
+    assert (df['userId'] == 'user-1').all()
+    assert df['datetime'].iloc[2] == pd.Timestamp('2024-01-02 11:00:00', tz='UTC')
+
+    # An unchanged statement is read back from the cache of the importer, and parsed again without a cache
+    import openpyxl
+    from CryptoWallet import Importer
+    calls = []
+    loadWorkbook = openpyxl.load_workbook
+    monkeypatch.setattr(openpyxl, 'load_workbook', lambda *args, **kwargs: calls.append(args) or loadWorkbook(*args, **kwargs))
+    cacheDirpath = str(tmp_path / "cache")
+    Importer.loadExport('SwissborgLoader', filepath, cacheDirpath)
+    cached, _ = Importer.loadExport('SwissborgLoader', filepath, cacheDirpath)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(cached, df)
+    Importer.loadExport('SwissborgLoader', filepath, None)
+    Importer.loadExport('SwissborgLoader', filepath, None)
+    assert len(calls) == 3
+
+def test_loadExportCache(tmp_path, monkeypatch):
+    from benchmarks.generators import writeLedger
+    from CryptoWallet import Importer
+    from CryptoWallet.Loader import LedgerLoader
+    path = writeLedger(str(tmp_path), 50)
+    calls = []
+    load = LedgerLoader.load
+    monkeypatch.setattr(LedgerLoader, 'load', lambda path: calls.append(path) or load(path))
+    cacheDirpath = str(tmp_path / "cache")
+
+    transactions, _ = Importer.loadExport('LedgerLoader', path, cacheDirpath)
+    cached, _ = Importer.loadExport('LedgerLoader', path, cacheDirpath)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(cached, transactions)
+    # A new version of the loader or a changed export is parsed again
+    monkeypatch.setattr(LedgerLoader, 'version', LedgerLoader.version + 1)
+    Importer.loadExport('LedgerLoader', path, cacheDirpath)
+    with open(path, 'a') as f:
+        f.write(open(path).read().splitlines()[-1] + '\n')
+    Importer.loadExport('LedgerLoader', path, cacheDirpath)
+    assert len(calls) == 3
+
+def test_KucoinAccountHistory(tmp_path):
+    pd.DataFrame({
+        'UID': 87654321,
+        'Currency': ['BTC', 'USDT', 'KCS'],
+        'Side': ['Deposit', 'Withdrawal', 'Deposit'],
+        'Amount': [0.5, 100.0, 1.0],
+        'Fee': [0.001, 0.0, 0.0],
+        'Time(UTC-05:30)': ['2024-01-01 08:00:00', '2024-01-02 23:00:00', '2024-01-03 00:00:00'],
+        'Remark': ['', 'To Ledger', ''],
+        'Type': ['Spot', 'Withdrawal', 'KuCoin Event'],
+    }).to_csv(tmp_path / "Account History_Trading Account_2024.csv", index=False)
+    df = KucoinLoader.load(str(tmp_path))
+    assert df['type'].tolist() == [TransactionType.SPOT_TRADE, TransactionType.FEE, TransactionType.WITHDRAW, TransactionType.DEPOSIT]
+    assert df['amount'].tolist() == [0.501, -0.001, -100.0, 1.0]
+    assert df['datetime'].tolist() == [pd.Timestamp('2024-01-01 13:30:00', tz='UTC'), pd.Timestamp('2024-01-01 13:30:00', tz='UTC'),
+                                       pd.Timestamp('2024-01-03 04:30:00', tz='UTC'), pd.Timestamp('2024-01-03 05:30:00', tz='UTC')]
+    assert df['note'].iloc[1] == 'Remark=nan, Type=Spot, Side=Deposit, Fee'
+    assert (df['wallet'] == WalletType.SPOT).all() and (df['userId'] == 87654321).all()
+
+def test_BybitAssetChanges(tmp_path):
+    with open(tmp_path / "Bybit_AssetChangeDetails_uta_2024.csv", 'w', newline='') as f:
+        f.write("UID: 12345678,\n")
+        pd.DataFrame({
+            'Currency': ['BTC', 'USDT', 'ETH'],
+            'Contract': ['BTCUSDT', 'BTCUSDT', 'ETHBTC'],
+            'Type': ['TRADE', 'TRADE', 'TRADE'],
+            'Direction': ['BUY', 'SELL', 'BUY'],
+            'Filled Price': [40000.0, 40000.0, 0.05],
+            'Fee Paid': [-0.0001, 0.0, 0.0],
+            'Cash Flow': [0.1, -4000.0, 1.0],
+            'Time(UTC)': ['2024-01-01 10:00:00'] * 3,
+        }).to_csv(f, index=False)
+    with open(tmp_path / "Bybit_AssetChangeDetails_fund_2024.csv", 'w', newline='') as f:
+        f.write("UID: 12345678,\n")
+        pd.DataFrame({
+            'Date & Time(UTC)': ['2024-01-02 10:00:00', '2024-01-03 10:00:00'],
+            'Coin': ['USDT', 'USDT'],
+            'QTY': [-500.0, 1.5],
+            'Description': [None, 'Flexible Savings Interest Distribution'],
+            'Type': ['Earn', 'Other'],
+        }).to_csv(f, index=False)
+    df = BybitLoader.load(str(tmp_path)).sort_values('datetime', kind='stable', ignore_index=True)
+    assert df['type'].tolist() == [TransactionType.SPOT_TRADE, TransactionType.FEE, TransactionType.SPOT_TRADE, TransactionType.SPOT_TRADE,
+                                   TransactionType.SAVING_PURCHASE, TransactionType.SAVING_PURCHASE, TransactionType.SAVING_INTEREST]
+    # Only the non stablecoin side of a stablecoin pair has a price
+    assert df['price_USD'].iloc[:4].tolist()[:2] == [40000.0, 40000.0] and df['price_USD'].iloc[2:4].isna().all()
+    assert df['amount_USD'].iloc[1] == pytest.approx(-4.0)
+    assert df['wallet'].iloc[4:6].tolist() == [WalletType.FUNDING, WalletType.SAVING]
+    assert df['amount'].iloc[4:6].tolist() == [-500.0, 500.0]
+    assert df['note'].iloc[5] == 'Description=nan, Type=Earn, Move to SAVING wallet, Transaction not from Bybit'
+    assert (df['userId'] == '12345678').all()
+
+def test_LedgerOperations(tmp_path):
+    operations = pd.DataFrame({
+        'Operation Date': ['2024-01-01T10:00:00.000Z', '2024-01-02T10:00:00.000Z', '2024-01-02T10:00:00.000Z', '2024-01-03T10:00:00.000Z', '2024-01-04T10:00:00.000Z'],
+        'Status': ['Confirmed', 'Confirmed', 'Confirmed', 'Failed', 'Confirmed'],
+        'Currency Ticker': ['ETH', 'ETH', 'ETH', 'ETH', 'ETH'],
+        'Operation Type': ['IN', 'OUT', 'FEES', 'OUT', 'NFT_IN'],
+        'Operation Amount': [1.0, 0.5, 0.001, 0.2, 1.0],
+        'Operation Hash': ['0x1', '0x2', '0x2', '0x3', '0x4'],
+        'Account Name': 'Ethereum 1',
+        'Account xpub': '0xabc',
+    })
+    filepath = str(tmp_path / "ledger.csv")
+    operations.to_csv(filepath, index=False)
+    df = LedgerLoader.load(filepath)
+    assert df['type'].tolist() == [TransactionType.DEPOSIT, TransactionType.WITHDRAW, TransactionType.FEE]
+    assert df['amount'].tolist() == [1.0, -0.5, -0.001]
+    assert df['note'].tolist() == ['Operation Hash=0x1', 'Operation Hash=0x2', 'Operation Hash=0x2']
+    assert (df['userId'] == 'Ethereum 1 - 0xabc').all()
+    assert df['datetime'].iloc[0] == pd.Timestamp('2024-01-01 10:00:00', tz='UTC')
+
+    operations.loc[3, 'Status'] = 'Pending'
+    operations.to_csv(filepath, index=False)
+    with pytest.raises(Exception, match="'Pending' is unknown"):
+        LedgerLoader.load(filepath)
+
+def test_BybitLocalTime(tmp_path, monkeypatch):
+    import time
+    # The times are read in the local timezone, as the databases were built with
+    monkeypatch.setenv('TZ', 'Europe/Paris')
+    time.tzset()
+    try:
+        with open(tmp_path / "Bybit_AssetChangeDetails_fund_2024.csv", 'w', newline='') as f:
+            f.write("UID: 12345678,\n")
+            pd.DataFrame({
+                'Date & Time(UTC)': ['2024-01-02 10:00:00', '2024-07-02 10:00:00'],
+                'Coin': ['USDT', 'USDT'],
+                'QTY': [-500.0, -100.0],
+                'Description': [None, None],  # All missing, a float column
+                'Type': ['Earn', 'Earn'],
+            }).to_csv(f, index=False)
+        df = BybitLoader.load(str(tmp_path))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert df['type'].tolist() == [TransactionType.SAVING_PURCHASE] * 4
+    assert df['datetime'].tolist() == [pd.Timestamp('2024-01-02 09:00:00', tz='UTC')] * 2 + [pd.Timestamp('2024-07-02 08:00:00', tz='UTC')] * 2
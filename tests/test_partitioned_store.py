@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from CryptoWallet.PartitionedStore import PartitionedStore
+from CryptoWallet.Transaction import WalletType
+from CryptoWallet.Wallet import Wallet
+from tests.test_sqlite_store import randomTransactions
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "transactions.parquet")
+    wallet = Wallet(apiKey="key", databaseFilename=filename)  # All the prices are known, no API request
+    wallet.transactions = randomTransactions(3000)
+    wallet.save()
+    return filename, wallet.transactions
+
+def test_roundTrip(database):
+    filename, transactions = database
+    reopened = Wallet(databaseFilename=filename)
+    pd.testing.assert_frame_equal(reopened.transactions, transactions, check_like=True)
+    assert sorted(PartitionedStore(filename).manifest()['partitions']) == [f"year={year}/exchange={exchange}"
+                                                                           for year in range(2019, 2024) for exchange in ['Binance', 'Kucoin']]
+
+def test_outOfCoreGetters(database):
+    filename, transactions = database
+    inMemory = Wallet(databaseFilename=filename)
+    lazy = Wallet(databaseFilename=filename, lazy=True)
+    for getter in ['getAmountTotByAsset', 'getCostTot', 'getFeesTot', 'getInterestsTot', 'getAmountSpot', 'getCoinsStats', 'getHistoricalAmounts']:
+        expected, result = getattr(inMemory, getter)(), getattr(lazy, getter)()
+        if isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(result, expected, check_exact=False, rtol=1e-9)
+        else:
+            pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9, atol=1e-9)
+    pd.testing.assert_frame_equal(lazy.getHistoricalAmounts(freq='M', by='wallet'), inMemory.getHistoricalAmounts(freq='M', by='wallet'),
+                                  check_exact=False, rtol=1e-9, atol=1e-9)
+    result = lazy.query('2020-03-01', '2021-01-01', exchange='Kucoin', wallet=WalletType.STAKING)
+    expected = inMemory.query('2020-03-01', '2021-01-01', exchange='Kucoin', wallet=WalletType.STAKING)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_like=True)
+    assert lazy.outOfCore
+
+def test_prunedProjectedScan(database, monkeypatch):
+    filename, transactions = database
+    store = PartitionedStore(filename)
+    reads = []
+    import pyarrow.parquet as pq
+    readTable = pq.read_table
+    monkeypatch.setattr(pq, 'read_table', lambda path, columns = None: reads.append((os.path.relpath(path, filename), columns)) or readTable(path, columns=columns))
+    amounts = store.aggregate('asset', ['amount'], start='2021-01-01', end='2022-01-01', exchange='Binance')
+    assert reads == [(os.path.join('year=2021', 'exchange=Binance', 'part-1.parquet'), ['asset', 'amount', 'exchange', 'datetime'])]
+    expected = transactions[(transactions['datetime'].dt.year == 2021) & (transactions['exchange'] == 'Binance')].groupby('asset')['amount'].sum()
+    pd.testing.assert_series_equal(amounts['amount'], expected, check_exact=False, rtol=1e-9)
+
+def test_saveRewritesChangedPartitions(database):
+    filename, transactions = database
+    wallet = Wallet(apiKey="key", databaseFilename=filename)
+    before = PartitionedStore(filename).manifest()['partitions']
+    changed = wallet.transactions.copy()
+    is2022 = changed['datetime'].dt.year == 2022
+    changed.loc[is2022, 'price_USD'] += 1
+    changed['amount_USD'] = changed['amount'] * changed['price_USD']
+    wallet.transactions = changed
+    wallet.save()
+    after = PartitionedStore(filename).manifest()['partitions']
+    assert {key for key in after if after[key]['file'] != before[key]['file']} == {'year=2022/exchange=Binance', 'year=2022/exchange=Kucoin'}
+    pd.testing.assert_frame_equal(Wallet(databaseFilename=filename).transactions, changed.sort_values('datetime', kind='stable').reset_index(drop=True),
+                                  check_like=True)
+
+def test_missingPyarrow(tmp_path, monkeypatch):
+    import sys
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)  # import pyarrow raises ImportError
+    with pytest.raises(ImportError, match=r"CryptoWallet\[parquet\]"):
+        PartitionedStore(str(tmp_path / "transactions.parquet")).write(randomTransactions(10))
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+from CryptoWallet.PricePanel import PricePanel
+from CryptoWallet.StubServer import CryptoCompareStubServer
+from CryptoWallet.Transport import HttpTransport
+
+def dailyPrices(start, days, base):
+    return pd.Series(base + np.arange(days, dtype=float), index=pd.date_range(start, periods=days, freq='D', tz='UTC'))
+
+def test_updateAndRead(tmp_path):
+    writer = PricePanel(str(tmp_path))
+    writer.update('BTC', dailyPrices('2024-01-01', 10, 100))
+    reader = PricePanel(str(tmp_path))
+    assert reader.prices()['BTC'].tolist() == list(100 + np.arange(10.0))
+
+    # New days are written in a new data file, the map of the reader stays valid until it reloads
+    dataFilename = writer.dataFilename
+    mapped = reader.prices()
+    writer.update('BTC', dailyPrices('2024-01-11', 5, 110))
+    assert writer.dataFilename != dataFilename
+    assert mapped['BTC'].tolist() == list(100 + np.arange(10.0))
+    # A new asset fills a free column in place
+    dataFilename = writer.dataFilename
+    writer.update('ETH', dailyPrices('2024-01-05', 3, 10))
+    assert writer.dataFilename == dataFilename
+    reader.reload()
+    prices = reader.prices()
+    assert prices.shape == (15, 2)
+    assert prices['BTC'].tolist() == list(100 + np.arange(15.0))
+    assert prices['ETH'].dropna().index.equals(pd.date_range('2024-01-05', periods=3, freq='D', tz='UTC', name='time'))
+    assert np.shares_memory(prices.to_numpy(), reader.array)
+
+    # Older prices rewrite the data file too
+    writer.update('ETH', dailyPrices('2023-12-30', 2, 8))
+    reader.reload()
+    assert reader.dataFilename != dataFilename
+    assert reader.prices(['ETH'], start='2023-12-30', end='2023-12-31')['ETH'].tolist() == [8.0, 9.0]
+    assert reader.prices(['BTC'], start='2024-01-01', end='2024-01-01')['BTC'].tolist() == [100.0]
+
+def test_previousFileInUse(tmp_path, monkeypatch):
+    # On Windows, a data file mapped by a reader can't be deleted: it is kept and deleted by a later rewrite
+    panel = PricePanel(str(tmp_path))
+    panel.update('BTC', dailyPrices('2024-01-01', 3, 100))
+    firstFilename = panel.dataFilename
+    def denyRemove(filename):
+        raise PermissionError(filename)
+    with monkeypatch.context() as m:
+        m.setattr(os, 'remove', denyRemove)
+        panel.update('BTC', dailyPrices('2024-01-04', 1, 103))
+    assert os.path.exists(firstFilename)
+    panel.update('BTC', dailyPrices('2024-01-05', 1, 104))
+    assert [os.path.basename(panel.dataFilename)] == [filename for filename in os.listdir(tmp_path) if filename.endswith('.f64')]
+    assert PricePanel(str(tmp_path)).prices()['BTC'].tolist() == list(100 + np.arange(5.0))
+
+def test_assetCapacity(tmp_path):
+    panel = PricePanel(str(tmp_path))
+    for i in range(PricePanel.AssetCapacityStep + 1):
+        panel.update(f"COIN{i}", dailyPrices('2024-01-01', 3, i))
+    prices = PricePanel(str(tmp_path)).prices()
+    assert prices.shape == (3, PricePanel.AssetCapacityStep + 1)
+    assert prices.iloc[0].tolist() == list(np.arange(PricePanel.AssetCapacityStep + 1.0))
+
+def test_requestDailyHistoricalPrices(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The prices are stored in ./data
+    monkeypatch.setattr(CryptoCompareWrapper, 'pricePanel', None)
+    with CryptoCompareStubServer() as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        try:
+            data = CryptoCompareWrapper.requestDailyHistoricalPrices('BTC', "key")
+        finally:
+            CryptoCompareWrapper.setTransport(previous)
+    prices = PricePanel().prices(['BTC'])['BTC'].dropna()
+    assert np.allclose(prices.to_numpy(), data['close'].to_numpy())
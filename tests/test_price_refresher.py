@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+from CryptoWallet.PriceRefresher import PriceRefresher
+from CryptoWallet.StubServer import CryptoCompareStubServer
+from CryptoWallet.Transaction import TransactionType, WalletType
+from CryptoWallet.Transport import HttpTransport
+from CryptoWallet.Wallet import Wallet
+
+@pytest.fixture
+def stubServer():
+    with CryptoCompareStubServer() as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        yield server
+        CryptoCompareWrapper.setTransport(previous)
+
+class FailingTransport:
+    # Any request fails the test
+    def get(self, *args, **kwargs):
+        pytest.fail("Unexpected request to the API")
+
+    def session(self, *args, **kwargs):
+        pytest.fail("Unexpected request to the API")
+
+def walletWithAssets(tmp_path, assets):
+    wallet = Wallet(apiKey="key")
+    wallet.cacheFilename = str(tmp_path / "currentPriceCache.pkl")
+    wallet.transactions = pd.DataFrame({
+        'datetime': pd.to_datetime(['2024-01-01'] * len(assets), utc=True), 'asset': assets, 'amount': 1.0,
+        'type': TransactionType.DEPOSIT, 'exchange': 'Binance', 'userId': '1', 'wallet': WalletType.SPOT, 'note': '',
+        'price_USD': 1.0, 'amount_USD': 1.0,
+    })
+    return wallet
+
+def test_refreshPublishesNewSnapshot(stubServer):
+    refresher = PriceRefresher(['BTC', 'ETH'], "key", initialPrices={'BTC': 1.0, 'OLD': 2.0})
+    snapshots = []
+    callback = refresher.subscribe(snapshots.append)
+    previous = refresher.snapshot
+    snapshot = refresher.refresh()
+    # The previous snapshot is left untouched, the new one is published as a whole
+    assert previous.prices.to_dict() == {'BTC': 1.0, 'OLD': 2.0}
+    assert refresher.snapshot is snapshot and snapshot is not previous
+    assert snapshot.timestamp > previous.timestamp
+    assert snapshot.prices['BTC'] != 1.0 and snapshot.prices['OLD'] == 2.0 and not np.isnan(snapshot.prices['ETH'])
+    assert snapshots == [snapshot]
+    refresher.unsubscribe(callback)
+    refresher.refresh()
+    assert len(snapshots) == 1
+
+def test_getCurrentPricesFromSnapshot(stubServer, tmp_path):
+    wallet = walletWithAssets(tmp_path, ['BTC', 'ETH'])
+    wallet.cache = {'BTC': {'value': 30000.0, 'timestamp': time.time()}, 'ETH': {'value': 2000.0, 'timestamp': time.time()}}
+    refresher = wallet.startPriceRefresher(interval=3600)
+    previous = CryptoCompareWrapper.setTransport(FailingTransport())
+    try:
+        start = time.perf_counter()
+        prices = wallet.getCurrentPrices()
+        assert time.perf_counter() - start < 0.5
+    finally:
+        CryptoCompareWrapper.setTransport(previous)
+        wallet.stopPriceRefresher()
+    assert prices.to_dict() == {'BTC': 30000.0, 'ETH': 2000.0}
+    assert not refresher.isRunning()
+
+def test_refreshOnNewAsset(stubServer, tmp_path):
+    wallet = walletWithAssets(tmp_path, ['BTC'])
+    wallet.cache = {'BTC': {'value': 30000.0, 'timestamp': time.time()}}
+    refresher = wallet.startPriceRefresher(interval=3600)
+    refreshed = threading.Event()
+    refresher.subscribe(lambda snapshot: refreshed.set())
+    try:
+        wallet.transactions = pd.concat([wallet.transactions, wallet.transactions.assign(asset='ETH')], ignore_index=True)
+        assert np.isnan(wallet.getCurrentPrices()['ETH'])  # Served immediately, fetched in the background
+        assert refreshed.wait(10)
+        assert not np.isnan(wallet.getCurrentPrices()['ETH'])
+    finally:
+        wallet.stopPriceRefresher()
+
+def test_stopJoinsThread(stubServer):
+    refresher = PriceRefresher(['BTC'], "key", interval=3600, initialTimestamp=time.time())
+    refresher.start()
+    thread = refresher._thread
+    assert refresher.isRunning()
+    refresher.stop(timeout=5)
+    assert not thread.is_alive() and not refresher.isRunning()
+
+def test_walletCollectedWhileRefreshing(stubServer, tmp_path):
+    import gc
+    import weakref
+    wallet = walletWithAssets(tmp_path, ['BTC'])
+    wallet.cache = {'BTC': {'value': 30000.0, 'timestamp': time.time()}}
+    refresher = wallet.startPriceRefresher(interval=3600)
+    # The assets are given to the refresher when the transactions are replaced
+    wallet.transactions = pd.concat([wallet.transactions, wallet.transactions.assign(asset='ETH')], ignore_index=True)
+    assert set(refresher.assets) == {'BTC', 'ETH'}
+    walletRef = weakref.ref(wallet)
+    del wallet
+    gc.collect()
+    assert walletRef() is None
+    assert not refresher.isRunning()
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from CryptoWallet.SqliteStore import SqliteStore
+from CryptoWallet.Transaction import TransactionType, WalletType
+from CryptoWallet.Wallet import Wallet
+
+def randomTransactions(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    transactions = pd.DataFrame({
+        'datetime': pd.to_datetime(rng.integers(1546300800, 1704067200, n), unit='s', utc=True),
+        'asset': rng.choice(['BTC', 'ETH', 'ADA', 'USDT'], n),
+        'amount': rng.normal(0, 10, n).round(6),
+        'type': rng.choice([TransactionType.SPOT_TRADE, TransactionType.STAKING_INTEREST, TransactionType.FEE, TransactionType.DEPOSIT], n),
+        'exchange': rng.choice(['Binance', 'Kucoin'], n),
+        'userId': rng.choice(['1', '2'], n),
+        'wallet': rng.choice([WalletType.SPOT, WalletType.STAKING], n),
+        'note': rng.choice(['', 'note'], n),
+        'price_USD': rng.uniform(1, 100, n),
+    })
+    transactions['amount_USD'] = transactions['amount'] * transactions['price_USD']
+    return transactions.sort_values('datetime', kind='stable').reset_index(drop=True)
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "transactions.db")
+    wallet = Wallet(apiKey="key", databaseFilename=filename)  # All the prices are known, no API request
+    wallet.transactions = randomTransactions(3000)
+    wallet.save()
+    return filename, wallet.transactions
+
+def test_roundTrip(database):
+    filename, transactions = database
+    reopened = Wallet(databaseFilename=filename)
+    pd.testing.assert_frame_equal(reopened.transactions, transactions, check_like=True)
+
+def test_outOfCoreGetters(database):
+    filename, transactions = database
+    inMemory = Wallet(databaseFilename=filename)
+    lazy = Wallet(databaseFilename=filename, lazy=True)
+    assert lazy.outOfCore
+    for getter in ['getAmountTotByAsset', 'getCostTot', 'getFeesTot', 'getInterestsTot', 'getAmountSpot', 'getAmountStaking', 'getCoinsStats', 'getHistoricalAmounts']:
+        expected, result = getattr(inMemory, getter)(), getattr(lazy, getter)()
+        if isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(result, expected, check_exact=False, rtol=1e-9)
+        else:
+            pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9, atol=1e-9)
+    result = lazy.query('2020-01-01', '2021-01-01', asset=['BTC', 'ETH'], wallet=WalletType.STAKING)
+    expected = inMemory.query('2020-01-01', '2021-01-01', asset=['BTC', 'ETH'], wallet=WalletType.STAKING)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_like=True)
+    assert lazy.outOfCore  # Nothing was read in memory
+
+def test_incrementalSave(database):
+    filename, transactions = database
+    wallet = Wallet(apiKey="key", databaseFilename=filename)
+    # Remove rows, update prices and add rows, including a duplicate of an existing transaction
+    updated = wallet.transactions.drop(index=range(10)).copy()
+    updated.loc[100:199, 'price_USD'] *= 2
+    updated['amount_USD'] = updated['amount'] * updated['price_USD']
+    added = pd.concat([randomTransactions(50, seed=1), transactions.iloc[[500]]], ignore_index=True)
+    wallet.transactions = pd.concat([updated, added], ignore_index=True).sort_values('datetime', kind='stable')
+    wallet.save()
+    pd.testing.assert_frame_equal(SqliteStore(filename).read().sort_values(['datetime', 'amount']).reset_index(drop=True),
+                                  wallet.transactions.sort_values(['datetime', 'amount']).reset_index(drop=True), check_like=True)
+    assert SqliteStore(filename).version() == 2
@@ -0,0 +1,95 @@
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from CryptoWallet.Storage import FileLock, atomicWrite
+from CryptoWallet.Transaction import TransactionType, WalletType
+from CryptoWallet.Wallet import Wallet
+
+def test_atomicWrite(tmp_path):
+    filename = str(tmp_path / "file.txt")
+    with atomicWrite(filename) as f:
+        f.write("first")
+    # On error the previous version is kept, and no temporary file is left
+    with pytest.raises(RuntimeError):
+        with atomicWrite(filename) as f:
+            f.write("partial")
+            raise RuntimeError()
+    assert open(filename).read() == "first"
+    assert [path.name for path in tmp_path.iterdir()] == ["file.txt"]
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="POSIX permissions")
+def test_atomicWritePermissions(tmp_path, monkeypatch):
+    import os
+    previous = os.umask(0o027)
+    try:
+        # The umask of the process is never changed, other threads may create files meanwhile
+        monkeypatch.setattr(os, 'umask', lambda mask: pytest.fail("umask changed"))
+        filename = str(tmp_path / "file.txt")
+        with atomicWrite(filename) as f:
+            f.write("new")
+        assert os.stat(filename).st_mode & 0o777 == 0o640
+        os.chmod(filename, 0o600)
+        with atomicWrite(filename) as f:
+            f.write("replaced")
+        assert os.stat(filename).st_mode & 0o777 == 0o600
+    finally:
+        monkeypatch.undo()
+        os.umask(previous)
+
+def test_fileLockExcludesOtherProcesses(tmp_path):
+    filename = str(tmp_path / "database.csv")
+    holder = subprocess.Popen([sys.executable, '-c', f"""
+from CryptoWallet.Storage import FileLock
+import time
+with FileLock({filename!r}):
+    print('locked', flush=True)
+    time.sleep(1)
+"""], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        with pytest.raises(TimeoutError):
+            FileLock(filename, timeout=0.1).acquire()
+        start = time.monotonic()
+        with FileLock(filename, timeout=10) as lock:
+            assert lock.locked
+        assert time.monotonic() - start > 0.2
+    finally:
+        holder.wait()
+    # Shared locks do not exclude each other
+    with FileLock(filename, shared=True), FileLock(filename, shared=True, timeout=0):
+        pass
+
+def test_saveRejectsConcurrentWriter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "transactions.csv")
+    rows = pd.DataFrame({
+        'datetime': pd.date_range('2024-01-01', periods=3, freq='D', tz='UTC'), 'asset': 'BTC', 'amount': 1.0,
+        'type': TransactionType.DEPOSIT, 'exchange': 'Binance', 'userId': '1', 'wallet': WalletType.SPOT, 'note': '',
+        'price_USD': 40000.0, 'amount_USD': 40000.0,
+    })
+    first = Wallet(apiKey="key", databaseFilename=filename)
+    first.transactions = rows
+    first.save()
+    second = Wallet(apiKey="key", databaseFilename=filename)
+    first.save()  # The same process saves again
+    with pytest.raises(Exception, match="modified by another process"):
+        second.save()
+    second.open(filename)
+    second.save()
+
+def test_saveCacheMergesProcesses(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first, second = Wallet(), Wallet()
+    # Resolved at construction, so that the cache saved at garbage collection stays in tmp_path after the test
+    assert second.cacheFilename == str(tmp_path / ".CryptoWallet" / "currentPriceCache.pkl")
+    first.cache = {'BTC': {'value': 40000.0, 'timestamp': 10.0}, 'ETH': {'value': 2000.0, 'timestamp': 10.0}}
+    first.saveCache()
+    second.cache = {'BTC': {'value': 41000.0, 'timestamp': 20.0}, 'ETH': {'value': 1900.0, 'timestamp': 5.0}}
+    second.saveCache()
+    assert Wallet.readCache(second.cacheFilename) == {'BTC': {'value': 41000.0, 'timestamp': 20.0}, 'ETH': {'value': 2000.0, 'timestamp': 10.0}}
+    assert np.isclose(second.cache['ETH']['value'], 2000.0)
@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from CryptoWallet.Transaction import TransactionType, WalletType
+from CryptoWallet.TaxReport import DisposalLedger
+from CryptoWallet.Wallet import Wallet
+
+@pytest.fixture
+def wallet(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The wallet stores its price cache in the working directory
+    rng = np.random.default_rng(0)
+    n = 2000
+    wallet = Wallet()
+    wallet.transactions = pd.DataFrame({
+        'datetime': pd.to_datetime(rng.integers(1546300800, 1704067200, n), unit='s', utc=True),
+        'asset': rng.choice(['BTC', 'ETH', 'ADA', 'USDT'], n),
+        'amount': rng.normal(0, 10, n),
+        'type': rng.choice([TransactionType.SPOT_TRADE, TransactionType.STAKING_INTEREST, TransactionType.DEPOSIT], n),
+        'exchange': rng.choice(['Binance', 'Kucoin'], n),
+        'userId': rng.choice(['1', '2'], n),
+        'wallet': rng.choice([WalletType.SPOT, WalletType.STAKING], n),
+        'note': '',
+        'price_USD': rng.uniform(1, 100, n),
+        'amount_USD': np.nan,
+    })
+    return wallet
+
+def test_query(wallet):
+    df = wallet.transactions
+    result = wallet.query('2023-01-01', '2024-01-01', asset='ETH', wallet=WalletType.STAKING)
+    expected = df[(df['datetime'] >= pd.Timestamp('2023-01-01', tz='UTC')) & (df['datetime'] < pd.Timestamp('2024-01-01', tz='UTC'))
+                  & (df['asset'] == 'ETH') & (df['wallet'] == WalletType.STAKING)].sort_values('datetime', kind='stable')
+    pd.testing.assert_frame_equal(result, expected)
+
+    result = wallet.query(asset=['BTC', 'ADA'], exchange='Kucoin')
+    expected = df[df['asset'].isin(['BTC', 'ADA']) & (df['exchange'] == 'Kucoin')].sort_values('datetime', kind='stable')
+    pd.testing.assert_frame_equal(result, expected)
+
+    assert wallet.query(asset='UNKNOWN').empty
+    assert wallet.query().index.equals(df.sort_values('datetime', kind='stable').index)
+    with pytest.raises(KeyError):
+        wallet.transactionIndex.positions(note='')
+
+def test_queryAfterTransactionsReplaced(wallet):
+    assert len(wallet.query(asset='BTC')) > 0
+    wallet.transactions = wallet.transactions[wallet.transactions['asset'] != 'BTC']
+    assert wallet.query(asset='BTC').empty
+
+def test_getHistoricalAmounts(wallet):
+    holdings = wallet.getHistoricalAmounts()
+    single = wallet.get_historical_amount('ETH')
+    eth = holdings['ETH'][holdings.index >= single['timestamp'].iloc[0]]
+    assert np.allclose(eth.to_numpy(), single['amount'].to_numpy())
+
+    byWallet = wallet.getHistoricalAmounts(assets=['BTC'], freq='W', by='wallet')
+    weekly = wallet.getHistoricalAmounts(freq='W')
+    assert np.allclose(byWallet.T.groupby(level='asset').sum().T['BTC'], weekly['BTC'])
+
+@pytest.mark.parametrize('freq', ['h', 'D', 'W'])
+def test_getHistoricalAmountsIncremental(wallet, freq):
+    transactions = wallet.transactions.sort_values('datetime')
+    wallet.transactions = transactions.iloc[:1500]
+    wallet.getHistoricalAmounts(freq=freq, by='exchange')
+    # New transactions, some in the last cached period, and a new asset
+    added = transactions.iloc[1500:].copy()
+    added.loc[added.index[-10:], 'asset'] = 'SOL'
+    wallet.transactions = pd.concat([wallet.transactions, added])
+    extended = wallet.getHistoricalAmounts(freq=freq, by='exchange')
+    wallet.invalidateTransactionIndex()
+    computed = wallet.getHistoricalAmounts(freq=freq, by='exchange')
+    pd.testing.assert_frame_equal(extended, computed[extended.columns], check_exact=False)
+    assert set(extended.columns) == set(computed.columns)
+
+    # A transaction before the last period modified, or replaced by another one: the holdings are computed again
+    first = wallet.transactions.index[0]
+    for modified in [wallet.transactions.assign(amount=wallet.transactions['amount'].where(wallet.transactions.index != first, 1000.0)),
+                     pd.concat([wallet.transactions.drop(first), wallet.transactions.loc[[first]].assign(asset='DOT')])]:
+        wallet.transactions = modified.sort_values('datetime', kind='stable')
+        holdings = wallet.getHistoricalAmounts(freq=freq, by='exchange')
+        wallet.invalidateTransactionIndex()
+        pd.testing.assert_frame_equal(holdings, wallet.getHistoricalAmounts(freq=freq, by='exchange'), check_exact=False)
+
+def taxWallet(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rows = [
+        ('2020-01-01', 'BTC', 1.0, TransactionType.SPOT_TRADE, 100.0),
+        ('2020-01-01', 'USD', -100.0, TransactionType.SPOT_TRADE, 1.0),
+        ('2021-06-01', 'BTC', 1.0, TransactionType.SPOT_TRADE, 200.0),
+        ('2021-07-01', 'BTC', -1.0, TransactionType.SAVING_PURCHASE, 250.0),  # Moves between the wallets are not disposals
+        ('2021-07-01', 'BTC', 1.0, TransactionType.SAVING_PURCHASE, 250.0),
+        ('2021-12-01', 'BTC', -1.5, TransactionType.SPOT_TRADE, 300.0),
+        ('2022-01-10', 'BTC', 0.1, TransactionType.SAVING_INTEREST, 300.0),
+        ('2022-02-01', 'BTC', -0.01, TransactionType.FEE, 300.0),
+    ]
+    wallet = Wallet()
+    wallet.transactions = pd.DataFrame({
+        'datetime': pd.to_datetime([r[0] for r in rows], utc=True),
+        'asset': [r[1] for r in rows],
+        'amount': [r[2] for r in rows],
+        'type': [r[3] for r in rows],
+        'price_USD': [r[4] for r in rows],
+    })
+    return wallet
+
+def test_getTaxReport(tmp_path, monkeypatch):
+    wallet = taxWallet(tmp_path, monkeypatch)
+    report = wallet.getTaxReport('US')
+    assert list(report.index) == [2021, 2022]
+    assert report.loc[2021, 'gain_long_USD'] == pytest.approx(200)
+    assert report.loc[2021, 'gain_short_USD'] == pytest.approx(50)
+    assert report.loc[2022, 'income_USD'] == pytest.approx(30)
+    assert report.loc[2022, 'fees_USD'] == pytest.approx(3)
+    assert report.loc[2022, 'gain_short_USD'] == pytest.approx(1)
+    assert report['taxable_income_USD'].sum() == pytest.approx(30)
+
+    assert wallet.getTaxReport('DE').loc[2021, 'taxable_gain_USD'] == pytest.approx(50)
+    assert wallet.getTaxReport('CH')['taxable_gain_USD'].sum() == 0
+    uk = wallet.getTaxReport('UK')
+    assert list(uk.index) == ['2021/2022']
+    # Average cost of the pool: 2 BTC for 300 USD, then 0.6 BTC for 105 USD after the sale and the interest
+    assert uk.loc['2021/2022', 'gain_short_USD'] == pytest.approx((450 - 225) + (3 - 0.01 * 105 / 0.6))
+
+def test_getTaxReportIncremental(tmp_path, monkeypatch):
+    wallet = taxWallet(tmp_path, monkeypatch)
+    transactions = wallet.transactions
+    wallet.transactions = transactions.iloc[:6]
+    wallet.getTaxReport('US')
+    ledger = wallet._disposalLedgers['FIFO']
+    wallet.transactions = transactions
+    extended = wallet.getTaxReport('US')
+    assert len(ledger.events) == 4  # The sale of two lots, the interest and the fee
+    # Modifying a price before the end of the ledger rebuilds it
+    wallet.transactions = transactions.assign(price_USD=transactions['price_USD'].where(transactions.index != 5, 400.0))
+    assert wallet.getTaxReport('US').loc[2021, 'gain_long_USD'] == pytest.approx(300)
+    wallet.transactions = transactions
+    pd.testing.assert_frame_equal(wallet.getTaxReport('US'), extended)
+    # Moving a transaction in time, or changing its asset or type, keeps the count and sums of the rows but rebuilds it too
+    for column, value in (('datetime', transactions['datetime'].iloc[2] - pd.Timedelta(days=400)), ('asset', 'ETH'), ('type', TransactionType.DEPOSIT)):
+        modified = transactions.copy()
+        modified.loc[modified.index[2], column] = value
+        ledger.update(transactions)
+        ledger.update(modified)
+        expected = DisposalLedger('FIFO', Wallet.Fiats)
+        expected.update(modified)
+        pd.testing.assert_frame_equal(ledger.events, expected.events)
+
+def test_getCostTotInCurrency(wallet, tmp_path, monkeypatch):
+    from CryptoWallet.CryptoCompareWrapper import CryptoCompareWrapper
+    from CryptoWallet.StubServer import CryptoCompareStubServer
+    from CryptoWallet.Transport import HttpTransport
+    monkeypatch.setattr(CryptoCompareWrapper, 'pricePanel', None)
+    wallet.apiKey = "key"
+    wallet.transactions['amount_USD'] = wallet.transactions['amount'] * wallet.transactions['price_USD']
+    with CryptoCompareStubServer() as server:
+        previous = CryptoCompareWrapper.setTransport(HttpTransport(baseUrl=server.url))
+        try:
+            costCHF = wallet.getCostTot('CHF')
+        finally:
+            CryptoCompareWrapper.setTransport(previous)
+    rates = wallet.getValuation('CHF').rates()
+    transactions = wallet.transactions[wallet.transactions['type'].isin([TransactionType.SPOT_TRADE, TransactionType.DEPOSIT])]
+    dayRates = rates.reindex(transactions['datetime'].dt.floor('D')).to_numpy()
+    expected = (transactions['amount_USD'] / dayRates).groupby(transactions['asset']).sum()
+    assert costCHF.name == 'cost_CHF'
+    assert np.allclose(costCHF.sort_index(), expected.sort_index())
+    assert wallet.getCostTot().name == 'cost_USD'
+
+def test_getInterestApr(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # 1000 ADA staked on the 1st of January, 1000 more on the 16th (half of the month), 10 ADA of interests in January
+    rows = [
+        ('2023-01-01', -1000.0, TransactionType.STAKING_PURCHASE, WalletType.SPOT),
+        ('2023-01-01', 1000.0, TransactionType.STAKING_PURCHASE, WalletType.STAKING),
+        ('2023-01-16 12:00', -1000.0, TransactionType.STAKING_PURCHASE, WalletType.SPOT),
+        ('2023-01-16 12:00', 1000.0, TransactionType.STAKING_PURCHASE, WalletType.STAKING),
+        ('2023-01-31', 10.0, TransactionType.STAKING_INTEREST, WalletType.SPOT),
+        ('2023-02-28', 14.0, TransactionType.STAKING_INTEREST, WalletType.SPOT),
+        # After the end of the analysis, ignored
+        ('2023-03-05', 5.0, TransactionType.STAKING_INTEREST, WalletType.SPOT),
+        ('2023-03-10', -2000.0, TransactionType.STAKING_REDEMPTION, WalletType.STAKING),
+        ('2023-03-10', 2000.0, TransactionType.STAKING_REDEMPTION, WalletType.SPOT),
+    ]
+    wallet = Wallet()
+    wallet.transactions = pd.DataFrame({
+        'datetime': pd.to_datetime([r[0] for r in rows], utc=True, format='ISO8601'),
+        'asset': 'ADA', 'amount': [r[1] for r in rows], 'type': [r[2] for r in rows],
+        'exchange': 'Binance', 'userId': '1', 'wallet': [r[3] for r in rows], 'amount_USD': [r[1] * 0.5 for r in rows],
+    })
+    apr = wallet.getInterestApr(freq='M', end='2023-03-01')
+    january = apr.loc[(pd.Period('2023-01', 'M'), 'Binance', 'ADA', WalletType.STAKING)]
+    assert january['average_balance'] == pytest.approx(1500)
+    assert january['apr'] == pytest.approx(10 / 1500 * 365.25 / 31)
+    february = apr.loc[(pd.Period('2023-02', 'M'), 'Binance', 'ADA', WalletType.STAKING)]
+    assert february['average_balance'] == pytest.approx(2000)
+    assert february['cumulative_apr'] == pytest.approx(24 / (1500 * 31 + 2000 * 28) * 365.25)
+    assert february['interest_USD'] == pytest.approx(7)
+    assert apr.index.get_level_values('period').max() == pd.Period('2023-02', 'M')
+
+def test_compactInterestRows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    days = pd.date_range('2023-01-01 01:00', periods=365, freq='D', tz='UTC')
+    interests = pd.DataFrame({
+        'datetime': days.repeat(2), 'asset': ['BTC', 'ETH'] * 365, 'amount': 0.001, 'type': TransactionType.SAVING_INTEREST,
+        'exchange': 'Binance', 'userId': '1', 'wallet': WalletType.SPOT, 'note': '', 'price_USD': np.tile([30000.0, 2000.0], 365),
+    })
+    interests['amount_USD'] = interests['amount'] * interests['price_USD']
+    trade = pd.DataFrame([{'datetime': days[10], 'asset': 'BTC', 'amount': 1.0, 'type': TransactionType.SPOT_TRADE, 'exchange': 'Binance',
+                           'userId': '1', 'wallet': WalletType.SPOT, 'note': '', 'price_USD': 20000.0, 'amount_USD': 20000.0}])
+    wallet = Wallet(apiKey="key", databaseFilename=str(tmp_path / "transactions.csv"))  # All the prices are known, no API request
+    wallet.transactions = pd.concat([interests, trade], ignore_index=True).sort_values('datetime')
+    original = wallet.transactions.copy()
+
+    removed = wallet.compactInterestRows('M')
+    assert len(wallet.transactions) == 12 * 2 + 1
+    assert removed == len(original) - len(wallet.transactions)
+    assert np.allclose(wallet.getAmountTotByAsset(), original.groupby('asset')['amount'].sum())
+    assert wallet.transactions['amount_USD'].sum() == pytest.approx(original['amount_USD'].sum())
+    wallet.checkIntegrity()
+    assert wallet.compactInterestRows('M') == 0  # Already compacted
+
+    # The archive is saved with the database, and the raw rows are restored from it
+    wallet.save()
+    reopened = Wallet(databaseFilename=str(tmp_path / "transactions.csv"))
+    reopened.expandCompactedRows()
+    columns = ['datetime', 'asset', 'amount', 'type', 'price_USD']
+    pd.testing.assert_frame_equal(reopened.transactions[columns].sort_values(['datetime', 'asset']).reset_index(drop=True),
+                                  original[columns].sort_values(['datetime', 'asset']).reset_index(drop=True), check_dtype=False)
+    assert reopened.archive.empty
+
+def test_inferTradePrices():
+    time = pd.Timestamp('2024-01-01 10:00', tz='UTC')
+    rows = [
+        # Buy of BNB with USDT, with a fee in BNB
+        (time, 'BNB', 2.0, TransactionType.SPOT_TRADE, 'Binance', '1'),
+        (time, 'USDT', -600.0, TransactionType.SPOT_TRADE, 'Binance', '1'),
+        (time, 'BNB', -0.002, TransactionType.FEE, 'Binance', '1'),
+        # Sale of ETH for USD, in two fills
+        (time, 'ETH', -0.5, TransactionType.SPOT_TRADE, 'Kucoin', '2'),
+        (time, 'ETH', -1.5, TransactionType.SPOT_TRADE, 'Kucoin', '2'),
+        (time, 'USD', 4000.0, TransactionType.SPOT_TRADE, 'Kucoin', '2'),
+        # Crypto to crypto trade, no USD leg
+        (time, 'ADA', 100.0, TransactionType.SPOT_TRADE, 'Binance', '2'),
+        (time, 'BTC', -0.001, TransactionType.SPOT_TRADE, 'Binance', '2'),
+        # Buy of SOL with EUR, at the rate of EUR
+        (time, 'SOL', 10.0, TransactionType.SPOT_TRADE, 'Kraken', '3'),
+        (time, 'EUR', -900.0, TransactionType.SPOT_TRADE, 'Kraken', '3'),
+        # Buy of DOT with CHF, without rate of CHF
+        (time, 'DOT', 10.0, TransactionType.SPOT_TRADE, 'Kraken', '4'),
+        (time, 'CHF', -50.0, TransactionType.SPOT_TRADE, 'Kraken', '4'),
+    ]
+    class FixedRate:
+        def rateAt(self, datetimes):
+            return np.full(len(datetimes), 1.1)
+    class MissingRate:
+        def rateAt(self, datetimes):
+            raise Exception("No exchange rate of CHF in the price panel")
+    transactions = pd.DataFrame(rows, columns=['datetime', 'asset', 'amount', 'type', 'exchange', 'userId'])
+    transactions['price_USD'] = np.nan
+    transactions = Wallet.inferTradePrices(transactions, {'EUR': FixedRate(), 'CHF': MissingRate()})
+    # The USD, stablecoin and fiat legs get their own price, and are not requested to the API
+    assert transactions['price_USD'].tolist() == pytest.approx([300.0, 1.0, 300.0, 2000.0, 2000.0, 1.0, np.nan, np.nan, 99.0, 1.1, np.nan, np.nan], nan_ok=True)